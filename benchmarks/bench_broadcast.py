@@ -0,0 +1,125 @@
+"""
+Microbenchmark for fanning a room broadcast out to connected sockets.
+
+Compares the old delivery path, where every recipient's handler re-encoded
+the event with json.dumps, against the current one, where the sender encodes
+the frame once per available codec and handlers only queue it for the
+connection's writer task. Sockets are simulated by consumers whose ``send``
+does nothing, so the numbers are pure per-recipient CPU cost in the worker.
+
+    python benchmarks/bench_broadcast.py [--sockets 50] [--rounds 2000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'codecollabhub.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from projects import codecs  # noqa: E402
+from projects.consumers import CodeEditorConsumer, broadcast_event  # noqa: E402
+from projects.sendqueue import SendQueue  # noqa: E402
+
+
+class NullSocketConsumer(CodeEditorConsumer):
+    def __init__(self, channel_name):
+        super().__init__()
+        self.channel_name = channel_name
+        self.codec = codecs.JSON
+        self.subscriptions = {}
+
+    def open_outbox(self):
+        # Large enough that the benchmark never compacts
+        self.outbox = SendQueue(self.write_frame, self.refresh, limit=10**6, max_overflows=0)
+        self.outbox.start()
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        pass
+
+    # The handlers as they were before frames were encoded once
+    async def legacy_operation(self, event):
+        if event['sender'] == self.channel_name:
+            await self.send(text_data=json.dumps({'type': 'ack', 'revision': event['revision']}))
+        else:
+            await self.send(text_data=json.dumps({
+                'type': 'operation',
+                'operation': event['operation'],
+                'revision': event['revision'],
+                'user': event['user']
+            }))
+
+    async def legacy_presence(self, event):
+        await self.send(text_data=json.dumps({'type': 'presence', 'cursors': event['cursors']}))
+
+
+def sample_payloads():
+    operation = [1200, 'for item in items:\n    total += item.price * item.quantity\n', -3, 48000]
+    cursors = {
+        f'user{i}': {'lineNumber': 100 + i, 'column': 12}
+        for i in range(20)
+    }
+    return operation, cursors
+
+
+async def run(sockets, rounds):
+    consumers = [NullSocketConsumer(f'chan.{i}') for i in range(sockets)]
+    for consumer in consumers:
+        consumer.open_outbox()
+    sender = consumers[0].channel_name
+    operation, cursors = sample_payloads()
+
+    def legacy_events():
+        return [
+            ('legacy_operation', {'operation': operation, 'revision': 42, 'user': 'alice', 'sender': sender}),
+            ('legacy_presence', {'cursors': cursors}),
+        ]
+
+    def current_events():
+        # Encoding happens once per group send, so it is part of the cost
+        return [
+            ('broadcast', broadcast_event(
+                {'type': 'operation', 'operation': operation, 'revision': 42, 'user': 'alice'},
+                sender=sender,
+                ack={'type': 'ack', 'revision': 42}
+            )),
+            ('broadcast', broadcast_event({'type': 'presence', 'cursors': cursors})),
+        ]
+
+    results = {}
+    for label, make_events in [('per-recipient json.dumps', legacy_events), ('encode once', current_events)]:
+        started = time.process_time()
+        for _ in range(rounds):
+            for handler, event in make_events():
+                for consumer in consumers:
+                    await getattr(consumer, handler)(event)
+            # Let the writer tasks drain the queued frames
+            await asyncio.sleep(0)
+        elapsed = time.process_time() - started
+        deliveries = rounds * 2 * sockets
+        results[label] = elapsed / deliveries * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sockets', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.sockets, args.rounds))
+    print(f"{args.sockets} sockets, {args.rounds} rounds of one operation and one presence frame")
+    for label, micros in results.items():
+        print(f"  {label:<26} {micros:8.2f} us CPU per recipient")
+    before, after = results.values()
+    print(f"  speedup                    {before / after:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
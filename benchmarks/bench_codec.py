@@ -0,0 +1,65 @@
+"""
+Frame size and encode/decode throughput of the editor socket codecs.
+
+Runs every codec in projects.codecs over the frames the editor sends most
+often. MessagePack is skipped when the ``msgpack`` package is missing.
+
+    python benchmarks/bench_codec.py [--iterations 20000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from projects import codecs  # noqa: E402
+
+
+def sample_frames():
+    cursors = {f'user{i}': {'lineNumber': 1000 + i * 7, 'column': 4 + i} for i in range(20)}
+    operation = [18234, 'self.total += item.price\n', -1, 94120]
+    return {
+        'ack': {'type': 'ack', 'revision': 18234},
+        'cursor_update': {'type': 'cursor_update', 'position': {'lineNumber': 1412, 'column': 17}},
+        'presence (20 users)': {'type': 'presence', 'cursors': cursors},
+        'operation': {'type': 'operation', 'operation': operation, 'revision': 18235, 'user': 'alice'},
+        'catchup (50 updates)': {
+            'type': 'catchup',
+            'updates': [
+                {'revision': 18000 + i, 'operation': [18000 + i, 'x', 94000], 'user': 'bob', 'own': False}
+                for i in range(50)
+            ],
+        },
+    }
+
+
+def measure(function, argument, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function(argument)
+    return iterations / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    if 'msgpack' not in codecs.CODECS:
+        print("msgpack is not installed; only JSON is measured")
+
+    header = f"{'frame':<22} {'codec':<8} {'bytes':>7} {'encode/s':>11} {'decode/s':>11}"
+    print(header)
+    print('-' * len(header))
+    for label, payload in sample_frames().items():
+        for codec in codecs.CODECS.values():
+            frame = codec.encode(payload)
+            size = len(frame.encode() if isinstance(frame, str) else frame)
+            encode_rate = measure(codec.encode, payload, args.iterations)
+            decode_rate = measure(codec.decode, frame, args.iterations)
+            print(f"{label:<22} {codec.name:<8} {size:>7} {encode_rate:>11,.0f} {decode_rate:>11,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Throughput of importing a project archive.
+
+Builds a zip of generated source files and creates them in a fresh project
+two ways: one file at a time the way ``create_file`` and a first save do it,
+and through ``import_archive``, which batches every insert. Reports files per
+second and queries issued. Runs against a throwaway SQLite database unless
+--database-url is given.
+
+    python benchmarks/bench_import.py [--files 1000] [--lines 80]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_archive(files, lines):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for number in range(files):
+            body = ''.join(f"    total_{line} = item_{number} * {line}\n" for line in range(lines))
+            archive.writestr(f"src/module_{number}.py", f"def run_{number}(item_{number}):\n{body}")
+    buffer.seek(0)
+    return buffer
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--lines', type=int, default=80)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'codecollabhub.settings')
+    import django
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.db import connection
+    from projects.imports import import_archive, read_archive, validate_members
+    from projects.models import CodeFile, FileVersion, Project
+
+    call_command('migrate', verbosity=0)
+    user, _ = User.objects.get_or_create(username='bench-import')
+    archive = build_archive(args.files, args.lines)
+    print(f"{args.files} files of {args.lines} lines, {len(archive.getvalue()):,} byte archive")
+
+    header = f"{'path':>12} {'seconds':>9} {'files/s':>9} {'queries':>9}"
+    print(header)
+    print('-' * len(header))
+
+    project = Project.objects.create(name='bench one by one', owner=user)
+    files = validate_members(project, read_archive(archive))
+    queries = QueryCounter()
+    with connection.execute_wrapper(queries):
+        started = time.perf_counter()
+        for filename, language, content in files:
+            code_file = CodeFile(filename=filename, language=language, project=project)
+            code_file.save()
+            FileVersion.objects.create_version(code_file, content, user)
+        elapsed = time.perf_counter() - started
+    print(f"{'per file':>12} {elapsed:>9.2f} {args.files / elapsed:>9.0f} {queries.count:>9}")
+
+    project = Project.objects.create(name='bench bulk', owner=user)
+    queries = QueryCounter()
+    with connection.execute_wrapper(queries):
+        started = time.perf_counter()
+        import_archive(project, archive, user)
+        elapsed = time.perf_counter() - started
+    print(f"{'bulk import':>12} {elapsed:>9.2f} {args.files / elapsed:>9.0f} {queries.count:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Latency of trigram-indexed code search.
+
+Imports a generated project of a few thousand files into a throwaway SQLite
+database (or --database-url), then times searches that hit one file, a
+handful of files, and most files, against a scan that reads and searches
+every head version. Timings are taken with a cold and a warm content cache;
+"candidates" is how many files the index could not rule out.
+
+    python benchmarks/bench_search.py [--files 3000] [--lines 60]
+"""
+import argparse
+import io
+import os
+import re
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QUERIES = [
+    (r'handler_1234\b', True),
+    (r'def handler_12\d\d', True),
+    ('return total', False),
+]
+
+
+def build_archive(files, lines):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for number in range(files):
+            body = ''.join(f"    total_{line} = value * {line + number}\n" for line in range(lines))
+            archive.writestr(f"handler_{number}.py", f"def handler_{number}(value):\n{body}    return total_0\n")
+    buffer.seek(0)
+    return buffer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files', type=int, default=3000)
+    parser.add_argument('--lines', type=int, default=60)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'codecollabhub.settings')
+    import django
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from django.core.cache import cache
+    from django.core.management import call_command
+    from projects.imports import import_archive
+    from projects.models import CodeFile, Project
+    from projects.search import candidate_files, search_project
+    from projects.trigrams import query_for
+
+    call_command('migrate', verbosity=0)
+    user, _ = User.objects.get_or_create(username='bench-search')
+    project = Project.objects.create(name='bench search', owner=user)
+    started = time.perf_counter()
+    import_archive(project, build_archive(args.files, args.lines), user)
+    print(f"{args.files} files of {args.lines} lines imported and indexed in {time.perf_counter() - started:.1f}s")
+
+    def scan(pattern):
+        compiled = re.compile(pattern)
+        hits = 0
+        for code_file in CodeFile.objects.filter(project=project).select_related('head__blob'):
+            hits += sum(1 for line in code_file.get_latest_version().content.splitlines() if compiled.search(line))
+        return hits
+
+    header = f"{'query':>20} {'candidates':>10} {'cold ms':>9} {'warm ms':>9} {'scan ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for pattern, regex in QUERIES:
+        query = query_for(pattern if regex else re.escape(pattern))
+        candidates = len(candidate_files(project.id, query))
+        cache.clear()
+        timings = []
+        for _ in range(2):
+            started = time.perf_counter()
+            search_project(project.id, pattern, regex=regex)
+            timings.append((time.perf_counter() - started) * 1000)
+        cache.clear()
+        started = time.perf_counter()
+        scan(pattern if regex else re.escape(pattern))
+        scan_ms = (time.perf_counter() - started) * 1000
+        print(f"{pattern:>20} {candidates:>10} {timings[0]:>9.1f} {timings[1]:>9.1f} {scan_ms:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Time to first byte of the editor page and the content endpoint for a large file.
+
+Creates a file of about --size MB (generated code, ~40 characters a line) in a
+throwaway SQLite database (or --database-url), then times the editor page with
+the whole text inlined (what it did before) against the page that inlines only
+the first lines, and the content endpoint for the rest of the file, whole,
+gzipped and as a line range. Each request is made --repeat times after a
+warm-up; the median is reported with the body size on the wire.
+
+    python benchmarks/bench_ttfb.py [--size 5] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_content(size):
+    lines, length, number = [], 0, 0
+    while length < size:
+        line = f"    value_{number} = compute({number}, factor={number % 97})\n"
+        lines.append(line)
+        length += len(line)
+        number += 1
+    return ''.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', type=float, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'codecollabhub.settings')
+    import django
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.conf import settings
+    from django.test import Client, override_settings
+    from django.urls import reverse
+    from projects.models import CodeFile, FileVersion, Project
+
+    call_command('migrate', verbosity=0)
+    user, _ = User.objects.get_or_create(username='bench-ttfb')
+    project = Project.objects.create(name='bench ttfb', owner=user)
+    code_file = CodeFile.objects.create(project=project, filename='generated.py', language='python')
+    content = build_content(int(args.size * 1024 * 1024))
+    FileVersion.objects.create_version(code_file, content, user)
+    print(f"{len(content) / 1024 / 1024:.1f} MB, {content.count(chr(10))} lines")
+
+    settings.ALLOWED_HOSTS = ['testserver']
+    client = Client()
+    client.force_login(user)
+    editor_url = reverse('code_editor', args=[project.id, code_file.id])
+    content_url = reverse('version_content', args=[project.id, code_file.id, 1])
+
+    def measure(url, **headers):
+        client.get(url, **headers)
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            response = client.get(url, **headers)
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), len(response.content)
+
+    rows = []
+    with override_settings(EDITOR_INLINE_MAX_CHARS=len(content) + 1):
+        rows.append(('editor, whole text inlined', *measure(editor_url)))
+    rows.append(('editor, first lines inlined', *measure(editor_url)))
+    rows.append(('content, whole', *measure(content_url)))
+    rows.append(('content, whole, gzip', *measure(content_url, HTTP_ACCEPT_ENCODING='gzip')))
+    rest = f"{content_url}?lines={settings.EDITOR_INITIAL_LINES + 1}-"
+    rows.append(('content, rest, gzip', *measure(rest, HTTP_ACCEPT_ENCODING='gzip')))
+    rows.append(('content, bytes 0-65535', *measure(content_url, HTTP_RANGE='bytes=0-65535')))
+
+    header = f"{'request':>28} {'ms':>9} {'bytes':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, milliseconds, size in rows:
+        print(f"{name:>28} {milliseconds:>9.1f} {size:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Storage saved by delta-encoded file versions, and what it costs to read them.
+
+Simulates an editing session on a generated source file, encodes every saved
+version the way FileVersion does for a few keyframe intervals, and reports
+the characters stored and the worst-case time to rebuild one version from
+its keyframe (an uncached read).
+
+    python benchmarks/bench_version_storage.py [--lines 2000] [--versions 500]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from projects.deltas import make_delta, apply_delta, delta_size  # noqa: E402
+
+
+def editing_session(lines, versions, seed=1):
+    """Yield the file after each save; every save edits a few nearby lines."""
+    rng = random.Random(seed)
+    text = [f"    value_{number} = compute({number}, scale=2.5)\n" for number in range(lines)]
+    for _ in range(versions):
+        line = rng.randrange(len(text))
+        for offset in range(rng.randint(1, 4)):
+            index = min(line + offset, len(text) - 1)
+            action = rng.random()
+            if action < 0.6:
+                text[index] = text[index].replace('2.5', str(rng.randint(1, 9)))
+            elif action < 0.85:
+                text.insert(index, f"    # note {rng.randint(0, 10**6)}\n")
+            elif len(text) > 1:
+                del text[index]
+        yield ''.join(text)
+
+
+def encode(contents, interval):
+    """Return the stored rows as (keyframe text or None, delta or None)."""
+    rows, previous, depth = [], None, 0
+    for content in contents:
+        if previous is not None and depth + 1 < interval:
+            delta = make_delta(previous, content)
+            if delta_size(delta) < len(content):
+                rows.append((None, delta))
+                depth += 1
+                previous = content
+                continue
+        rows.append((content, None))
+        depth = 0
+        previous = content
+    return rows
+
+
+def rebuild(rows, index):
+    start = index
+    while rows[start][0] is None:
+        start -= 1
+    content = rows[start][0]
+    for _, delta in rows[start + 1:index + 1]:
+        content = apply_delta(content, delta)
+    return content
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--lines', type=int, default=2000)
+    parser.add_argument('--versions', type=int, default=500)
+    args = parser.parse_args()
+
+    contents = list(editing_session(args.lines, args.versions))
+    full = sum(len(content) for content in contents)
+    print(f"{args.versions} versions of a {args.lines}-line file, {full:,} characters as full copies")
+
+    header = f"{'keyframe every':>14} {'stored':>12} {'saved':>7} {'encode ms/ver':>14} {'worst read ms':>14}"
+    print(header)
+    print('-' * len(header))
+    for interval in (1, 8, 32, 128):
+        started = time.perf_counter()
+        rows = encode(contents, interval)
+        encode_ms = (time.perf_counter() - started) / len(contents) * 1000
+        stored = sum(len(text) if text is not None else delta_size(delta) for text, delta in rows)
+
+        # The version just before a keyframe has the longest chain
+        worst = 0
+        for index in range(len(rows) - 1, -1, -1):
+            if index + 1 < len(rows) and rows[index + 1][0] is None:
+                continue
+            started = time.perf_counter()
+            assert rebuild(rows, index) == contents[index]
+            worst = max(worst, time.perf_counter() - started)
+        print(f"{interval:>14} {stored:>12,} {1 - stored / full:>7.1%} {encode_ms:>14.2f} {worst * 1000:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
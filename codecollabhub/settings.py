@@ -75,6 +75,13 @@ DATABASES = {
     )
 }
 
+# On SQLite, tests run against a file rather than an in-memory database so
+# that tests saving from several threads get real concurrent writers.
+# Immediate transactions make writers wait for each other instead of failing
+if DATABASES['default'].get('ENGINE') == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('TEST', {}).setdefault('NAME', str(BASE_DIR / 'test_db.sqlite3'))
+    DATABASES['default'].setdefault('OPTIONS', {}).setdefault('transaction_mode', 'IMMEDIATE')
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -148,3 +155,89 @@ LOGGING = {
         },
     },
 }
+
+# Collaborative editor
+# Number of recent operations kept per room for transforming late edits
+EDITOR_HISTORY_SIZE = int(os.getenv('EDITOR_HISTORY_SIZE', '500'))
+# Longest time an edit may stay unsaved, and how long a file must be idle
+# before its latest content is written as a new version (seconds)
+EDITOR_SAVE_WINDOW = float(os.getenv('EDITOR_SAVE_WINDOW', '10'))
+EDITOR_SAVE_IDLE = float(os.getenv('EDITOR_SAVE_IDLE', '2'))
+# A failed write is retried after the idle time, doubling up to this (seconds)
+EDITOR_SAVE_MAX_RETRY_DELAY = float(os.getenv('EDITOR_SAVE_MAX_RETRY_DELAY', '60'))
+# How often a live room's document is checkpointed, and how long an empty
+# room stays in memory before it is evicted (seconds)
+EDITOR_CHECKPOINT_INTERVAL = float(os.getenv('EDITOR_CHECKPOINT_INTERVAL', '1'))
+EDITOR_ROOM_TTL = float(os.getenv('EDITOR_ROOM_TTL', '60'))
+# Cursor moves are batched per room and published once per tick (seconds)
+EDITOR_PRESENCE_TICK = float(os.getenv('EDITOR_PRESENCE_TICK', '0.03'))
+# Frames queued per socket before it is compacted, and how many compactions
+# a socket may need before catching up once it is closed as too slow
+EDITOR_SEND_QUEUE_SIZE = int(os.getenv('EDITOR_SEND_QUEUE_SIZE', '256'))
+EDITOR_SEND_QUEUE_MAX_OVERFLOWS = int(os.getenv('EDITOR_SEND_QUEUE_MAX_OVERFLOWS', '3'))
+
+# The default cache is per process and only holds what can be rebuilt from
+# the database. Project access lists go to the 'shared' cache, which every
+# worker reads, so dropping a list revokes access everywhere at once. It is
+# a database table unless REDIS_URL is set
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    } if os.getenv('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'projects_shared_cache',
+    },
+}
+
+# Project access lists are cached (seconds); changes invalidate them at once
+PROJECT_ACCESS_CACHE_TTL = int(os.getenv('PROJECT_ACCESS_CACHE_TTL', '300'))
+
+# File versions are stored as deltas with a full keyframe every N versions.
+# Rebuilt contents are cached (seconds)
+VERSION_KEYFRAME_INTERVAL = int(os.getenv('VERSION_KEYFRAME_INTERVAL', '32'))
+VERSION_CONTENT_CACHE_TTL = int(os.getenv('VERSION_CONTENT_CACHE_TTL', '3600'))
+
+# Version retention applied by ``manage.py compact_versions``, youngest tier
+# first. Versions younger than ``age`` seconds keep the newest version per
+# ``bucket`` seconds (every version without a bucket), per author if asked
+VERSION_RETENTION = [
+    {'age': 24 * 3600, 'bucket': None},
+    {'age': 30 * 24 * 3600, 'bucket': 3600, 'per_author': True},
+    {'age': None, 'bucket': 24 * 3600},
+]
+
+# Version diffs: texts with more lines than this (both sides together) are
+# not diffed, and this many computed diffs are kept per process
+DIFF_MAX_LINES = int(os.getenv('DIFF_MAX_LINES', '20000'))
+DIFF_CACHE_SIZE = int(os.getenv('DIFF_CACHE_SIZE', '256'))
+
+# Archive imports: most files per archive, largest file and most bytes
+# unpacked from one archive
+IMPORT_MAX_FILES = int(os.getenv('IMPORT_MAX_FILES', '5000'))
+IMPORT_MAX_FILE_SIZE = int(os.getenv('IMPORT_MAX_FILE_SIZE', str(1024 * 1024)))
+IMPORT_MAX_TOTAL_SIZE = int(os.getenv('IMPORT_MAX_TOTAL_SIZE', str(100 * 1024 * 1024)))
+
+# Code search: matching lines returned per query, and longest pattern accepted
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', '200'))
+SEARCH_MAX_PATTERN_LENGTH = int(os.getenv('SEARCH_MAX_PATTERN_LENGTH', '256'))
+# Most candidate files read, and seconds spent matching, before a search stops
+SEARCH_MAX_FILES = int(os.getenv('SEARCH_MAX_FILES', '5000'))
+SEARCH_TIME_LIMIT = float(os.getenv('SEARCH_TIME_LIMIT', '2.0'))
+# Threads that update the trigram index after saves; 0 (or SQLite) indexes inline
+SEARCH_INDEX_WORKERS = int(os.getenv('SEARCH_INDEX_WORKERS', '2'))
+
+# Threads that extract Python definitions after saves; 0 (or SQLite) extracts inline
+SYMBOL_INDEX_WORKERS = int(os.getenv('SYMBOL_INDEX_WORKERS', '2'))
+
+# Threads that compute blame for files saved before it was tracked; 0 (or
+# SQLite) computes it inline
+BLAME_INDEX_WORKERS = int(os.getenv('BLAME_INDEX_WORKERS', '1'))
+
+# Files longer than this (characters) open with only their first lines in
+# the editor page; the rest is fetched once the page has rendered
+EDITOR_INLINE_MAX_CHARS = int(os.getenv('EDITOR_INLINE_MAX_CHARS', str(256 * 1024)))
+EDITOR_INITIAL_LINES = int(os.getenv('EDITOR_INITIAL_LINES', '1000'))
@@ -0,0 +1,93 @@
+"""
+Project access control.
+
+Every check goes through ``get_role``. The access list of a project (its
+owner and the role of each member) is loaded with a single query and kept
+in the 'shared' cache for ``PROJECT_ACCESS_CACHE_TTL`` seconds, so a warm
+check does not run the query. Within one request the list is also
+memoized on the user object. ``projects.signals`` drops the cached list
+whenever a membership or the owner of a project changes; as the cache is
+shared by every worker, the change is seen everywhere at once.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Project
+
+
+def _cache():
+    return caches['shared']
+
+
+def _cache_key(project_id):
+    return f"project_acl:{project_id}"
+
+
+def _load_acl(project_id):
+    rows = Project.objects.filter(id=project_id).values_list(
+        'owner_id',
+        'projectmembership__user_id',
+        'projectmembership__role'
+    )
+    acl = None
+    for owner_id, user_id, role in rows:
+        if acl is None:
+            acl = {'owner_id': owner_id, 'roles': {}}
+        if user_id is not None:
+            acl['roles'][user_id] = role
+    return acl
+
+
+def get_acl(user, project_id):
+    """
+    Return ``{'owner_id': ..., 'roles': {user_id: role}}`` for a project,
+    or None if the project does not exist.
+    """
+    memo = getattr(user, '_project_acls', None)
+    if memo is None:
+        memo = user._project_acls = {}
+    if project_id in memo:
+        return memo[project_id]
+
+    key = _cache_key(project_id)
+    acl = _cache().get(key)
+    if acl is None:
+        acl = _load_acl(project_id)
+        if acl is not None:
+            _cache().set(key, acl, settings.PROJECT_ACCESS_CACHE_TTL)
+    memo[project_id] = acl
+    return acl
+
+
+def get_role(user, project):
+    """
+    Return the role of ``user`` in ``project`` ('owner', 'admin' or
+    'member'), or None if the user has no access. ``project`` may be a
+    Project or its id.
+    """
+    if not user or user.is_anonymous:
+        return None
+
+    # The owner is known without looking anything up
+    if isinstance(project, Project):
+        if project.owner_id == user.id:
+            return 'owner'
+        project_id = project.id
+    else:
+        project_id = int(project)
+
+    acl = get_acl(user, project_id)
+    if acl is None:
+        return None
+    if acl['owner_id'] == user.id:
+        return 'owner'
+    return acl['roles'].get(user.id)
+
+
+def has_access(user, project):
+    return get_role(user, project) is not None
+
+
+def invalidate(project_id):
+    """Forget the cached access list of a project."""
+    _cache().delete(_cache_key(project_id))
@@ -0,0 +1,52 @@
+"""
+Per-line blame for file versions.
+
+Every version stores its blame as run-length ranges, ``[[count, version],
+...]``: the next ``count`` lines were last changed by version number
+``version``. A new version's blame is derived from the previous version's
+with one line diff when it is created, so serving blame never replays the
+history. Versions written before blame existed have none;
+``FileVersion.objects.rebuild_blame`` fills them in with one pass over the
+file's history.
+"""
+import difflib
+
+
+def _expand(runs):
+    lines = []
+    for count, version in runs:
+        lines.extend([version] * count)
+    return lines
+
+
+def _compress(lines):
+    runs = []
+    for version in lines:
+        if runs and runs[-1][1] == version:
+            runs[-1][0] += 1
+        else:
+            runs.append([1, version])
+    return runs
+
+
+def advance(runs, old, new, version_number):
+    """
+    Return the blame of ``new`` given the blame ``runs`` of ``old``. Without
+    a previous version every line belongs to ``version_number``; with one
+    whose blame is unknown, the result is unknown (None) too.
+    """
+    new_lines = new.splitlines()
+    if old is None:
+        return [[len(new_lines), version_number]] if new_lines else []
+    if runs is None:
+        return None
+
+    owners = _expand(runs)
+    matcher = difflib.SequenceMatcher(None, old.splitlines(), new_lines)
+    result = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            result.extend(owners[i1:i2])
+        else:
+            result.extend([version_number] * (j2 - j1))
+    return _compress(result)
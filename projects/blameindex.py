@@ -0,0 +1,18 @@
+"""
+Line blame for files saved before blame was tracked.
+
+Such a file has versions without stored ranges, and filling them in means
+replaying its whole history. The blame endpoint queues the file on
+``blame_indexer`` (see ``projects.indexing``) rather than doing that in the
+request, and ``manage.py rebuild_blame`` does it for every file at once.
+"""
+from .indexing import BackgroundIndexer
+from .models import FileVersion
+
+
+def index_files(code_file_ids):
+    """Compute the missing blame of files. Returns how many were changed."""
+    return sum(1 for code_file_id in code_file_ids if FileVersion.objects.rebuild_blame(code_file_id))
+
+
+blame_indexer = BackgroundIndexer('blame', index_files, 'BLAME_INDEX_WORKERS')
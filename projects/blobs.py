@@ -0,0 +1,23 @@
+"""
+Content addressing and compression for stored file text.
+
+Keyframe text is kept in ``ContentBlob`` rows keyed by the SHA-256 of the
+text, so identical content (reverts, repeated autosaves, empty new files)
+is stored once. Blobs are zlib-compressed at rest.
+"""
+import hashlib
+import zlib
+
+COMPRESSION_LEVEL = 6
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def compress(text):
+    return zlib.compress(text.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def decompress(data):
+    return zlib.decompress(bytes(data)).decode('utf-8')
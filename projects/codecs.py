@@ -0,0 +1,64 @@
+"""
+Wire codecs for editor sockets.
+
+Clients pick a codec through the WebSocket subprotocol. MessagePack sends
+binary frames and is only offered when the ``msgpack`` package is installed;
+JSON text frames are the fallback and are used when the client does not ask
+for a subprotocol at all.
+"""
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JsonCodec:
+    name = 'json'
+    subprotocol = 'codecollab.json'
+    binary = False
+
+    def encode(self, payload):
+        return json.dumps(payload, separators=(',', ':'))
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+    subprotocol = 'codecollab.msgpack'
+    binary = True
+
+    def encode(self, payload):
+        return msgpack.packb(payload, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+JSON = JsonCodec()
+
+# Every codec this process can speak, keyed by name
+CODECS = {JSON.name: JSON}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+
+def negotiate(subprotocols):
+    """
+    Choose a codec for the subprotocols offered by the client, in the
+    client's order of preference. Returns ``(codec, subprotocol)`` where the
+    subprotocol is None when the client did not ask for one.
+    """
+    by_subprotocol = {codec.subprotocol: codec for codec in CODECS.values()}
+    for subprotocol in subprotocols or []:
+        if subprotocol in by_subprotocol:
+            return by_subprotocol[subprotocol], subprotocol
+    return JSON, None
+
+
+def encode_all(payload):
+    """Encode a payload once for every available codec."""
+    return {name: codec.encode(payload) for name, codec in CODECS.items()}
@@ -0,0 +1,50 @@
+"""
+Conditional GET for pages that are rendered from the database.
+
+A page's strong ETag is a hash of what it was rendered from: the version
+of the file or project it shows, the user viewing it, and the CSRF secret
+its forms were rendered with. ``If-None-Match`` and ``If-Modified-Since``
+are answered with a 304 before anything else is loaded. Pages carrying
+one-off messages are always rendered in full, and are sent with
+``no-cache`` so the browser revalidates each load instead of guessing a
+freshness lifetime from ``Last-Modified``.
+"""
+import hashlib
+from calendar import timegm
+
+from django.contrib import messages
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+def page_etag(request, *parts):
+    """The ETag of a page rendered from ``parts``, or None if it has none"""
+    if len(messages.get_messages(request)):
+        # Flash messages are shown once, so the page must be rendered
+        return None
+    # Issues the CSRF cookie now if the request had none, so that the
+    # page's forms and its ETag agree from the first response
+    get_token(request)
+    key = ':'.join(str(part) for part in (request.user.id, request.META['CSRF_COOKIE'], *parts))
+    return quote_etag(hashlib.sha256(key.encode('utf-8')).hexdigest()[:32])
+
+
+def conditional_response(request, etag, last_modified):
+    """
+    The response to a request whose preconditions decide it (a 304 if the
+    client already has the page), or None if the page must be rendered.
+    """
+    if etag is None:
+        return None
+    response = get_conditional_response(request, etag=etag, last_modified=timegm(last_modified.utctimetuple()))
+    return set_validators(response, etag, last_modified) if response is not None else None
+
+
+def set_validators(response, etag, last_modified):
+    if etag is None:
+        return response
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
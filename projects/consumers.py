@@ -1,23 +1,145 @@
-import json
+import asyncio
+import atexit
 import logging
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
-from .models import Project, CodeFile, FileVersion
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import transaction
+from .models import CodeFile, FileVersion, VersionConflict
 from .utils import check_user_access
+from . import ot
+from .rooms import room_group_name, join_room, leave_room, get_room, file_room, checkpoint_all
+from .writebehind import WriteBehindBuffer
+from .sendqueue import SendQueue, PRESENCE, UPDATE, CONTROL
+from . import metrics
+from . import codecs
 
 logger = logging.getLogger(__name__)
 
-class CodeEditorConsumer(AsyncWebsocketConsumer):
+
+def write_file_version(file_id, content, creator, base_version=None):
+    code_file = CodeFile.objects.get(id=file_id)
+    try:
+        version, created = FileVersion.objects.save_content(code_file, content, creator, base_version)
+    except VersionConflict as e:
+        # Saved over from outside the room, which adopts that version when
+        # it is announced (see announce_version)
+        metrics.increment('editor.save.conflicts')
+        logger.warning(f"Dropped save of file {file_id} based on version {base_version}; version {e.head.version_number} is the latest")
+        return None
+    if created:
+        logger.info(f"Code changes saved for file {file_id}, version {version.version_number}")
+    return version.version_number
+
+
+def version_written(file_id, version_number):
+    room = file_room(file_id)
+    if room is not None:
+        room.saved(version_number)
+
+
+# Room checkpoints go through a per-process write-behind buffer so that a
+# burst of edits produces a single FileVersion
+save_buffer = WriteBehindBuffer(
+    write_file_version,
+    window=settings.EDITOR_SAVE_WINDOW,
+    idle=settings.EDITOR_SAVE_IDLE,
+    written=version_written,
+    max_retry_delay=settings.EDITOR_SAVE_MAX_RETRY_DELAY
+)
+
+
+def has_live_edits(file_id):
+    """Whether the live room of a file in this process has unsaved edits"""
+    room = file_room(file_id)
+    return room is not None and (room.dirty or save_buffer.has_pending(file_id))
+
+
+def announce_version(project_id, file_id, version_number, user):
+    """
+    Tell the live room of a file, if there is one, about a version saved
+    outside it, once the save has committed.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    transaction.on_commit(lambda: async_to_sync(channel_layer.group_send)(room_group_name(project_id, file_id), {
+        'type': 'version_saved',
+        'file': file_id,
+        'version': version_number,
+        'user': user.username
+    }))
+
+
+# How queued frames may be compacted when a socket falls behind
+FRAME_KINDS = {
+    'operation': UPDATE,
+    'ack': UPDATE,
+    'snapshot': UPDATE,
+    'catchup': UPDATE,
+    'presence': PRESENCE,
+}
+
+
+def broadcast_event(payload, sender=None, ack=None):
+    """
+    Build a group event whose frame is encoded once per codec by the sender
+    rather than once per recipient. The ``sender`` channel is skipped on
+    delivery and gets the optional ``ack`` payload instead.
+    """
+    event = {
+        'type': 'broadcast',
+        'frames': codecs.encode_all(payload),
+        'kind': FRAME_KINDS.get(payload['type'], CONTROL),
+        'file': payload.get('file'),
+        'sender': sender
+    }
+    if ack is not None:
+        event['ack'] = codecs.encode_all(ack)
+    return event
+
+
+async def publish_presence(room, cursors):
+    # One frame per room and tick, however many cursors moved
+    metrics.increment('editor.presence.batches')
+    await get_channel_layer().group_send(room.name, broadcast_event({
+        'type': 'presence',
+        'file': room.file_id,
+        'cursors': cursors
+    }))
+
+
+@atexit.register
+def flush_on_shutdown():
+    checkpoint_all()
+    save_buffer.flush_all_sync()
+
+
+class ProjectConsumer(AsyncWebsocketConsumer):
+    """
+    One socket per project. Clients subscribe to the files they have open
+    and every file-scoped message carries a ``file`` id. Access to the
+    project is checked once, when the socket connects.
+    """
+
     async def connect(self):
         try:
-            self.project_id = self.scope['url_route']['kwargs']['project_id']
-            self.file_id = self.scope['url_route']['kwargs']['file_id']
+            self.project_id = int(self.scope['url_route']['kwargs']['project_id'])
+            self.subscriptions = {}
+            
+            query = parse_qs(self.scope.get('query_string', b'').decode())
+            self.client_id = query.get('client', [self.channel_name])[0]
+            self.query = query
+            
+            # Frames are MessagePack when the client offers it, JSON otherwise
+            self.codec, self.subprotocol = codecs.negotiate(self.scope.get('subprotocols'))
             
             # Log connection attempt details
-            logger.info(f"WebSocket connection attempt - Project: {self.project_id}, File: {self.file_id}")
+            logger.info(f"WebSocket connection attempt - Project: {self.project_id}")
             logger.info(f"Client: {self.scope.get('client', 'No client info')}")
-            logger.info(f"Headers: {self.scope.get('headers', 'No headers')}")
             logger.info(f"User: {self.scope.get('user', 'Anonymous')}")
             
             # Check user authentication
@@ -34,146 +156,342 @@ class CodeEditorConsumer(AsyncWebsocketConsumer):
                 return
             
             # Accept the connection
-            await self.accept()
-            logger.info(f"WebSocket connection accepted - Project: {self.project_id}, File: {self.file_id}")
+            await self.accept(subprotocol=self.subprotocol)
+            logger.info(f"WebSocket connection accepted - Project: {self.project_id}")
             
-            # Add user to the group
-            await self.channel_layer.group_add(
-                f"project_{self.project_id}_file_{self.file_id}",
-                self.channel_name
-            )
-            
-            # Notify others that a new user has joined
-            await self.channel_layer.group_send(
-                f"project_{self.project_id}_file_{self.file_id}",
-                {
-                    'type': 'user_joined',
-                    'username': self.scope['user'].username
-                }
+            # Everything sent from here on goes through a bounded queue
+            self.outbox = SendQueue(
+                self.write_frame,
+                self.refresh,
+                limit=settings.EDITOR_SEND_QUEUE_SIZE,
+                max_overflows=settings.EDITOR_SEND_QUEUE_MAX_OVERFLOWS,
+                on_drop=self.frames_dropped,
+                on_slow=self.too_slow
             )
+            self.outbox.start()
+            await self.on_accept()
             
         except Exception as e:
             logger.error(f"Error in WebSocket connect: {str(e)}", exc_info=True)
             await self.close(code=1011, reason=str(e))
+
+    async def on_accept(self):
+        pass
     
     @database_sync_to_async
     def check_project_access(self):
+        # Served from the shared access cache, so a warm connect skips the access query
         try:
-            project = Project.objects.get(id=self.project_id)
-            return check_user_access(self.scope['user'], project)
-        except Project.DoesNotExist:
-            logger.error(f"Project {self.project_id} does not exist")
-            return False
+            return check_user_access(self.scope['user'], self.project_id)
         except Exception as e:
             logger.error(f"Error checking project access: {str(e)}", exc_info=True)
             return False
 
     async def disconnect(self, close_code):
+        logger.info(f"WebSocket disconnected - Code: {close_code}")
+        if hasattr(self, 'outbox'):
+            self.outbox.stop()
+        for file_id in list(getattr(self, 'subscriptions', {})):
+            try:
+                await self.unsubscribe_file(file_id)
+            except Exception as e:
+                logger.error(f"Error in disconnect: {str(e)}")
+
+    async def subscribe_file(self, file_id, epoch=None, revision=None):
+        if file_id in self.subscriptions:
+            return
+        group_name = room_group_name(self.project_id, file_id)
+        
+        # Add user to the group
+        await self.channel_layer.group_add(group_name, self.channel_name)
+        
+        # Bring the client up to date: only the missed updates when it is
+        # reconnecting within the history buffer, otherwise the document
         try:
-            logger.info(f"WebSocket disconnected - Code: {close_code}")
-            await self.channel_layer.group_discard(
-                f"project_{self.project_id}_file_{self.file_id}",
-                self.channel_name
+            room = await join_room(
+                group_name,
+                file_id,
+                self.channel_name,
+                lambda: self.load_content(file_id),
+                save_buffer.submit,
+                publish_presence,
+                self.outbox
             )
-            
-            # Notify others that user has left
-            await self.channel_layer.group_send(
-                f"project_{self.project_id}_file_{self.file_id}",
-                {
-                    'type': 'user_left',
-                    'username': self.scope["user"].username
-                }
-            )
-        except Exception as e:
-            logger.error(f"Error in disconnect: {str(e)}")
+        except CodeFile.DoesNotExist:
+            await self.channel_layer.group_discard(group_name, self.channel_name)
+            await self.send_payload({'type': 'error', 'file': file_id, 'message': 'File not found'})
+            return
+        self.subscriptions[file_id] = group_name
+        await self.send_catchup(room, epoch, revision)
+        if room.presence:
+            await self.send_payload(self.presence_payload(room))
+        
+        # Notify others that a new user has joined
+        await self.channel_layer.group_send(
+            group_name,
+            broadcast_event({
+                'type': 'user_joined',
+                'file': file_id,
+                'username': self.scope['user'].username
+            }, sender=self.channel_name)
+        )
+
+    async def unsubscribe_file(self, file_id):
+        group_name = self.subscriptions.pop(file_id, None)
+        if group_name is None:
+            return
+        await self.channel_layer.group_discard(group_name, self.channel_name)
+        
+        # leave_room checkpoints the room once its last member is gone
+        room = leave_room(group_name, self.channel_name)
+        if room is not None:
+            room.remove_presence(self.scope["user"].username)
+        await save_buffer.flush(file_id)
+        
+        # Notify others that user has left
+        await self.channel_layer.group_send(
+            group_name,
+            broadcast_event({
+                'type': 'user_left',
+                'file': file_id,
+                'username': self.scope["user"].username
+            }, sender=self.channel_name)
+        )
 
-    async def receive(self, text_data):
+    def message_file(self, message):
+        """The file a client message is about, or None if it is missing."""
         try:
-            text_data_json = json.loads(text_data)
-            message_type = text_data_json.get('type')
+            return int(message.get('file'))
+        except (TypeError, ValueError):
+            return None
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            message = self.codec.decode(bytes_data if self.codec.binary else text_data)
+            message_type = message.get('type')
+            file_id = self.message_file(message)
             
-            logger.info(f"Received message type: {message_type}")
+            logger.debug(f"Received message type: {message_type}")
             
-            if message_type == 'code_update':
-                # Save the code changes to database
-                await self.save_code_changes(text_data_json.get('content'))
-                
-                # Broadcast the changes to other users
-                await self.channel_layer.group_send(
-                    f"project_{self.project_id}_file_{self.file_id}",
-                    {
-                        'type': 'code_update',
-                        'content': text_data_json.get('content'),
-                        'user': self.scope["user"].username
-                    }
+            if file_id is None:
+                await self.send_payload({'type': 'error', 'message': 'Message has no file'})
+            elif message_type == 'subscribe':
+                await self.subscribe_file(file_id, message.get('epoch'), message.get('revision'))
+            elif message_type == 'unsubscribe':
+                await self.unsubscribe_file(file_id)
+            elif file_id not in self.subscriptions:
+                await self.send_payload({'type': 'error', 'file': file_id, 'message': 'Not subscribed to file'})
+            elif message_type == 'operation':
+                await self.handle_operation(
+                    file_id,
+                    message.get('revision'),
+                    message.get('operation')
                 )
             elif message_type == 'cursor_update':
-                await self.channel_layer.group_send(
-                    f"project_{self.project_id}_file_{self.file_id}",
-                    {
-                        'type': 'cursor_update',
-                        'position': text_data_json.get('position'),
-                        'user': self.scope["user"].username
-                    }
-                )
+                self.handle_cursor_update(file_id, message.get('position'))
         except Exception as e:
             logger.error(f"Error in receive: {str(e)}")
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'error',
                 'message': 'Error processing message'
-            }))
+            })
 
-    @database_sync_to_async
-    def save_code_changes(self, content):
-        try:
-            code_file = CodeFile.objects.get(id=self.file_id)
-            latest_version = code_file.get_latest_version()
-            next_version_number = (latest_version.version_number + 1) if latest_version else 1
+    async def send_payload(self, payload):
+        await self.send_frame(
+            self.codec.encode(payload),
+            FRAME_KINDS.get(payload['type'], CONTROL),
+            payload.get('file')
+        )
+
+    async def send_frame(self, frame, kind=CONTROL, file_id=None):
+        self.outbox.put(frame, kind, file_id)
+
+    async def write_frame(self, frame):
+        if self.codec.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def refresh(self, kind, file_id):
+        """Send a file's current state in place of frames the queue dropped."""
+        room = get_room(self.subscriptions.get(file_id))
+        if room is None:
+            return
+        if kind == 'snapshot':
+            await self.write_frame(self.codec.encode(self.snapshot_payload(room)))
+        elif room.presence:
+            await self.write_frame(self.codec.encode(self.presence_payload(room)))
+
+    def frames_dropped(self, kind, file_id, count):
+        room = get_room(self.subscriptions.get(file_id))
+        if kind == PRESENCE:
+            metrics.increment('editor.send.dropped_presence', count)
+            if room is not None:
+                room.dropped_presence += count
+        else:
+            metrics.increment('editor.send.collapsed_updates', count)
+            if room is not None:
+                room.collapsed_updates += count
+
+    def too_slow(self):
+        logger.warning(f"Closing slow WebSocket for project {self.project_id}")
+        metrics.increment('editor.send.slow_disconnects')
+        for group_name in self.subscriptions.values():
+            room = get_room(group_name)
+            if room is not None:
+                room.slow_disconnects += 1
+        self._closing = asyncio.ensure_future(self.close(code=4008, reason="Client too slow"))
+
+    async def handle_operation(self, file_id, revision, operation):
+        room = get_room(self.subscriptions[file_id])
+        async with room.lock:
+            try:
+                operation = room.apply_operation(revision, operation, self.scope['user'], self.client_id)
+            except ot.OperationError as e:
+                # The client cannot recover on its own, so resend the document
+                logger.warning(f"Rejected operation on {room.name}: {str(e)}")
+                await self.send_snapshot(room)
+                return
             
-            # Create new version
-            FileVersion.objects.create(
-                code_file=code_file,
-                creator=self.scope['user'],
-                content=content,
-                version_number=next_version_number
+            # Broadcast while holding the lock so revisions go out in order.
+            # The author only needs to know which revision its edit became
+            await self.channel_layer.group_send(
+                room.name,
+                broadcast_event({
+                    'type': 'operation',
+                    'file': file_id,
+                    'operation': operation,
+                    'revision': room.revision,
+                    'user': self.scope["user"].username
+                }, sender=self.channel_name, ack={
+                    'type': 'ack',
+                    'file': file_id,
+                    'revision': room.revision
+                })
             )
-            
-            logger.info(f"Code changes saved for file {self.file_id}, version {next_version_number}")
-            return True
-        except Exception as e:
-            logger.error(f"Error saving code changes: {str(e)}")
-            return False
 
-    async def code_update(self, event):
-        try:
-            await self.send(text_data=json.dumps({
-                'type': 'code_update',
-                'content': event['content'],
-                'user': event['user']
-            }))
-        except Exception as e:
-            logger.error(f"Error in code_update: {str(e)}")
+    def handle_cursor_update(self, file_id, position):
+        if not isinstance(position, dict):
+            return
+        line_number, column = position.get('lineNumber'), position.get('column')
+        if not isinstance(line_number, int) or not isinstance(column, int):
+            return
+        metrics.increment('editor.presence.updates')
+        room = get_room(self.subscriptions[file_id])
+        room.update_presence(self.scope["user"].username, {'lineNumber': line_number, 'column': column})
+
+    def snapshot_payload(self, room):
+        return {
+            'type': 'snapshot',
+            'file': room.file_id,
+            'content': room.content,
+            'revision': room.revision,
+            'epoch': room.epoch
+        }
 
-    async def cursor_update(self, event):
+    def presence_payload(self, room):
+        return {
+            'type': 'presence',
+            'file': room.file_id,
+            'cursors': room.presence
+        }
+
+    async def send_snapshot(self, room):
+        await self.send_payload(self.snapshot_payload(room))
+
+    async def send_catchup(self, room, epoch, revision):
+        updates = None
+        if epoch == room.epoch and revision is not None:
+            try:
+                updates = room.updates_since(int(revision))
+            except (TypeError, ValueError):
+                updates = None
+        if updates is None:
+            await self.send_snapshot(room)
+            return
+        
+        await self.send_payload({
+            'type': 'catchup',
+            'file': room.file_id,
+            'updates': [
+                {
+                    'revision': update.revision,
+                    'operation': update.operation,
+                    'user': update.user,
+                    'own': update.client_id == self.client_id
+                }
+                for update in updates
+            ]
+        })
+
+    @database_sync_to_async
+    def load_content(self, file_id):
+        # Also makes sure the file belongs to the project the socket is for
+        code_file = CodeFile.objects.select_related('head').get(id=file_id, project_id=self.project_id)
+        latest_version = code_file.get_latest_version()
+        if latest_version is None:
+            return "", None
+        return latest_version.content, latest_version.version_number
+
+    @database_sync_to_async
+    def load_version(self, file_id, version_number):
+        """The content of a version and of the version it was saved over"""
+        versions = list(
+            FileVersion.objects.filter(code_file_id=file_id, version_number__lte=version_number)
+            .order_by('-version_number')[:2]
+        )
+        base = versions[1].content if len(versions) > 1 else ''
+        return versions[0].content, base
+
+    async def version_saved(self, event):
+        room = get_room(self.subscriptions.get(event['file']))
+        if room is None:
+            return
+        async with room.lock:
+            # Every member in this process is told; the first one adopts it
+            if room.version is not None and room.version >= event['version']:
+                return
+            content, base = await self.load_version(event['file'], event['version'])
+            operation = room.adopt(base, content, event['version'], event['user'])
+            if operation is None:
+                return
+            await self.channel_layer.group_send(
+                room.name,
+                broadcast_event({
+                    'type': 'operation',
+                    'file': room.file_id,
+                    'operation': operation,
+                    'revision': room.revision,
+                    'user': event['user']
+                })
+            )
+
+    async def broadcast(self, event):
+        # The frame was encoded once by the sender; just forward it
         try:
-            await self.send(text_data=json.dumps({
-                'type': 'cursor_update',
-                'position': event['position'],
-                'user': event['user']
-            }))
+            if event['sender'] != self.channel_name:
+                await self.send_frame(event['frames'][self.codec.name], event['kind'], event['file'])
+            elif 'ack' in event:
+                await self.send_frame(event['ack'][self.codec.name], UPDATE, event['file'])
         except Exception as e:
-            logger.error(f"Error in cursor_update: {str(e)}")
-
-    async def user_joined(self, event):
-        # Send user joined notification to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'user_joined',
-            'username': event['username']
-        }))
-
-    async def user_left(self, event):
-        # Send user left notification to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'user_left',
-            'username': event['username']
-        }))
+            logger.error(f"Error in broadcast: {str(e)}")
+
+
+class CodeEditorConsumer(ProjectConsumer):
+    """
+    Single-file socket for ``ws/projects/<id>/files/<id>/``. It subscribes
+    to its file on connect and messages without a ``file`` id refer to it.
+    """
+
+    async def on_accept(self):
+        self.file_id = int(self.scope['url_route']['kwargs']['file_id'])
+        await self.subscribe_file(
+            self.file_id,
+            self.query.get('epoch', [None])[0],
+            self.query.get('revision', [None])[0]
+        )
+
+    def message_file(self, message):
+        if message.get('file') is None:
+            return self.file_id
+        return super().message_file(message)
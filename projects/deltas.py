@@ -0,0 +1,36 @@
+"""
+Deltas between consecutive versions of a file.
+
+A delta is an operation in the ``projects.ot`` format that turns the text of
+the previous version into the text of the next one. It is computed from a
+line diff, so an edit to one line stores that line rather than the file.
+"""
+import difflib
+
+from . import ot
+
+
+def make_delta(old, new):
+    """Return an operation that turns ``old`` into ``new``."""
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+    operation = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            operation.append(sum(ot.utf16_len(line) for line in old_lines[i1:i2]))
+            continue
+        if j2 > j1:
+            operation.append(''.join(new_lines[j1:j2]))
+        if i2 > i1:
+            operation.append(-sum(ot.utf16_len(line) for line in old_lines[i1:i2]))
+    return ot.normalize(operation)
+
+
+def apply_delta(text, delta):
+    return ot.apply(text, delta)
+
+
+def delta_size(delta):
+    """Rough number of characters a delta takes up when stored."""
+    return sum(len(c) if isinstance(c, str) else 8 for c in delta)
@@ -0,0 +1,199 @@
+"""
+Line diffs between file versions.
+
+Lines are matched with patience diff: lines that occur exactly once on both
+sides anchor the alignment, and the gaps between anchors are diffed
+recursively. That keeps moved blocks and reformatted code readable and
+avoids the quadratic worst case of a plain LCS. Gaps without any unique line
+fall back to difflib, unless they are too large, in which case they are
+reported as replaced. Inputs over ``DIFF_MAX_LINES`` are not diffed at all.
+
+Results are memoized in a small per-process LRU keyed by the version pair;
+versions never change, so entries never go stale.
+"""
+import difflib
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+
+CONTEXT_LINES = 3
+
+# Largest gap, in compared line pairs, that is handed to difflib
+FALLBACK_LIMIT = 250000
+
+
+def _unique_anchors(a, b, alo, ahi, blo, bhi):
+    """Longest increasing run of lines that are unique on both sides."""
+    seen = {}
+    for i in range(alo, ahi):
+        entry = seen.setdefault(a[i], [0, 0, i, None])
+        entry[0] += 1
+    for j in range(blo, bhi):
+        entry = seen.get(b[j])
+        if entry is not None:
+            entry[1] += 1
+            entry[3] = j
+    pairs = sorted((i, j) for a_count, b_count, i, j in seen.values() if a_count == 1 and b_count == 1)
+
+    # Patience sorting: piles hold the smallest j ending a run of each length
+    piles, tops, back = [], [], {}
+    for i, j in pairs:
+        pile = bisect_left(tops, j)
+        back[i, j] = piles[pile - 1][-1] if pile else None
+        if pile == len(piles):
+            piles.append([(i, j)])
+            tops.append(j)
+        else:
+            piles[pile].append((i, j))
+            tops[pile] = j
+    anchors = []
+    node = piles[-1][-1] if piles else None
+    while node is not None:
+        anchors.append(node)
+        node = back[node]
+    anchors.reverse()
+    return anchors
+
+
+def _match(a, b, alo, ahi, blo, bhi, matches):
+    suffix = []
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        matches.append((alo, blo))
+        alo += 1
+        blo += 1
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        suffix.append((ahi, bhi))
+
+    if alo < ahi and blo < bhi:
+        anchors = _unique_anchors(a, b, alo, ahi, blo, bhi)
+        if anchors:
+            i, j = alo, blo
+            for anchor_i, anchor_j in anchors:
+                _match(a, b, i, anchor_i, j, anchor_j, matches)
+                matches.append((anchor_i, anchor_j))
+                i, j = anchor_i + 1, anchor_j + 1
+            _match(a, b, i, ahi, j, bhi, matches)
+        elif (ahi - alo) * (bhi - blo) <= FALLBACK_LIMIT:
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for block in matcher.get_matching_blocks():
+                for offset in range(block.size):
+                    matches.append((alo + block.a + offset, blo + block.b + offset))
+    matches.extend(reversed(suffix))
+
+
+def _opcodes(a, b):
+    """Return ('equal' | 'change', i1, i2, j1, j2) runs covering both texts."""
+    matches = []
+    _match(a, b, 0, len(a), 0, len(b), matches)
+    matches.append((len(a), len(b)))
+    opcodes, i, j = [], 0, 0
+    for match_i, match_j in matches:
+        if i < match_i or j < match_j:
+            opcodes.append(['change', i, match_i, j, match_j])
+        if match_i < len(a):
+            if opcodes and opcodes[-1][0] == 'equal':
+                opcodes[-1][2] += 1
+                opcodes[-1][4] += 1
+            else:
+                opcodes.append(['equal', match_i, match_i + 1, match_j, match_j + 1])
+        i, j = match_i + 1, match_j + 1
+    return opcodes
+
+
+def _groups(opcodes):
+    """Split opcodes into hunks with CONTEXT_LINES of context (as difflib)."""
+    if not opcodes:
+        return
+    if opcodes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = opcodes[0]
+        opcodes[0] = [tag, max(i1, i2 - CONTEXT_LINES), i2, max(j1, j2 - CONTEXT_LINES), j2]
+    if opcodes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = opcodes[-1]
+        opcodes[-1] = [tag, i1, min(i2, i1 + CONTEXT_LINES), j1, min(j2, j1 + CONTEXT_LINES)]
+
+    group = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal' and i2 - i1 > 2 * CONTEXT_LINES:
+            group.append([tag, i1, i1 + CONTEXT_LINES, j1, j1 + CONTEXT_LINES])
+            yield group
+            group = []
+            i1, j1 = i2 - CONTEXT_LINES, j2 - CONTEXT_LINES
+        group.append([tag, i1, i2, j1, j2])
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def diff_lines(old, new):
+    """
+    Return a structured diff of two texts: hunks of context (' '), removed
+    ('-') and added ('+') lines, plus counts. ``too_large`` is set instead
+    when the texts have more than ``DIFF_MAX_LINES`` lines between them.
+    """
+    a, b = old.splitlines(), new.splitlines()
+    if len(a) + len(b) > settings.DIFF_MAX_LINES:
+        return {'too_large': True, 'added': None, 'removed': None, 'hunks': []}
+
+    added = removed = 0
+    hunks = []
+    for group in _groups(_opcodes(a, b)):
+        lines = []
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                lines.extend([' ', line] for line in a[i1:i2])
+                continue
+            lines.extend(['-', line] for line in a[i1:i2])
+            lines.extend(['+', line] for line in b[j1:j2])
+            removed += i2 - i1
+            added += j2 - j1
+        hunks.append({
+            'old_start': group[0][1] + 1,
+            'old_count': group[-1][2] - group[0][1],
+            'new_start': group[0][3] + 1,
+            'new_count': group[-1][4] - group[0][3],
+            'lines': lines
+        })
+    return {'too_large': False, 'added': added, 'removed': removed, 'hunks': hunks}
+
+
+class DiffCache:
+    """Thread-safe LRU of computed diffs."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            diff = self._entries.get(key)
+            if diff is not None:
+                self._entries.move_to_end(key)
+            return diff
+
+    def put(self, key, diff):
+        with self._lock:
+            self._entries[key] = diff
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+diff_cache = DiffCache(settings.DIFF_CACHE_SIZE)
+
+
+def diff_versions(old_version, new_version):
+    """Diff two FileVersions, computing it only once per pair."""
+    key = (old_version.pk, new_version.pk)
+    diff = diff_cache.get(key)
+    if diff is None:
+        diff = diff_lines(old_version.content, new_version.content)
+        diff_cache.put(key, diff)
+    return diff
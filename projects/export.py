@@ -0,0 +1,85 @@
+"""
+Streaming ZIP export of a project.
+
+The archive is produced by a generator: each file's head version is written
+to a zipfile.ZipFile backed by a sink that only holds the bytes written
+since the last chunk was yielded. Nothing is seeked back into (the sizes go
+in data descriptors after each entry), so memory use does not depend on the
+size of the project, apart from the central directory written at the end.
+"""
+import posixpath
+import zipfile
+
+from .models import CodeFile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _Sink:
+    """Write-only stream whose contents are taken by the response iterator."""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def archive_name(project, filename):
+    """Path of a file inside the archive, kept under the project folder."""
+    parts = [part for part in filename.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return posixpath.join(f"project-{project.id}", *(parts or ['unnamed']))
+
+
+def iter_zip(project, entries):
+    """
+    Yield the bytes of a ZIP archive of ``entries``, an iterable of
+    ``(filename, content, modified)`` consumed one file at a time.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for filename, content, modified in entries:
+            info = zipfile.ZipInfo(archive_name(project, filename), date_time=modified.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            data = content.encode('utf-8')
+            with archive.open(info, 'w') as entry:
+                for start in range(0, len(data), CHUNK_SIZE):
+                    entry.write(data[start:start + CHUNK_SIZE])
+                    yield from _drain(sink)
+            yield from _drain(sink)
+    yield from _drain(sink)
+
+
+def iter_project_zip(project):
+    """Yield the bytes of a ZIP archive with the latest text of every file."""
+    return iter_zip(project, _head_entries(project))
+
+
+def _head_entries(project):
+    files = CodeFile.objects.filter(project=project).select_related('head__blob').order_by('filename')
+    for code_file in files.iterator(chunk_size=100):
+        version = code_file.get_latest_version()
+        if version is None:
+            yield code_file.filename, '', code_file.updated_at
+        else:
+            yield code_file.filename, version.content, version.created_at
+
+
+def _drain(sink):
+    chunk = sink.take()
+    if chunk:
+        yield chunk
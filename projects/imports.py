@@ -0,0 +1,206 @@
+"""
+Bulk import of files from an uploaded archive.
+
+The archive (zip, or tar with any compression) is read and validated in
+full before anything is written: every name must pass ``CodeFileForm`` and
+must not clash with another file in the archive or the project. The files,
+their blobs and first versions are then written with ``bulk_create`` in one
+transaction, a few queries per thousand files. The search and symbol
+indexes are built after it commits (see ``projects.indexing``).
+"""
+import posixpath
+import tarfile
+import zipfile
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from . import blame
+from .blobs import content_hash, compress
+from .forms import CodeFileForm
+from .models import CodeFile, ContentBlob, FileVersion, Project
+from .search import search_indexer
+from .symbolindex import symbol_indexer
+
+BATCH_SIZE = 500
+
+LANGUAGES_BY_EXTENSION = {
+    '.py': 'python', '.js': 'javascript', '.mjs': 'javascript', '.html': 'html', '.htm': 'html',
+    '.css': 'css', '.java': 'java', '.cpp': 'cpp', '.cc': 'cpp', '.hpp': 'cpp', '.c': 'c',
+    '.h': 'c', '.php': 'php', '.rb': 'ruby', '.go': 'go', '.rs': 'rust', '.swift': 'swift',
+    '.kt': 'kotlin', '.scala': 'scala', '.r': 'r', '.m': 'matlab', '.sql': 'sql', '.sh': 'shell',
+    '.ps1': 'powershell', '.md': 'markdown',
+}
+
+
+class ArchiveError(Exception):
+    """The archive cannot be imported; ``errors`` lists every problem found"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def guess_language(filename):
+    return LANGUAGES_BY_EXTENSION.get(posixpath.splitext(filename)[1].lower(), 'plaintext')
+
+
+def read_archive(fileobj):
+    """Return ``(path, data)`` for every regular file in the archive."""
+    members = []
+    # Bytes unpacked so far, checked against IMPORT_MAX_TOTAL_SIZE
+    unpacked = [0]
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                _check_count(members)
+                with archive.open(info) as entry:
+                    members.append((info.filename, _read_member(entry, unpacked)))
+        return members
+
+    fileobj.seek(0)
+    try:
+        with tarfile.open(fileobj=fileobj, mode='r:*') as archive:
+            for info in archive:
+                if not info.isfile():
+                    continue
+                _check_count(members)
+                members.append((info.name, _read_member(archive.extractfile(info), unpacked)))
+    except tarfile.TarError:
+        raise ArchiveError(['The upload is not a zip or tar archive.'])
+    return members
+
+
+def _check_count(members):
+    if len(members) >= settings.IMPORT_MAX_FILES:
+        raise ArchiveError([f'The archive has more than {settings.IMPORT_MAX_FILES} files.'])
+
+
+def _read_member(entry, unpacked):
+    """
+    Read at most one byte over the file size limit, whatever the header
+    says, and never more than is left of the limit for the whole archive.
+    """
+    left = settings.IMPORT_MAX_TOTAL_SIZE - unpacked[0]
+    data = entry.read(min(settings.IMPORT_MAX_FILE_SIZE, left) + 1)
+    if len(data) > left:
+        raise ArchiveError([f'The archive unpacks to more than {settings.IMPORT_MAX_TOTAL_SIZE} bytes.'])
+    unpacked[0] += len(data)
+    return data
+
+
+def _strip_top_folder(paths):
+    """Drop a folder that every path sits in, as archives of a folder have."""
+    split = [path.replace('\\', '/').lstrip('/').split('/') for path in paths]
+    if split and all(len(parts) > 1 for parts in split) and len({parts[0] for parts in split}) == 1:
+        split = [parts[1:] for parts in split]
+    return ['/'.join(parts) for parts in split]
+
+
+def validate_members(project, members):
+    """
+    Return ``(filename, language, content)`` for every member, or raise
+    ArchiveError listing every member that cannot be imported.
+    """
+    errors = []
+    files = []
+    seen = set()
+    existing = set(project.code_files.values_list('filename', flat=True))
+    for filename, (path, data) in zip(_strip_top_folder([path for path, _ in members]), members):
+        form = CodeFileForm({'filename': filename, 'language': guess_language(filename)})
+        if not form.is_valid():
+            errors.extend(f'{path}: {error}' for field_errors in form.errors.values() for error in field_errors)
+            continue
+        filename = form.cleaned_data['filename']
+        if filename in existing or filename in seen:
+            errors.append(f'{path}: a file named "{filename}" already exists in this project')
+            continue
+        if len(data) > settings.IMPORT_MAX_FILE_SIZE:
+            errors.append(f'{path}: larger than {settings.IMPORT_MAX_FILE_SIZE} bytes')
+            continue
+        try:
+            content = data.decode('utf-8')
+        except UnicodeDecodeError:
+            errors.append(f'{path}: not a UTF-8 text file')
+            continue
+        seen.add(filename)
+        files.append((filename, form.cleaned_data['language'], content))
+
+    if errors:
+        raise ArchiveError(errors)
+    if not files:
+        raise ArchiveError(['The archive contains no files.'])
+    return files
+
+
+def import_archive(project, fileobj, creator):
+    """Create a file with one version for every member of the archive."""
+    files = validate_members(project, read_archive(fileobj))
+    now = datetime.utcnow()
+
+    blobs = {}
+    hashes = []
+    for _, _, content in files:
+        digest = content_hash(content)
+        hashes.append(digest)
+        if digest not in blobs:
+            blobs[digest] = ContentBlob(hash=digest, data=compress(content), size=len(content), created_at=now)
+
+    with transaction.atomic():
+        # Blobs that already exist are shared, not rewritten. Old ones may
+        # be unused and about to be collected, so they are made young first
+        # (as ContentBlob.objects.store does); any collected meanwhile are
+        # simply created again
+        digests = list(blobs)
+        touched_at = timezone.now()
+        for start in range(0, len(digests), BATCH_SIZE):
+            ContentBlob.objects.filter(
+                hash__in=digests[start:start + BATCH_SIZE],
+                created_at__lt=touched_at - ContentBlob.TOUCH_AGE
+            ).update(created_at=touched_at)
+        ContentBlob.objects.bulk_create(blobs.values(), batch_size=BATCH_SIZE, ignore_conflicts=True)
+        code_files = CodeFile.objects.bulk_create(
+            [
+                CodeFile(
+                    project=project,
+                    filename=filename,
+                    language=language,
+                    created_at=now,
+                    updated_at=now,
+                    version_count=1
+                )
+                for filename, language, _ in files
+            ],
+            batch_size=BATCH_SIZE
+        )
+        FileVersion.objects.bulk_create(
+            [
+                FileVersion(
+                    code_file=code_file,
+                    creator=creator,
+                    version_number=1,
+                    blob_id=digest,
+                    content_hash=digest,
+                    blame=blame.advance(None, None, content, 1),
+                    created_at=now
+                )
+                for code_file, digest, (_, _, content) in zip(code_files, hashes, files)
+            ],
+            batch_size=BATCH_SIZE
+        )
+        first_version = FileVersion.objects.filter(code_file=OuterRef('pk'), version_number=1).values('id')[:1]
+        CodeFile.objects.filter(id__in=[code_file.id for code_file in code_files]).update(head=Subquery(first_version))
+        # bulk_create sends no post_save, so move the project page on and
+        # queue the files for indexing here
+        Project.objects.touch(project.id)
+        code_file_ids = [code_file.id for code_file in code_files]
+        transaction.on_commit(lambda: search_indexer.schedule(code_file_ids))
+        python_files = [code_file.id for code_file in code_files if code_file.language == 'python']
+        transaction.on_commit(lambda: symbol_indexer.schedule(python_files))
+    return code_files
@@ -0,0 +1,98 @@
+"""
+Background upkeep of the per-file indexes.
+
+Files are queued once a new head is committed and indexed a batch at a
+time by a small thread pool, so saves do not wait for it. SQLite cannot
+take a second writer while a request holds the database, so there (and
+when no workers are configured) batches run inline instead. A batch that
+fails is retried with backoff and then given up on. Every index records on
+the file row which version it holds, so a file that was given up on stays
+marked stale and is queued again the next time it is looked up.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Files indexed per transaction
+BATCH_SIZE = 200
+# Tries at a failing batch, and the wait before the first retry (seconds)
+ATTEMPTS = 3
+RETRY_DELAY = 1.0
+
+
+class BackgroundIndexer:
+    def __init__(self, name, index, workers_setting):
+        """
+        ``index(code_file_ids)`` brings those files' entries up to their
+        heads and returns how many files it changed.
+        """
+        self.name = name
+        self.index = index
+        self.workers_setting = workers_setting
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def inline(self):
+        return getattr(settings, self.workers_setting) == 0 or connection.vendor == 'sqlite'
+
+    def schedule(self, code_file_ids):
+        code_file_ids = list(code_file_ids)
+        if self.inline():
+            for start in range(0, len(code_file_ids), BATCH_SIZE):
+                self._run(code_file_ids[start:start + BATCH_SIZE], attempts=1)
+            return
+        with self._lock:
+            added = [code_file_id for code_file_id in code_file_ids if code_file_id not in self._queued]
+            self._queued.update(added)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    getattr(settings, self.workers_setting),
+                    thread_name_prefix=f'{self.name}-index'
+                )
+            executor = self._executor
+        for _ in range(0, len(added), BATCH_SIZE):
+            executor.submit(self._run_queued)
+
+    def _run_queued(self):
+        # Dequeued before the work starts, so a save during it queues the file again
+        with self._lock:
+            batch = [self._queued.pop() for _ in range(min(BATCH_SIZE, len(self._queued)))]
+        if not batch:
+            return
+        try:
+            self._run(batch, ATTEMPTS)
+        finally:
+            close_old_connections()
+
+    def _run(self, batch, attempts):
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+                # Drops the connection if the failure left it unusable
+                close_old_connections()
+            try:
+                metrics.increment(f'{self.name}.files_indexed', self.index(batch))
+                return
+            except Exception as e:
+                metrics.increment(f'{self.name}.errors')
+                logger.error(
+                    f"Error indexing {self.name} of {len(batch)} files (try {attempt + 1} of {attempts}): {str(e)}",
+                    exc_info=True
+                )
+        # Left marked stale on their rows, to be queued again when next looked up
+        metrics.increment(f'{self.name}.given_up', len(batch))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from projects.indexing import BATCH_SIZE
+from projects.models import CodeFile
+from projects.search import index_files
+
+
+class Command(BaseCommand):
+    help = "Index the head text of files whose trigram index is behind their head"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Rebuild the index of every file")
+
+    def handle(self, *args, **options):
+        if options['all']:
+            # Checked against the stored postings, so only differences are written
+            CodeFile.objects.update(search_indexed=False)
+        stale = list(CodeFile.objects.filter(search_indexed=False).order_by('id').values_list('id', flat=True))
+        indexed = 0
+        for start in range(0, len(stale), BATCH_SIZE):
+            indexed += index_files(stale[start:start + BATCH_SIZE])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} files"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from projects.models import CodeFile, FileVersion
+
+
+class Command(BaseCommand):
+    help = "Re-encode stored file versions as deltas with periodic keyframes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', type=int, help="Only compress this CodeFile id")
+
+    def handle(self, *args, **options):
+        code_files = CodeFile.objects.order_by('id')
+        if options['file'] is not None:
+            code_files = code_files.filter(id=options['file'])
+
+        total_before = total_after = 0
+        for code_file in code_files.iterator():
+            with transaction.atomic():
+                before, after = FileVersion.objects.rechain(code_file)
+            total_before += before
+            total_after += after
+            self.stdout.write(f"{code_file.project_id}/{code_file.filename}: {before} -> {after} characters")
+
+        saved = total_before - total_after
+        ratio = (saved / total_before * 100) if total_before else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {total_after} characters instead of {total_before} ({ratio:.1f}% saved)"
+        ))
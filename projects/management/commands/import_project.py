@@ -0,0 +1,35 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from projects.imports import ArchiveError, import_archive
+from projects.models import Project
+
+
+class Command(BaseCommand):
+    help = "Create files in a project from a zip or tar archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_id', type=int)
+        parser.add_argument('archive', help="Path to a .zip or .tar(.gz/.bz2/.xz) file")
+        parser.add_argument('--user', help="Username recorded as the creator (default: the project owner)")
+
+    def handle(self, *args, **options):
+        try:
+            project = Project.objects.select_related('owner').get(id=options['project_id'])
+        except Project.DoesNotExist:
+            raise CommandError(f"Project {options['project_id']} does not exist")
+        creator = project.owner
+        if options['user']:
+            try:
+                creator = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist")
+
+        try:
+            with open(options['archive'], 'rb') as archive:
+                code_files = import_archive(project, archive, creator)
+        except OSError as e:
+            raise CommandError(str(e))
+        except ArchiveError as e:
+            raise CommandError("\n".join(["Nothing was imported:"] + e.errors))
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {len(code_files)} files into {project.name}"))
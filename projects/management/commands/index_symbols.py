@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from projects.indexing import BATCH_SIZE
+from projects.symbolindex import index_files, stale_files
+
+
+class Command(BaseCommand):
+    help = "Extract definitions from Python files whose head is not in the symbol table yet"
+
+    def handle(self, *args, **options):
+        stale = list(stale_files().order_by('id').values_list('id', flat=True))
+        indexed = 0
+        for start in range(0, len(stale), BATCH_SIZE):
+            indexed += index_files(stale[start:start + BATCH_SIZE])
+        self.stdout.write(self.style.SUCCESS(f"Indexed definitions of {indexed} files"))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from projects.blobs import content_hash
+from projects.deltas import apply_delta
+from projects.models import CodeFile, ContentBlob, FileVersion
+
+
+class Command(BaseCommand):
+    help = "Move keyframe text into the deduplicated blob store and hash every version"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Versions read and written at a time")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        moved = moved_bytes = 0
+        blobs_before = set(ContentBlob.objects.values_list('hash', flat=True))
+        touched = set()
+
+        for code_file in CodeFile.objects.order_by('id').iterator():
+            with transaction.atomic():
+                versions = FileVersion.objects.filter(code_file=code_file).select_related('blob').order_by('version_number')
+                content = None
+                last_number = 0
+                while True:
+                    # A chunk of version numbers at a time, so a long history
+                    # is never held in memory at once
+                    chunk = list(versions.filter(version_number__gt=last_number)[:batch_size])
+                    if not chunk:
+                        break
+                    for version in chunk:
+                        content = version.keyframe_text() if version.is_keyframe else apply_delta(content, version.delta)
+                        version.content_hash = content_hash(content)
+                        if version.is_keyframe and version.blob_id is None:
+                            version.blob = ContentBlob.objects.store(content)
+                            version.text = ''
+                            moved += 1
+                            moved_bytes += len(content.encode('utf-8'))
+                            touched.add(version.blob_id)
+                    FileVersion.objects.bulk_update(chunk, ['content_hash', 'blob', 'text'])
+                    last_number = chunk[-1].version_number
+
+        new_blobs = ContentBlob.objects.filter(hash__in=touched - blobs_before)
+        stored_bytes = sum(len(data) for data in new_blobs.values_list('data', flat=True).iterator(chunk_size=batch_size))
+        distinct = len(touched)
+        ratio = moved / distinct if distinct else 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {moved} keyframes into {distinct} blobs (dedup ratio {ratio:.2f}); "
+            f"{moved_bytes} bytes of text now take {stored_bytes} bytes, "
+            f"{moved_bytes - stored_bytes} bytes saved"
+        ))
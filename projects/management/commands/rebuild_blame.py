@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from projects.models import CodeFile, FileVersion
+
+
+class Command(BaseCommand):
+    help = "Compute line blame for file versions saved before blame was tracked"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', type=int, help="Only rebuild this CodeFile id")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        code_files = CodeFile.objects.filter(versions__blame__isnull=True).distinct().order_by('id')
+        if options['file'] is not None:
+            code_files = code_files.filter(id=options['file'])
+
+        total = 0
+        for code_file_id in code_files.values_list('id', flat=True):
+            total += FileVersion.objects.rebuild_blame(code_file_id, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Computed blame for {total} versions"))
@@ -0,0 +1,45 @@
+"""
+Lightweight in-process metrics for the collaboration layer.
+
+Counters and timings are kept per worker process and exposed as JSON by the
+``editor_metrics`` view. Values reset when the process restarts.
+"""
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name, value):
+    """Record a timing or size sample under ``name``."""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            _timings[name] = {'count': 1, 'total': value, 'max': value}
+        else:
+            timing['count'] += 1
+            timing['total'] += value
+            timing['max'] = max(timing['max'], value)
+
+
+def snapshot():
+    """Return a copy of all metrics, with averages for timings."""
+    with _lock:
+        timings = {
+            name: dict(timing, avg=timing['total'] / timing['count'])
+            for name, timing in _timings.items()
+        }
+        return {'counters': dict(_counters), 'timings': timings}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timings.clear()
@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0005_fileversion_code_file_alter_codefile_unique_together'),
+    ]
+
+    # Existing rows keep their text in the same column and become keyframes;
+    # ``manage.py compress_versions`` re-encodes them as deltas.
+    operations = [
+        migrations.RenameField(
+            model_name='fileversion',
+            old_name='content',
+            new_name='text',
+        ),
+        migrations.AlterField(
+            model_name='fileversion',
+            name='text',
+            field=models.TextField(blank=True, db_column='content'),
+        ),
+        migrations.AddField(
+            model_name='fileversion',
+            name='delta',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fileversion',
+            name='delta_depth',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='fileversion',
+            name='is_keyframe',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2 on 2026-10-18 08:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def set_heads(apps, schema_editor):
+    CodeFile = apps.get_model('projects', 'CodeFile')
+    FileVersion = apps.get_model('projects', 'FileVersion')
+    for code_file in CodeFile.objects.iterator():
+        versions = list(FileVersion.objects.filter(code_file=code_file).order_by('version_number', 'created_at', 'id'))
+        if not versions:
+            continue
+        # Concurrent saves used to produce duplicate numbers; renumber those
+        # files so the new unique constraint holds
+        numbers = [version.version_number for version in versions]
+        if len(set(numbers)) != len(numbers):
+            for number, version in enumerate(versions, start=1):
+                version.version_number = number
+            FileVersion.objects.bulk_update(versions, ['version_number'])
+        head = versions[-1]
+        CodeFile.objects.filter(pk=code_file.pk).update(head=head, version_count=head.version_number)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0007_content_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='codefile',
+            name='head',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='projects.fileversion'),
+        ),
+        migrations.AddField(
+            model_name='codefile',
+            name='version_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(set_heads, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='fileversion',
+            unique_together={('code_file', 'version_number')},
+        ),
+    ]
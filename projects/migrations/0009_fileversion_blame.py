@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0008_codefile_head'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileversion',
+            name='blame',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
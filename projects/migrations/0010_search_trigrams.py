@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 09:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0009_fileversion_blame'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='codefile',
+            name='search_indexed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='FileTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('code_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigrams', to='projects.codefile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['trigram', 'code_file'], name='projects_fi_trigram_185b21_idx')],
+                'unique_together': {('code_file', 'trigram')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-18 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0010_search_trigrams'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='codefile',
+            name='symbols_version',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='Symbol',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('qualname', models.CharField(max_length=1024)),
+                ('kind', models.CharField(choices=[('class', 'Class'), ('function', 'Function'), ('method', 'Method'), ('variable', 'Variable'), ('attribute', 'Attribute')], max_length=10)),
+                ('line', models.PositiveIntegerField()),
+                ('end_line', models.PositiveIntegerField()),
+                ('code_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='symbols', to='projects.codefile')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='symbols', to='projects.project')),
+            ],
+            options={
+                'ordering': ['line'],
+                'indexes': [models.Index(fields=['project', 'name'], name='projects_sy_project_1a4ec6_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 09:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0011_symbols'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='change_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-18 11:40
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    # The shared cache holds project access lists; with the database backend
+    # its table must exist before the first request. Does nothing for Redis
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0012_project_change_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
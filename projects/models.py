@@ -1,7 +1,13 @@
-from django.db import models
+from django.db import connections, models, transaction
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
-from datetime import datetime
+from django.utils import timezone
+from datetime import datetime, timedelta
+from .deltas import make_delta, apply_delta, delta_size
+from .blobs import content_hash, compress, decompress
+from . import blame
 
 class ProjectMembership(models.Model):
     ROLE_CHOICES = [
@@ -19,15 +25,272 @@ class ProjectMembership(models.Model):
         ordering = ['-joined_at']
         unique_together = ['project', 'user']
 
+class ContentBlobManager(models.Manager):
+    def store(self, text):
+        """Return the blob holding ``text``, creating it if it is new"""
+        digest = content_hash(text)
+        blob, created = self.get_or_create(hash=digest, defaults={'data': compress(text), 'size': len(text)})
+        now = timezone.now()
+        if not created and blob.created_at < now - ContentBlob.TOUCH_AGE:
+            # An old blob may be unused and about to be collected; making
+            # it young keeps it (see projects.retention.collect_blobs)
+            if self.filter(hash=digest).update(created_at=now):
+                blob.created_at = now
+            else:
+                # Collected since it was looked up
+                blob = self.create(hash=digest, data=compress(text), size=len(text))
+        return blob
+
+class ContentBlob(models.Model):
+    """Compressed file text, stored once per distinct content"""
+    hash = models.CharField(max_length=64, primary_key=True)
+    data = models.BinaryField()
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(default=datetime.utcnow)
+
+    # Reused blobs older than this are made young again
+    TOUCH_AGE = timedelta(minutes=10)
+
+    objects = ContentBlobManager()
+
+    @property
+    def text(self):
+        return decompress(self.data)
+
+class VersionConflict(Exception):
+    """A save was based on a version that is no longer the file's head"""
+    def __init__(self, head):
+        super().__init__(f"The file has changed since it was loaded; version {head.version_number} is the latest.")
+        self.head = head
+
+class FileVersionManager(models.Manager):
+    def save_content(self, code_file, content, creator, base_version=None):
+        """
+        Save ``content`` from an editor. Returns ``(version, created)``:
+        content equal to the head's, by hash, is not stored again and the
+        head is returned as it is. With ``base_version``, the save is
+        refused with VersionConflict if the head has moved past it.
+        """
+        with transaction.atomic():
+            # Only the file row is locked: Postgres refuses FOR UPDATE on the
+            # nullable side of the outer join to the head
+            locked = CodeFile.objects.select_for_update(of=('self',)).select_related('head').get(pk=code_file.pk)
+            head = locked.get_latest_version()
+            # Checked first, so a retried save that did go through is not a conflict
+            if head is not None and self._same_content(head, content):
+                return head, False
+            if base_version is not None and head is not None and head.version_number != base_version:
+                raise VersionConflict(head)
+            return self.create_version(code_file, content, creator), True
+
+    def _same_content(self, head, content):
+        digest = content_hash(content)
+        if head.content_hash:
+            return head.content_hash == digest
+        # Versions stored before content hashes were kept are compared by
+        # text, and hashed on the way so the next save compares by hash
+        head_digest = content_hash(head.content)
+        self.filter(pk=head.pk).update(content_hash=head_digest)
+        head.content_hash = head_digest
+        return head_digest == digest
+
+    def create_version(self, code_file, content, creator):
+        """
+        Store ``content`` as the next version of ``code_file``. The version
+        number comes from the file's counter, which is bumped first so the
+        row stays locked until the head pointer is moved to the new version.
+        """
+        with transaction.atomic():
+            CodeFile.objects.filter(pk=code_file.pk).update(version_count=models.F('version_count') + 1)
+            locked = CodeFile.objects.select_related('head__blob').get(pk=code_file.pk)
+            version = self.model(
+                code_file=code_file,
+                creator=creator,
+                version_number=locked.version_count
+            )
+            previous = locked.get_latest_version()
+            version.set_content(content, previous)
+            if previous is None:
+                version.blame = blame.advance(None, None, content, version.version_number)
+            else:
+                version.blame = blame.advance(previous.blame, previous.content, content, version.version_number)
+            version.save()
+            updated_at = datetime.utcnow()
+            # The trigram index catches up after commit (projects.search.search_indexer)
+            CodeFile.objects.filter(pk=code_file.pk).update(head=version, updated_at=updated_at, search_indexed=False)
+
+        code_file.version_count = version.version_number
+        code_file.head = version
+        code_file.updated_at = updated_at
+        return version
+
+    def rechain(self, code_file, batch_size=500):
+        """
+        Re-encode every version of ``code_file`` as deltas with keyframes,
+        e.g. after versions were removed or the keyframe interval changed.
+        Versions are read and rewritten ``batch_size`` version numbers at a
+        time. Returns the number of characters stored before and after.
+        """
+        versions = self.filter(code_file=code_file).select_related('blob').order_by('version_number')
+        stored_before = stored_after = 0
+        previous = content = None
+        last_number = 0
+        while True:
+            chunk = list(versions.filter(version_number__gt=last_number)[:batch_size])
+            if not chunk:
+                break
+            for version in chunk:
+                stored_before += version.stored_size
+                # Decode from the old encoding before overwriting it
+                content = version.keyframe_text() if version.is_keyframe else apply_delta(content, version.delta)
+                version.set_content(content, previous)
+                version.store_blob()
+                stored_after += version.stored_size
+                previous = version
+            self.bulk_update(chunk, ['text', 'delta', 'is_keyframe', 'delta_depth', 'content_hash', 'blob'])
+            last_number = chunk[-1].version_number
+        return stored_before, stored_after
+
+    def rebuild_blame(self, code_file, batch_size=500):
+        """
+        Compute blame for the versions of ``code_file`` that have none, in
+        one pass over its history. Returns the number of versions updated.
+        """
+        with transaction.atomic():
+            versions = self.filter(code_file=code_file).select_related('blob').order_by('version_number')
+            pending = []
+            updated = 0
+            content = runs = None
+            for version in versions.iterator(chunk_size=batch_size):
+                new_content = version.keyframe_text() if version.is_keyframe else apply_delta(content, version.delta)
+                if version.blame is None:
+                    version.blame = blame.advance(runs, content, new_content, version.version_number)
+                    pending.append(version)
+                content, runs = new_content, version.blame
+                if len(pending) >= batch_size:
+                    self.bulk_update(pending, ['blame'])
+                    updated += len(pending)
+                    pending = []
+            self.bulk_update(pending, ['blame'])
+        return updated + len(pending)
+
 class FileVersion(models.Model):
-    content = models.TextField()
+    """
+    One saved state of a file. Most versions only store a delta against the
+    previous version; every ``VERSION_KEYFRAME_INTERVAL`` versions, or when
+    a delta would not be smaller, the full text is stored as a keyframe in a
+    shared ``ContentBlob``. ``content`` rebuilds the text from the nearest
+    keyframe and caches it. ``text`` only holds keyframes written before
+    blobs existed.
+    """
+    text = models.TextField(blank=True, db_column='content')
+    blob = models.ForeignKey(ContentBlob, on_delete=models.PROTECT, related_name='versions', null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    delta = models.JSONField(null=True, blank=True)
+    is_keyframe = models.BooleanField(default=True)
+    delta_depth = models.PositiveIntegerField(default=0)
+    # Run-length [count, version_number] pairs naming the version that last
+    # changed each line; see projects.blame
+    blame = models.JSONField(null=True, blank=True)
     creator = models.ForeignKey(User, on_delete=models.CASCADE)
     version_number = models.IntegerField()
     created_at = models.DateTimeField(default=datetime.utcnow)
     code_file = models.ForeignKey('CodeFile', on_delete=models.CASCADE, related_name='versions', null=True, blank=True)
 
+    objects = FileVersionManager()
+
+    _content = None
+    _pending_blob = None
+
     class Meta:
         ordering = ['-version_number']
+        unique_together = ['code_file', 'version_number']
+
+    @property
+    def stored_size(self):
+        """Characters this version takes up, counting its blob in full"""
+        size = len(self.text) + (delta_size(self.delta) if self.delta else 0)
+        return size + (self.blob.size if self.blob_id else 0)
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self._reconstruct()
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        # Assigning text directly always stores a keyframe
+        self.set_content(value)
+
+    def set_content(self, content, previous=None):
+        """Encode ``content``, as a delta against ``previous`` when worthwhile"""
+        self._content = content
+        self.content_hash = content_hash(content)
+        self.text = ''
+        if previous is not None and previous.delta_depth + 1 < settings.VERSION_KEYFRAME_INTERVAL:
+            delta = make_delta(previous.content, content)
+            if delta_size(delta) < len(content):
+                self.blob = None
+                self.delta = delta
+                self.is_keyframe = False
+                self.delta_depth = previous.delta_depth + 1
+                return
+        # The blob is looked up or written when the version is saved
+        self._pending_blob = content
+        self.delta = None
+        self.is_keyframe = True
+        self.delta_depth = 0
+
+    def store_blob(self):
+        if self._pending_blob is not None:
+            self.blob = ContentBlob.objects.store(self._pending_blob)
+            self._pending_blob = None
+
+    def keyframe_text(self):
+        return self.blob.text if self.blob_id else self.text
+
+    def save(self, *args, **kwargs):
+        self.store_blob()
+        super().save(*args, **kwargs)
+        # The next version is diffed against this one, so keep it warm
+        cache.set(self._cache_key(), self._content, settings.VERSION_CONTENT_CACHE_TTL)
+
+    @staticmethod
+    def content_cache_key(version_id):
+        return f"file_version_content:{version_id}"
+
+    def _cache_key(self):
+        return self.content_cache_key(self.pk)
+
+    def _reconstruct(self):
+        content = cache.get(self._cache_key())
+        if content is not None:
+            return content
+        if self.is_keyframe:
+            content = self.keyframe_text()
+            cache.set(self._cache_key(), content, settings.VERSION_CONTENT_CACHE_TTL)
+            return content
+
+        # The nearest keyframe and every delta after it, in one query
+        keyframe = FileVersion.objects.filter(
+            code_file_id=self.code_file_id,
+            is_keyframe=True,
+            version_number__lt=self.version_number
+        ).order_by('-version_number').values('version_number')[:1]
+        chain = FileVersion.objects.filter(
+            code_file_id=self.code_file_id,
+            version_number__gte=models.Subquery(keyframe),
+            version_number__lte=self.version_number
+        ).order_by('version_number').values_list('text', 'blob__data', 'delta', 'is_keyframe')
+
+        for text, blob_data, delta, is_keyframe in chain:
+            if is_keyframe:
+                content = decompress(blob_data) if blob_data is not None else text
+            else:
+                content = apply_delta(content, delta)
+        cache.set(self._cache_key(), content, settings.VERSION_CONTENT_CACHE_TTL)
+        return content
 
 class CodeFile(models.Model):
     LANGUAGE_CHOICES = [
@@ -48,11 +311,101 @@ class CodeFile(models.Model):
     created_at = models.DateTimeField(default=datetime.utcnow)
     updated_at = models.DateTimeField(default=datetime.utcnow)
     project = models.ForeignKey('Project', on_delete=models.CASCADE, related_name='code_files')
+    # Last version number handed out, and the version it belongs to
+    version_count = models.PositiveIntegerField(default=0)
+    head = models.ForeignKey(FileVersion, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    # Whether the trigram index holds the head's text
+    search_indexed = models.BooleanField(default=False)
+    # Version number whose definitions are in the symbol table
+    symbols_version = models.PositiveIntegerField(null=True, blank=True)
 
     class Meta:
         ordering = ['-updated_at']
         unique_together = ['project', 'filename']
 
+    def get_latest_version(self):
+        """Get the most recent version of the file, or None if it has none"""
+        if self.head_id is not None:
+            return self.head
+        # Versions written directly rather than through create_version
+        return self.versions.order_by('-version_number').first()
+
+class FileTrigramManager(models.Manager):
+    def sync(self, wanted):
+        """
+        Make the index of each file hold exactly ``wanted[code_file_id]``,
+        a set of trigrams. Only postings that appear or vanish are written.
+        """
+        held = {code_file_id: {} for code_file_id in wanted}
+        for posting_id, code_file_id, trigram in self.filter(code_file_id__in=list(wanted)).values_list('id', 'code_file_id', 'trigram').iterator():
+            held[code_file_id][trigram] = posting_id
+        removed = [
+            posting_id
+            for code_file_id, postings in held.items()
+            for trigram, posting_id in postings.items()
+            if trigram not in wanted[code_file_id]
+        ]
+        for start in range(0, len(removed), 500):
+            self.filter(id__in=removed[start:start + 500]).delete()
+        self.insert_postings([
+            (code_file_id, trigram)
+            for code_file_id, trigrams_wanted in wanted.items()
+            for trigram in trigrams_wanted
+            if trigram not in held[code_file_id]
+        ])
+
+    def insert_postings(self, rows):
+        """
+        Insert ``(code_file_id, trigram)`` rows, as many to a statement as
+        the backend allows. This skips bulk_create: building a model
+        instance per posting cost several times more than the inserts.
+        """
+        connection = connections[self.db]
+        meta = self.model._meta
+        fields = [meta.get_field('code_file'), meta.get_field('trigram')]
+        batch_size = max(min(connection.ops.bulk_batch_size(fields, rows), 1000), 1)
+        sql = 'INSERT INTO {} ({}, {}) VALUES '.format(
+            connection.ops.quote_name(meta.db_table),
+            *(connection.ops.quote_name(field.column) for field in fields)
+        )
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                cursor.execute(sql + ', '.join(['(%s, %s)'] * len(batch)), [value for row in batch for value in row])
+
+class FileTrigram(models.Model):
+    """One trigram occurring in the head text of a file, for code search"""
+    code_file = models.ForeignKey(CodeFile, on_delete=models.CASCADE, related_name='trigrams')
+    trigram = models.CharField(max_length=3)
+
+    objects = FileTrigramManager()
+
+    class Meta:
+        unique_together = ['code_file', 'trigram']
+        indexes = [models.Index(fields=['trigram', 'code_file'])]
+
+class Symbol(models.Model):
+    """A definition in the head version of a Python file"""
+    KIND_CHOICES = [
+        ('class', 'Class'),
+        ('function', 'Function'),
+        ('method', 'Method'),
+        ('variable', 'Variable'),
+        ('attribute', 'Attribute'),
+    ]
+
+    project = models.ForeignKey('Project', on_delete=models.CASCADE, related_name='symbols')
+    code_file = models.ForeignKey(CodeFile, on_delete=models.CASCADE, related_name='symbols')
+    name = models.CharField(max_length=255)
+    qualname = models.CharField(max_length=1024)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    line = models.PositiveIntegerField()
+    end_line = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['line']
+        indexes = [models.Index(fields=['project', 'name'])]
+
 class Task(models.Model):
     STATUS_CHOICES = [
         ('todo', 'To Do'),
@@ -94,6 +447,11 @@ class ProjectRequest(models.Model):
     def __str__(self):
         return f"{self.requester.username}'s request to join {self.project.name}"
 
+class ProjectManager(models.Manager):
+    def touch(self, project_id):
+        """Record that something shown on the project's pages changed"""
+        self.filter(pk=project_id).update(change_count=models.F('change_count') + 1, updated_at=datetime.utcnow())
+
 class Project(models.Model):
     LANGUAGE_CHOICES = [
         ('python', 'Python'),
@@ -116,6 +474,10 @@ class Project(models.Model):
     is_public = models.BooleanField(default=False)
     max_members = models.IntegerField(default=5, validators=[MinValueValidator(2), MaxValueValidator(20)])
     members = models.ManyToManyField(User, through='ProjectMembership', related_name='member_projects')
+    # Bumped with updated_at whenever the project page would render differently
+    change_count = models.PositiveIntegerField(default=0)
+    
+    objects = ProjectManager()
     
     class Meta:
         ordering = ['-created_at']
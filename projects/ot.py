@@ -0,0 +1,208 @@
+"""
+Operational transformation for plain-text documents.
+
+An operation is a list of components that walks the whole document from
+left to right:
+
+* a positive ``int`` retains (skips over) that many characters,
+* a ``str`` inserts that text at the current position,
+* a negative ``int`` deletes that many characters.
+
+Lengths are counted in UTF-16 code units so offsets line up with the browser
+editor, which reports positions the same way. The same format is used by
+``static/js/ot.js``.
+"""
+
+
+class OperationError(ValueError):
+    """Raised when an operation is malformed or does not fit the document."""
+
+
+def utf16_len(text):
+    """Return the length of ``text`` in UTF-16 code units."""
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _is_retain(component):
+    return isinstance(component, int) and not isinstance(component, bool) and component > 0
+
+
+def _is_delete(component):
+    return isinstance(component, int) and not isinstance(component, bool) and component < 0
+
+
+def _is_insert(component):
+    return isinstance(component, str)
+
+
+def _retain(operation, count):
+    if count <= 0:
+        return
+    if operation and _is_retain(operation[-1]):
+        operation[-1] += count
+    else:
+        operation.append(count)
+
+
+def _insert(operation, text):
+    if not text:
+        return
+    # Keep inserts in front of deletes so equal operations have one spelling.
+    if operation and _is_insert(operation[-1]):
+        operation[-1] += text
+    elif operation and _is_delete(operation[-1]):
+        if len(operation) > 1 and _is_insert(operation[-2]):
+            operation[-2] += text
+        else:
+            operation.insert(len(operation) - 1, text)
+    else:
+        operation.append(text)
+
+
+def _delete(operation, count):
+    if count <= 0:
+        return
+    if operation and _is_delete(operation[-1]):
+        operation[-1] -= count
+    else:
+        operation.append(-count)
+
+
+def normalize(operation):
+    """
+    Validate a decoded operation and return it in canonical form.
+    Adjacent components of the same kind are merged and no-ops are dropped.
+    """
+    if not isinstance(operation, list):
+        raise OperationError("Operation must be a list")
+    result = []
+    for component in operation:
+        if component == 0 and not isinstance(component, bool):
+            continue
+        if _is_retain(component):
+            _retain(result, component)
+        elif _is_delete(component):
+            _delete(result, -component)
+        elif _is_insert(component):
+            _insert(result, component)
+        else:
+            raise OperationError(f"Invalid operation component: {component!r}")
+    return result
+
+
+def base_length(operation):
+    """Length of the document the operation can be applied to."""
+    return sum(c if _is_retain(c) else -c for c in operation if not _is_insert(c))
+
+
+def target_length(operation):
+    """Length of the document after the operation has been applied."""
+    return sum(c if _is_retain(c) else utf16_len(c) for c in operation if not _is_delete(c))
+
+
+def is_noop(operation):
+    """True if the operation leaves every document unchanged."""
+    return all(_is_retain(c) for c in operation)
+
+
+def replace(old, new):
+    """
+    An operation turning ``old`` into ``new``: the text they share at
+    either end is retained and only the middle is replaced.
+    """
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[len(old) - 1 - suffix] == new[len(new) - 1 - suffix]:
+        suffix += 1
+    operation = []
+    _retain(operation, utf16_len(old[:prefix]))
+    _insert(operation, new[prefix:len(new) - suffix])
+    _delete(operation, utf16_len(old[prefix:len(old) - suffix]))
+    _retain(operation, utf16_len(old[len(old) - suffix:]))
+    return operation
+
+
+def apply(text, operation):
+    """Apply ``operation`` to ``text`` and return the new text."""
+    if base_length(operation) != utf16_len(text):
+        raise OperationError("Operation base length does not match the document")
+    if text.isascii():
+        parts, index = [], 0
+        for component in operation:
+            if _is_retain(component):
+                parts.append(text[index:index + component])
+                index += component
+            elif _is_delete(component):
+                index -= component
+            else:
+                parts.append(component)
+        return ''.join(parts)
+
+    # Slice on the UTF-16 encoding so that offsets match the client's.
+    data = text.encode('utf-16-le')
+    parts, index = [], 0
+    for component in operation:
+        if _is_retain(component):
+            parts.append(data[index:index + 2 * component])
+            index += 2 * component
+        elif _is_delete(component):
+            index -= 2 * component
+        else:
+            parts.append(component.encode('utf-16-le'))
+    try:
+        return b''.join(parts).decode('utf-16-le')
+    except UnicodeDecodeError:
+        raise OperationError("Operation splits a surrogate pair")
+
+
+def transform(a, b):
+    """
+    Transform two concurrent operations ``a`` and ``b`` that apply to the
+    same document. Returns ``(a', b')`` such that applying ``a`` then ``b'``
+    gives the same result as applying ``b`` then ``a'``. When both insert at
+    the same position, ``a``'s text ends up first.
+    """
+    if base_length(a) != base_length(b):
+        raise OperationError("Concurrent operations must share a base length")
+
+    a_prime, b_prime = [], []
+    ia, ib = iter(a), iter(b)
+    ca, cb = next(ia, None), next(ib, None)
+    while ca is not None or cb is not None:
+        if ca is not None and _is_insert(ca):
+            _insert(a_prime, ca)
+            _retain(b_prime, utf16_len(ca))
+            ca = next(ia, None)
+            continue
+        if cb is not None and _is_insert(cb):
+            _retain(a_prime, utf16_len(cb))
+            _insert(b_prime, cb)
+            cb = next(ib, None)
+            continue
+        if ca is None or cb is None:
+            raise OperationError("Operations have different lengths")
+
+        len_a = abs(ca)
+        len_b = abs(cb)
+        step = min(len_a, len_b)
+        if _is_retain(ca) and _is_retain(cb):
+            _retain(a_prime, step)
+            _retain(b_prime, step)
+        elif _is_delete(ca) and _is_retain(cb):
+            _delete(a_prime, step)
+        elif _is_retain(ca) and _is_delete(cb):
+            _delete(b_prime, step)
+        # Both deleting the same range: nothing left to do for either side.
+
+        ca = _shrink(ca, step) if len_a > step else next(ia, None)
+        cb = _shrink(cb, step) if len_b > step else next(ib, None)
+    return a_prime, b_prime
+
+
+def _shrink(component, step):
+    return component - step if component > 0 else component + step
@@ -0,0 +1,195 @@
+"""
+Refusing regular expressions whose matching time can blow up.
+
+Python's ``re`` backtracks and a running match cannot be interrupted, so a
+user pattern is checked before it runs. Refused are:
+
+* backreferences, and quantifiers over variable-length quantifiers, which
+  can take exponential time,
+* repeated alternatives that do not start with distinct characters, for
+  the same reason,
+* two variable-length repeats that can split the same run of text between
+  them, such as ``.*.*`` or ``.*=.*``. Each such pair multiplies the work
+  by the length of the line. Repeats are fine when something only the
+  later one can match separates them, as in ``\\w+\\(\\s*``.
+
+What is left takes time at most quadratic in the length of a line.
+"""
+import re
+
+from .trigrams import sre_constants, sre_parse
+
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+# Constructs that never backtrack into what they matched (Python 3.11+)
+_POSSESSIVE_REPEAT = getattr(sre_constants, 'POSSESSIVE_REPEAT', None)
+_ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+_ATOMIC = tuple(op for op in (_POSSESSIVE_REPEAT, _ATOMIC_GROUP) if op is not None)
+_ZERO_WIDTH = (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: re.compile(r'\d'),
+    sre_constants.CATEGORY_NOT_DIGIT: re.compile(r'\D'),
+    sre_constants.CATEGORY_SPACE: re.compile(r'\s'),
+    sre_constants.CATEGORY_NOT_SPACE: re.compile(r'\S'),
+    sre_constants.CATEGORY_WORD: re.compile(r'\w'),
+    sre_constants.CATEGORY_NOT_WORD: re.compile(r'\W'),
+}
+# Characters two character sets are compared on, besides the ones named
+# in the pattern: ASCII and a few from each Unicode category
+_SAMPLE = [chr(code) for code in range(9, 127)] + list(' éßΩ ٣中\U0001f600')
+
+
+class PatternError(ValueError):
+    pass
+
+
+def check_pattern(pattern):
+    """Raise PatternError if matching ``pattern`` can take too long"""
+    parsed = sre_parse.parse(pattern)
+    sample = set(_SAMPLE)
+    _named_characters(parsed, sample)
+    # Case is ignored when sets are compared, which only refuses more
+    sample |= {variant for char in sample for variant in (char.lower(), char.upper()) if len(variant) == 1}
+    _check_nesting(parsed)
+    _check_sequence(parsed, sorted(sample))
+
+
+def _named_characters(items, sample):
+    for op, arg in items:
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL):
+            sample.add(chr(arg))
+        elif op is sre_constants.RANGE:
+            sample.update((chr(arg[0]), chr(arg[1])))
+        elif op is sre_constants.IN:
+            _named_characters(arg, sample)
+        else:
+            for part in _parts(op, arg):
+                _named_characters(part, sample)
+
+
+def _parts(op, arg):
+    """The sub-sequences of one parsed item"""
+    if op in _REPEATS or op is _POSSESSIVE_REPEAT:
+        return [arg[2]]
+    if op is _ATOMIC_GROUP:
+        return [arg]
+    if op is sre_constants.SUBPATTERN:
+        return [arg[-1]]
+    if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return [arg[1]]
+    if op is sre_constants.BRANCH:
+        return arg[1]
+    return []
+
+
+def _first_literal(items):
+    if items and items[0][0] is sre_constants.LITERAL:
+        return chr(items[0][1]).lower()
+    return None
+
+
+def _check_nesting(items, repeated=False):
+    for op, arg in items:
+        if op in _ATOMIC:
+            continue
+        if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+            raise PatternError("Backreferences are not supported.")
+        if op in _REPEATS:
+            low, high, body = arg
+            if repeated and low != high:
+                raise PatternError("Nested quantifiers are not supported.")
+            _check_nesting(body, repeated or high > 1)
+        elif op is sre_constants.BRANCH:
+            branches = arg[1]
+            if repeated:
+                # Repeated branches must be told apart by their first character
+                firsts = [_first_literal(branch) for branch in branches]
+                if None in firsts or len(set(firsts)) < len(firsts):
+                    raise PatternError("Repeated alternatives must start with different characters.")
+            for branch in branches:
+                _check_nesting(branch, repeated)
+        else:
+            for part in _parts(op, arg):
+                _check_nesting(part, repeated)
+
+
+def _matches(op, arg, char):
+    """Whether the one-character item ``(op, arg)`` matches ``char``"""
+    if op is sre_constants.LITERAL:
+        return char == chr(arg)
+    if op is sre_constants.NOT_LITERAL:
+        return char != chr(arg)
+    if op is sre_constants.ANY:
+        return True
+    if op is sre_constants.RANGE:
+        return arg[0] <= ord(char) <= arg[1]
+    if op is sre_constants.CATEGORY:
+        return _CATEGORIES.get(arg, re.compile('.')).match(char) is not None
+    if op is sre_constants.IN:
+        negated = bool(arg) and arg[0][0] is sre_constants.NEGATE
+        members = arg[1:] if negated else arg
+        return any(_matches(member_op, member_arg, char) for member_op, member_arg in members) != negated
+    return False
+
+
+def _characters(items, sample):
+    """The sample characters any one-character item in ``items`` can match"""
+    found = set()
+    for op, arg in items:
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+            found.update(char for char in sample if _matches(op, arg, char))
+        else:
+            for part in _parts(op, arg):
+                found |= _characters(part, sample)
+    return found
+
+
+def _overlap(first, second):
+    return any(char.lower() in second or char.upper() in second for char in first)
+
+
+def _has_repeat(items):
+    for op, arg in items:
+        if op in _REPEATS and arg[0] != arg[1]:
+            return True
+        if op not in _ATOMIC and any(_has_repeat(part) for part in _parts(op, arg)):
+            return True
+    return False
+
+
+def _check_sequence(items, sample, live=None):
+    """
+    Walk ``items`` left to right keeping the character sets of the
+    variable-length repeats that could still take more text (``live``).
+    A repeat that overlaps a live one is refused; a character a live
+    repeat cannot match ends it. Returns the repeats still live.
+    """
+    live = [] if live is None else live
+    for op, arg in items:
+        if op is sre_constants.SUBPATTERN:
+            live = _check_sequence(arg[-1], sample, live)
+            continue
+        if op in _ZERO_WIDTH:
+            for part in _parts(op, arg):
+                _check_sequence(part, sample)
+            continue
+        if op in _ATOMIC:
+            continue
+        characters = _characters([(op, arg)], sample)
+        variable = (op in _REPEATS and arg[0] != arg[1]) or (op is sre_constants.BRANCH and _has_repeat([(op, arg)]))
+        if op is sre_constants.BRANCH:
+            for branch in arg[1]:
+                _check_sequence(branch, sample)
+        elif op in _REPEATS:
+            _check_sequence(arg[2], sample)
+        if variable and any(_overlap(characters, earlier) for earlier in live):
+            raise PatternError(
+                "Repeats that can match the same characters must be separated by "
+                "a character the first one cannot match (try a literal instead of .*)."
+            )
+        required = op not in _REPEATS or arg[0] > 0
+        if required and op is not sre_constants.BRANCH:
+            # Text the earlier repeats cannot take ends them
+            live = [earlier for earlier in live if _overlap(characters, earlier)]
+        if variable:
+            live.append(characters)
+    return live
@@ -0,0 +1,100 @@
+"""
+Partial responses for file text.
+
+Two kinds of range are understood: an HTTP ``Range: bytes=`` header over
+the UTF-8 encoding of the text (single ranges only; anything else is
+answered with the whole text, as RFC 9110 allows), and a ``lines=a-b``
+query parameter, 1-based and inclusive, with either end optional. Whole
+and line-range bodies are gzipped for clients that accept it; byte ranges
+are not, so that offsets keep referring to the text.
+"""
+import re
+
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+_BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_LINE_RANGE = re.compile(r'^(\d*)-(\d*)$')
+
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_LENGTH = 200
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_byte_range(header, length):
+    """
+    Return ``(start, end)``, end exclusive, for a ``Range`` header, or None
+    when the header should be ignored.
+    """
+    match = _BYTE_RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # bytes=-N is the last N bytes
+        start, end = max(length - int(last), 0), length
+    else:
+        start = int(first)
+        end = min(int(last) + 1, length) if last else length
+    if start >= length or start >= end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def parse_line_range(value):
+    """Return ``(first, last)`` line numbers from ``a-b``; last may be None."""
+    match = _LINE_RANGE.match(value.strip())
+    if not match or match.groups() == ('', ''):
+        raise ValueError(f"Invalid line range: {value}")
+    first, last = match.groups()
+    first = int(first) if first else 1
+    last = int(last) if last else None
+    if first < 1 or (last is not None and last < first):
+        raise ValueError(f"Invalid line range: {value}")
+    return first, last
+
+
+def text_response(request, content):
+    """Serve ``content`` honouring ``?lines=``, ``Range`` and gzip."""
+    content_type = 'text/plain; charset=utf-8'
+    lines = request.GET.get('lines')
+    if lines is not None:
+        first, last = parse_line_range(lines)
+        all_lines = content.splitlines(keepends=True)
+        body = ''.join(all_lines[first - 1:last]).encode('utf-8')
+        response = _maybe_gzip(request, HttpResponse(body, content_type=content_type))
+        response['X-Total-Lines'] = len(all_lines)
+        return response
+
+    data = content.encode('utf-8')
+    header = request.headers.get('Range')
+    if header:
+        try:
+            byte_range = parse_byte_range(header, len(data))
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{len(data)}'
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            response = HttpResponse(data[start:end], content_type=content_type, status=206)
+            response['Content-Range'] = f'bytes {start}-{end - 1}/{len(data)}'
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+    response = _maybe_gzip(request, HttpResponse(data, content_type=content_type))
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _maybe_gzip(request, response):
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if len(response.content) < GZIP_MIN_LENGTH or 'gzip' not in request.headers.get('Accept-Encoding', ''):
+        return response
+    response.content = compress_string(response.content)
+    response['Content-Encoding'] = 'gzip'
+    return response
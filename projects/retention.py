@@ -0,0 +1,209 @@
+"""
+Retention policy and compaction for file versions.
+
+``VERSION_RETENTION`` is a list of tiers, youngest first. A version falls in
+the first tier whose ``age`` (seconds) it is younger than; the last tier
+should have no age and covers everything older. Within a tier, time is cut
+into ``bucket``-second windows and only the newest version of each window is
+kept, per author when ``per_author`` is set. A tier without a bucket keeps
+every version. The head of a file is always kept.
+
+Removing a version breaks the delta of the version after it, so compaction
+walks the file from its oldest version, rebuilding each text on the way,
+and re-encodes the versions it keeps against the previous kept version.
+"""
+import logging
+from collections import namedtuple
+from itertools import chain
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Exists, Min, OuterRef
+from django.utils import timezone
+
+from . import blame
+from .deltas import apply_delta
+from .models import CodeFile, ContentBlob, FileVersion
+
+logger = logging.getLogger(__name__)
+
+Tier = namedtuple('Tier', ['age', 'bucket', 'per_author'])
+
+# Blobs younger than this are not collected, in case a save that is still
+# in flight is about to point a new version at them. It must be well above
+# ContentBlob.TOUCH_AGE, after which a reused blob is made young again
+BLOB_GRACE = timedelta(hours=1)
+# Characters of rewritten text held before they are written out
+REWRITE_BATCH_CHARS = 8 * 1024 * 1024
+
+
+def parse_policy(tiers):
+    return [
+        Tier(
+            timedelta(seconds=tier['age']) if tier.get('age') is not None else None,
+            tier.get('bucket'),
+            tier.get('per_author', False)
+        )
+        for tier in tiers
+    ]
+
+
+class RetentionPolicy:
+    def __init__(self, tiers, now=None):
+        self.tiers = parse_policy(tiers)
+        self.now = now or timezone.now()
+
+    def tier_for(self, created_at):
+        age = self.now - created_at
+        for index, tier in enumerate(self.tiers):
+            if tier.age is None or age < tier.age:
+                return index, tier
+        return None, None
+
+    def expired(self, versions):
+        """
+        Yield the ids to remove from ``versions``, an iterable of
+        ``(id, creator_id, created_at)`` ordered newest first. Only the last
+        window seen per author is remembered, so memory stays constant.
+        """
+        last_window = {}
+        for version_id, creator_id, created_at in versions:
+            if timezone.is_naive(created_at):
+                created_at = timezone.make_aware(created_at, dt_timezone.utc)
+            index, tier = self.tier_for(created_at)
+            if tier is None or tier.bucket is None:
+                continue
+            author = creator_id if tier.per_author else None
+            window = (index, int(created_at.timestamp()) // tier.bucket)
+            if last_window.get(author) == window:
+                yield version_id
+            else:
+                last_window[author] = window
+
+
+def _expired_blocks(versions, policy, batch_size):
+    """
+    Yield ``(first, last, expired_ids)`` for the versions of a file, a
+    block of ``batch_size`` version numbers at a time, oldest first.
+    Whether a version expires only depends on the nearest newer version of
+    each author, so a block is decided from those rows and its own.
+    """
+    rows = versions.order_by('version_number').values_list('id', 'creator_id', 'created_at', 'version_number')
+    last = None
+    while True:
+        block = list((rows if last is None else rows.filter(version_number__gt=last))[:batch_size])
+        if not block:
+            return
+        first, last = block[0][3], block[-1][3]
+        nearest = (
+            versions.filter(version_number__gt=last).order_by().values('creator_id')
+            .annotate(first=Min('version_number')).values_list('first', flat=True)
+        )
+        newer = list(rows.filter(version_number__in=list(nearest)).order_by('-version_number'))
+        ids = {row[0] for row in block}
+        expired = {
+            version_id
+            for version_id in policy.expired(row[:3] for row in chain(newer, reversed(block)))
+            if version_id in ids
+        }
+        yield first, last, expired
+
+
+def compact_file(code_file_id, policy, batch_size=500, dry_run=False):
+    """
+    Apply ``policy`` to one file. Returns ``(removed, rewritten)`` counts.
+    The file row stays locked for the duration, so saves to the file wait
+    instead of racing the rewrite. Versions are decided, removed and
+    rewritten a block at a time, so memory does not grow with the history.
+    """
+    with transaction.atomic():
+        code_file = CodeFile.objects.select_for_update().get(pk=code_file_id)
+        versions = FileVersion.objects.filter(code_file_id=code_file_id)
+        removed_count = rewritten_count = 0
+        content = previous = None
+        dirty = False
+        for first, last, expired in _expired_blocks(versions, policy, batch_size):
+            expired.discard(code_file.head_id)
+            removed_count += len(expired)
+            if dry_run or not (expired or dirty):
+                # Nothing before the first removal is rewritten
+                continue
+            if not dirty:
+                # Deltas are applied on top of the version before the block
+                previous = versions.filter(version_number__lt=first).order_by('-version_number').first()
+                content = previous.content if previous is not None else None
+
+            removed, rewritten, rewritten_chars = [], [], 0
+            block = versions.select_related('blob').filter(version_number__gte=first, version_number__lte=last)
+            for version in block.order_by('version_number').iterator(chunk_size=batch_size):
+                content = version.keyframe_text() if version.is_keyframe else apply_delta(content, version.delta)
+                if version.id in expired:
+                    removed.append(version.id)
+                    dirty = True
+                elif dirty:
+                    # Lines last changed by a removed version now belong to the next kept one
+                    if previous is None:
+                        version.blame = blame.advance(None, None, content, version.version_number)
+                    else:
+                        version.blame = blame.advance(previous.blame, previous.content, content, version.version_number)
+                    version.set_content(content, previous)
+                    version.store_blob()
+                    rewritten.append(version)
+                    rewritten_chars += len(content)
+                    previous = version
+                else:
+                    version._content = content
+                    previous = version
+
+                # Rewritten versions hold their full text until they are saved
+                if len(rewritten) >= batch_size or rewritten_chars >= REWRITE_BATCH_CHARS:
+                    _save_encoding(rewritten)
+                    rewritten_count += len(rewritten)
+                    rewritten, rewritten_chars = [], 0
+
+            FileVersion.objects.filter(id__in=removed).delete()
+            _save_encoding(rewritten)
+            rewritten_count += len(rewritten)
+
+        if removed_count and not dry_run:
+            # History pages are validated against updated_at, and just lost entries
+            CodeFile.objects.filter(pk=code_file_id).update(updated_at=timezone.now())
+
+    if removed_count and not dry_run:
+        logger.info(f"Compacted file {code_file_id}: removed {removed_count} versions, rewrote {rewritten_count}")
+    return removed_count, rewritten_count
+
+
+def _save_encoding(versions):
+    FileVersion.objects.bulk_update(
+        versions,
+        ['text', 'delta', 'is_keyframe', 'delta_depth', 'content_hash', 'blob', 'blame']
+    )
+
+
+def collect_blobs(batch_size=500):
+    """
+    Delete blobs that no version points at any more. A save that reuses an
+    old blob makes it young again (see ``ContentBlob.objects.store``), so
+    each batch is locked and checked again before it is deleted: the save
+    either keeps its blob or finds it gone and stores it again.
+    """
+    cutoff = timezone.now() - BLOB_GRACE
+    unused = ContentBlob.objects.filter(
+        ~Exists(FileVersion.objects.filter(blob_id=OuterRef('pk'))),
+        created_at__lt=cutoff
+    )
+    deleted = 0
+    last = ''
+    while True:
+        with transaction.atomic():
+            hashes = list(
+                unused.select_for_update().filter(hash__gt=last).order_by('hash')
+                .values_list('hash', flat=True)[:batch_size]
+            )
+            if not hashes:
+                return deleted
+            last = hashes[-1]
+            # Read after the lock was taken, so versions saved meanwhile count
+            count, _ = unused.filter(hash__in=hashes).delete()
+            deleted += count
@@ -0,0 +1,301 @@
+"""
+In-process state for collaborative editing rooms.
+
+A room exists per ``project_{id}_file_{id}`` group while sockets are
+connected to it, and lingers for ``EDITOR_ROOM_TTL`` seconds after the last
+one leaves. It is the authoritative copy of the document: it holds the
+current text, a revision counter and the recent operations needed to
+transform edits made against an older revision. That history is a bounded
+ring buffer keyed by revision, which also lets a reconnecting client catch up
+on what it missed instead of downloading the whole document again. Joiners
+are served from the room, and the text is checkpointed to the database on a
+fixed schedule rather than on every edit.
+
+A room also knows which stored version its text is based on. Checkpoints
+are saved against that version, so they are refused rather than written
+over a version saved from outside the room (an HTTP save). The room merges
+such a version into its text as one more operation when it is told about
+it, keeping the edits it had not saved yet.
+
+Cursor positions are aggregated per room as well. Only the latest position
+per user is kept, and changes are published as one batch per presence tick.
+
+Rooms also keep the send queues of their members and count what those
+queues dropped, so ``room_stats`` can report backpressure per room.
+"""
+import asyncio
+import logging
+import secrets
+from collections import deque, namedtuple
+
+from django.conf import settings
+
+from . import ot
+
+logger = logging.getLogger(__name__)
+
+HISTORY_SIZE = getattr(settings, 'EDITOR_HISTORY_SIZE', 500)
+
+_rooms = {}
+
+# One applied operation; ``client_id`` identifies the tab that sent it so a
+# reconnecting author can recognise its own edits.
+Update = namedtuple('Update', ['revision', 'operation', 'user', 'client_id'])
+
+
+def room_group_name(project_id, file_id):
+    return f"project_{project_id}_file_{file_id}"
+
+
+class Room:
+    def __init__(self, name, file_id, content, save, publish_presence=None, revision=0, version=None):
+        """
+        ``save(file_id, content, author, base_version)`` is called with the
+        current text whenever the room is checkpointed and has unsaved
+        revisions. ``version`` is the number of the version ``content`` was
+        loaded from.
+        ``publish_presence(room, cursors)`` is awaited once per presence tick
+        with the cursors that moved since the previous tick.
+        """
+        self.name = name
+        self.file_id = file_id
+        self.content = content
+        self.save = save
+        self.revision = revision
+        # Revisions restart when a room is recreated, so clients also need
+        # to know which incarnation of the room a revision belongs to
+        self.epoch = secrets.token_hex(4)
+        self.saved_revision = revision
+        self.version = version
+        self.last_author = None
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.members = set()
+        self.send_queues = {}
+        self.dropped_presence = 0
+        self.collapsed_updates = 0
+        self.slow_disconnects = 0
+        self.lock = asyncio.Lock()
+        self.publish_presence = publish_presence
+        self.presence = {}
+        self._presence_changed = set()
+        self._presence_flush = None
+        self._tasks = set()
+        self._checkpointer = None
+        self._eviction = None
+
+    @property
+    def dirty(self):
+        return self.revision != self.saved_revision
+
+    def checkpoint(self):
+        """Hand the current text to ``save`` if it changed since last time."""
+        if not self.dirty:
+            return False
+        self.save(self.file_id, self.content, self.last_author, self.version)
+        self.saved_revision = self.revision
+        return True
+
+    def saved(self, version_number):
+        """Record that a checkpoint was stored as ``version_number``."""
+        if self.version is None or version_number > self.version:
+            self.version = version_number
+
+    def adopt(self, base, content, version_number, user=None):
+        """
+        Take over a version that was saved from outside the room, turning
+        ``base`` into ``content``. That change is transformed against what
+        the room did to ``base`` and applied as one operation, which is
+        returned (None if it changes nothing) so that it can be broadcast
+        like any other. Edits the room had not saved yet are kept and saved
+        on top of the new version.
+        """
+        self.version = version_number
+        theirs = ot.replace(base, content)
+        ours = ot.replace(base, self.content)
+        operation = ot.transform(theirs, ours)[0]
+        if ot.is_noop(operation):
+            operation = None
+        else:
+            self.content = ot.apply(self.content, operation)
+            self.revision += 1
+            self.history.append(Update(self.revision, operation, user, None))
+        if self.content == content:
+            self.saved_revision = self.revision
+        elif not self.dirty:
+            # Revisions start at 0, so this marks the text as unsaved
+            self.saved_revision = -1
+        return operation
+
+    def update_presence(self, user, position):
+        """Record a cursor move; it is published on the next presence tick."""
+        self.presence[user] = position
+        self._presence_changed.add(user)
+        if self._presence_flush is None and self.publish_presence is not None:
+            loop = asyncio.get_running_loop()
+            tick = getattr(settings, 'EDITOR_PRESENCE_TICK', 0.03)
+            self._presence_flush = loop.call_later(tick, self._flush_presence)
+
+    def remove_presence(self, user):
+        self.presence.pop(user, None)
+        self._presence_changed.discard(user)
+
+    def _flush_presence(self):
+        self._presence_flush = None
+        cursors = {user: self.presence[user] for user in self._presence_changed}
+        self._presence_changed.clear()
+        if not cursors:
+            return
+        task = asyncio.ensure_future(self.publish_presence(self, cursors))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def start(self):
+        self._checkpointer = asyncio.ensure_future(self._checkpoint_periodically())
+
+    def stop(self):
+        if self._checkpointer is not None:
+            self._checkpointer.cancel()
+            self._checkpointer = None
+        if self._presence_flush is not None:
+            self._presence_flush.cancel()
+            self._presence_flush = None
+        self.checkpoint()
+
+    async def _checkpoint_periodically(self):
+        while True:
+            await asyncio.sleep(getattr(settings, 'EDITOR_CHECKPOINT_INTERVAL', 1.0))
+            try:
+                self.checkpoint()
+            except Exception as e:
+                logger.error(f"Error checkpointing {self.name}: {str(e)}", exc_info=True)
+
+    def updates_since(self, revision):
+        """
+        Return the updates applied after ``revision``, or None when they are
+        no longer all in the history buffer.
+        """
+        if not isinstance(revision, int) or isinstance(revision, bool):
+            return None
+        missed = self.revision - revision
+        if missed < 0 or missed > len(self.history):
+            return None
+        if missed == 0:
+            return []
+        return list(self.history)[-missed:]
+
+    def apply_operation(self, revision, operation, author=None, client_id=None):
+        """
+        Apply a client operation made against ``revision`` and return it
+        transformed against everything that happened since.
+        """
+        if not isinstance(revision, int) or isinstance(revision, bool) or revision < 0:
+            raise ot.OperationError("Operation needs a base revision")
+        if revision > self.revision:
+            raise ot.OperationError("Operation is based on an unknown revision")
+        missed = self.updates_since(revision)
+        if missed is None:
+            raise ot.OperationError("Operation is too old to be transformed")
+
+        operation = ot.normalize(operation)
+        for concurrent in missed:
+            operation = ot.transform(operation, concurrent.operation)[0]
+
+        self.content = ot.apply(self.content, operation)
+        self.revision += 1
+        self.history.append(Update(
+            self.revision,
+            operation,
+            author.username if author is not None else None,
+            client_id
+        ))
+        if author is not None:
+            self.last_author = author
+        return operation
+
+
+async def join_room(name, file_id, channel_name, load_content, save, publish_presence=None, send_queue=None):
+    """
+    Register ``channel_name`` as a member of the room, creating the room from
+    ``load_content()``, which returns the text and the number of the version
+    it was read from, if this process does not have it yet. ``send_queue``
+    is the member's outbound queue, reported by ``room_stats``.
+    """
+    room = _rooms.get(name)
+    if room is None:
+        content, version = await load_content()
+        # Another socket may have created the room while we were loading.
+        room = _rooms.get(name)
+        if room is None:
+            room = _rooms[name] = Room(name, file_id, content, save, publish_presence, version=version)
+            room.start()
+    if room._eviction is not None:
+        room._eviction.cancel()
+        room._eviction = None
+    room.members.add(channel_name)
+    if send_queue is not None:
+        room.send_queues[channel_name] = send_queue
+    return room
+
+
+def leave_room(name, channel_name):
+    """
+    Remove a member. An empty room is checkpointed and kept warm for
+    ``EDITOR_ROOM_TTL`` seconds in case someone rejoins, then evicted.
+    """
+    room = _rooms.get(name)
+    if room is None:
+        return None
+    room.members.discard(channel_name)
+    room.send_queues.pop(channel_name, None)
+    if not room.members:
+        room.checkpoint()
+        if room._eviction is None:
+            loop = asyncio.get_running_loop()
+            ttl = getattr(settings, 'EDITOR_ROOM_TTL', 60.0)
+            room._eviction = loop.call_later(ttl, _evict, name)
+    return room
+
+
+def _evict(name):
+    room = _rooms.get(name)
+    if room is None or room.members:
+        return
+    del _rooms[name]
+    room._eviction = None
+    room.stop()
+    logger.info(f"Evicted idle room {name} at revision {room.revision}")
+
+
+def get_room(name):
+    return _rooms.get(name)
+
+
+def file_room(file_id):
+    """The room of a file in this process, if there is one"""
+    return next((room for room in _rooms.values() if room.file_id == file_id), None)
+
+
+def checkpoint_all():
+    """Checkpoint every room; used when the worker shuts down."""
+    for room in list(_rooms.values()):
+        try:
+            room.checkpoint()
+        except Exception as e:
+            logger.error(f"Error checkpointing {room.name}: {str(e)}", exc_info=True)
+
+
+def room_stats():
+    """Send queue depth and drop counts of every room in this process."""
+    stats = {}
+    for name, room in list(_rooms.items()):
+        depths = [queue.depth(room.file_id) for queue in room.send_queues.values()]
+        stats[name] = {
+            'members': len(room.members),
+            'revision': room.revision,
+            'queue_depth': sum(depths),
+            'max_queue_depth': max(depths, default=0),
+            'dropped_presence': room.dropped_presence,
+            'collapsed_updates': room.collapsed_updates,
+            'slow_disconnects': room.slow_disconnects,
+        }
+    return stats
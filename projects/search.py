@@ -0,0 +1,168 @@
+"""
+Code search over the head text of a project's files.
+
+The pattern is turned into a trigram query (see ``projects.trigrams``), the
+files that can match are found from the index in one query, and only those
+files are read and searched line by line, until enough lines matched. A
+pattern that needs no trigram at all (shorter than three literal
+characters) would need every file read, so it is refused.
+
+Python's ``re`` backtracks and cannot be interrupted, so user patterns are
+bounded before they run. Patterns that can backtrack more than
+quadratically are refused (see ``projects.patterns``), and only the first
+``MATCH_LENGTH`` characters of a line are searched, which bounds the time
+one line can take. A search stops with its results marked truncated after
+``SEARCH_MAX_FILES`` files or ``SEARCH_TIME_LIMIT`` seconds.
+
+The index is brought up to a file's new head after the save commits, by
+``search_indexer``. Until then the file is marked ``search_indexed=False``
+and is always a candidate, so searches never miss a fresh save.
+"""
+import operator
+import re
+import time
+from functools import reduce
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .indexing import BackgroundIndexer
+from .models import CodeFile, FileTrigram, FileVersion
+from .snapshots import iter_snapshot
+from .patterns import PatternError, check_pattern
+from .trigrams import ALL, query_for, trigrams
+
+# Longest line text returned with a match
+LINE_LENGTH = 400
+# Candidate files read at a time
+CONTENT_BATCH_SIZE = 50
+# Longest prefix of a line a pattern is run against
+MATCH_LENGTH = 1000
+
+
+class SearchError(Exception):
+    pass
+
+
+def _filter(query):
+    if query[0] == 'tri':
+        return Q(id__in=FileTrigram.objects.filter(trigram=query[1]).values('code_file_id'))
+    parts = [_filter(part) for part in query[1]]
+    return reduce(operator.and_ if query[0] == 'and' else operator.or_, parts)
+
+
+def candidate_files(project_id, query):
+    """
+    The files whose index satisfies ``query``, as ``(id, filename, head_id)``
+    by filename. The query is answered by the database from the trigram
+    index, so only the ids of candidates come back.
+    """
+    return list(
+        CodeFile.objects.filter(_filter(query) | Q(search_indexed=False), project_id=project_id, head__isnull=False)
+        .order_by('filename')
+        .values_list('id', 'filename', 'head_id')
+    )
+
+
+def index_files(code_file_ids):
+    """Bring the trigram index of files up to their heads. Returns how many were indexed."""
+    code_files = list(
+        CodeFile.objects.select_related('head__blob')
+        .filter(id__in=code_file_ids, search_indexed=False, head__isnull=False)
+    )
+    if not code_files:
+        return 0
+    # Read before locking, so saves to the files are not held up by it
+    wanted = {code_file.id: (code_file.head_id, trigrams(code_file.head.content)) for code_file in code_files}
+
+    with transaction.atomic():
+        heads = dict(CodeFile.objects.select_for_update().filter(id__in=wanted).values_list('id', 'head_id'))
+        # A file saved meanwhile has been queued again
+        current = {
+            code_file_id: trigram_set
+            for code_file_id, (head_id, trigram_set) in wanted.items()
+            if heads.get(code_file_id) == head_id
+        }
+        FileTrigram.objects.sync(current)
+        CodeFile.objects.filter(id__in=list(current)).update(search_indexed=True)
+    return len(current)
+
+
+search_indexer = BackgroundIndexer('search', index_files, 'SEARCH_INDEX_WORKERS')
+
+
+def head_contents(project_id, files):
+    """
+    Yield ``(file_id, filename, content)`` for ``files`` as returned by
+    candidate_files, a batch at a time so that a search that fills its
+    results early reads no further. Cached head texts are used as they
+    are; the rest of each batch is rebuilt in one query.
+    """
+    for start in range(0, len(files), CONTENT_BATCH_SIZE):
+        batch = files[start:start + CONTENT_BATCH_SIZE]
+        cached = cache.get_many([FileVersion.content_cache_key(head_id) for _, _, head_id in batch])
+        missing = [file_id for file_id, _, head_id in batch if FileVersion.content_cache_key(head_id) not in cached]
+        rebuilt = {}
+        if missing:
+            rebuilt = {snapshot_file.file_id: snapshot_file.content for snapshot_file in iter_snapshot(project_id, file_ids=missing)}
+            heads = {file_id: head_id for file_id, _, head_id in batch}
+            cache.set_many(
+                {FileVersion.content_cache_key(heads[file_id]): content for file_id, content in rebuilt.items()},
+                settings.VERSION_CONTENT_CACHE_TTL
+            )
+        for file_id, filename, head_id in batch:
+            content = cached.get(FileVersion.content_cache_key(head_id), rebuilt.get(file_id))
+            if content is not None:
+                yield file_id, filename, content
+
+
+def search_project(project_id, pattern, regex=False, ignore_case=False):
+    """
+    Return matching lines grouped by file, at most ``SEARCH_MAX_RESULTS``
+    of them, and whether the results were cut off there or by the file or
+    time limit.
+    """
+    if len(pattern) > settings.SEARCH_MAX_PATTERN_LENGTH:
+        raise SearchError(f"Patterns are limited to {settings.SEARCH_MAX_PATTERN_LENGTH} characters.")
+    if not regex:
+        pattern = re.escape(pattern)
+    try:
+        compiled = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+        query = query_for(pattern)
+    except re.error as e:
+        raise SearchError(f"Invalid regular expression: {str(e)}")
+    try:
+        check_pattern(pattern)
+    except PatternError as e:
+        raise SearchError(str(e))
+    if query == ALL:
+        raise SearchError("The query must contain at least three consecutive literal characters.")
+
+    results = []
+    remaining = settings.SEARCH_MAX_RESULTS
+    deadline = time.monotonic() + settings.SEARCH_TIME_LIMIT
+    truncated = False
+    files = candidate_files(project_id, query)
+    if len(files) > settings.SEARCH_MAX_FILES:
+        files, truncated = files[:settings.SEARCH_MAX_FILES], True
+    for file_id, filename, content in head_contents(project_id, files):
+        matches = []
+        for number, line in enumerate(content.splitlines(), 1):
+            if compiled.search(line, 0, MATCH_LENGTH):
+                matches.append({'line': number, 'text': line[:LINE_LENGTH]})
+                remaining -= 1
+                if remaining == 0:
+                    break
+            if time.monotonic() > deadline:
+                truncated = True
+                break
+        if matches:
+            results.append({'file': file_id, 'filename': filename, 'matches': matches})
+        if remaining == 0 or truncated:
+            break
+    # Files that an index run gave up on are scanned every time until queued again
+    unindexed = CodeFile.objects.filter(project_id=project_id, search_indexed=False, head__isnull=False)
+    search_indexer.schedule(unindexed.values_list('id', flat=True))
+    return results, truncated or remaining == 0
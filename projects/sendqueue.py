@@ -0,0 +1,118 @@
+"""
+Bounded outbound queue for editor sockets.
+
+Handlers never write to the socket directly; they queue frames and a writer
+task drains the queue. A client that reads slower than the room produces
+frames would otherwise make every handler wait on it. When the queue
+overflows it is compacted:
+
+* queued cursor frames are dropped and replaced by one marker per file,
+  which is sent as the room's current presence when it is reached,
+* queued document updates (operations, acks, catch-ups, snapshots) are
+  dropped and replaced by one snapshot marker per file, which is rendered
+  from the room's current text when it is reached.
+
+A socket that keeps overflowing before its queue drains, or that cannot be
+brought under the limit by compaction, is considered too slow and closed.
+"""
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Frame kinds
+PRESENCE = 'presence'
+UPDATE = 'update'
+CONTROL = 'control'
+
+# Collapsed frames are rendered from the room when they are sent
+_COLLAPSED = {PRESENCE: 'presence_refresh', UPDATE: 'snapshot'}
+
+
+class SendQueue:
+    def __init__(self, write, refresh, limit, max_overflows, on_drop=None, on_slow=None):
+        """
+        ``write(frame)`` sends one encoded frame and ``refresh(kind, file_id)``
+        sends the current presence or snapshot of a file, where ``kind`` is
+        'presence_refresh' or 'snapshot'. ``on_drop(kind, file_id, count)`` is
+        told about frames removed by compaction and ``on_slow()`` is called
+        once when the socket should be closed.
+        """
+        self.write = write
+        self.refresh = refresh
+        self.limit = limit
+        self.max_overflows = max_overflows
+        self.on_drop = on_drop
+        self.on_slow = on_slow
+        self.overflows = 0
+        self.closed = False
+        self._items = deque()
+        self._ready = asyncio.Event()
+        self._writer = None
+
+    def __len__(self):
+        return len(self._items)
+
+    def depth(self, file_id):
+        return sum(1 for _, item_file, _ in self._items if item_file == file_id)
+
+    def start(self):
+        self._writer = asyncio.ensure_future(self._drain())
+
+    def stop(self):
+        self.closed = True
+        self._items.clear()
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+
+    def put(self, frame, kind=CONTROL, file_id=None):
+        if self.closed:
+            return
+        self._items.append((kind, file_id, frame))
+        self._ready.set()
+        if len(self._items) > self.limit:
+            self._compact()
+
+    def _compact(self):
+        self.overflows += 1
+        dropped = {}
+        kept = deque()
+        markers = set()
+        for kind, file_id, frame in self._items:
+            if kind in _COLLAPSED and file_id is not None:
+                dropped[kind, file_id] = dropped.get((kind, file_id), 0) + 1
+            else:
+                if frame is None:
+                    markers.add((kind, file_id))
+                kept.append((kind, file_id, frame))
+        for (kind, file_id), count in dropped.items():
+            # A marker still waiting to be sent will render the newer state too
+            if (_COLLAPSED[kind], file_id) not in markers:
+                kept.append((_COLLAPSED[kind], file_id, None))
+            if self.on_drop is not None:
+                self.on_drop(kind, file_id, count)
+        self._items = kept
+
+        if len(self._items) > self.limit or self.overflows > self.max_overflows:
+            self.closed = True
+            self._items.clear()
+            if self.on_slow is not None:
+                self.on_slow()
+
+    async def _drain(self):
+        while True:
+            await self._ready.wait()
+            while self._items:
+                kind, file_id, frame = self._items.popleft()
+                try:
+                    if frame is None:
+                        await self.refresh(kind, file_id)
+                    else:
+                        await self.write(frame)
+                except Exception as e:
+                    logger.error(f"Error sending frame: {str(e)}")
+            # Caught up, so earlier overflows no longer count against it
+            self.overflows = 0
+            self._ready.clear()
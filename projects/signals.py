@@ -0,0 +1,64 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .models import CodeFile, FileVersion, Project, ProjectMembership, ProjectRequest
+from .access import invalidate
+from .search import search_indexer
+from .symbolindex import symbol_indexer
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def project_changed(sender, instance, **kwargs):
+    """The owner may have changed, so the cached access list is stale"""
+    invalidate(instance.id)
+    if kwargs.get('created') is False:
+        Project.objects.touch(instance.id)
+
+@receiver(post_save, sender=ProjectMembership)
+@receiver(post_delete, sender=ProjectMembership)
+def membership_changed(sender, instance, **kwargs):
+    """Drop the cached access list when a membership is saved or deleted"""
+    if instance.project_id is not None:
+        invalidate(instance.project_id)
+        Project.objects.touch(instance.project_id)
+
+@receiver(m2m_changed, sender=Project.members.through)
+def members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """members.add() and friends bypass the membership save signals"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        project_ids = [instance.id]
+    elif action == 'pre_clear':
+        project_ids = list(instance.member_projects.values_list('id', flat=True))
+    else:
+        project_ids = pk_set or ()
+    for project_id in project_ids:
+        invalidate(project_id)
+        Project.objects.touch(project_id)
+
+@receiver(post_save, sender=CodeFile)
+@receiver(post_delete, sender=CodeFile)
+@receiver(post_save, sender=ProjectRequest)
+@receiver(post_delete, sender=ProjectRequest)
+def project_page_changed(sender, instance, **kwargs):
+    """The file list and join request state are shown on the project page"""
+    Project.objects.touch(instance.project_id)
+
+@receiver(post_save, sender=FileVersion)
+def version_created(sender, instance, created, **kwargs):
+    """
+    Move the project's page on, since files are listed by last change, and
+    bring the search index and (for Python) the definitions up to the new
+    head once it is committed
+    """
+    if not created or instance.code_file_id is None:
+        return
+    # After commit, so that saves to different files do not queue on the project row
+    project_id = instance.code_file.project_id
+    code_file_id = instance.code_file_id
+    transaction.on_commit(lambda: Project.objects.touch(project_id))
+    transaction.on_commit(lambda: search_indexer.schedule([code_file_id]))
+    if instance.code_file.language != 'python':
+        return
+    transaction.on_commit(lambda: symbol_indexer.schedule([code_file_id]))
@@ -0,0 +1,69 @@
+"""
+A project as it was at a point in time.
+
+For every file, the version to show is the newest one created at or before
+the requested time. Most versions are deltas, so the rows needed are that
+version and every version back to its keyframe. Both bounds come from
+window functions over the file's versions up to that time, so the whole
+snapshot is read with one query, ordered so that each file's text can be
+rebuilt and handed on before the next file's rows are read.
+"""
+from collections import namedtuple
+
+from django.db.models import Case, F, Max, When, Window
+
+from .blobs import decompress
+from .deltas import apply_delta
+from .models import FileVersion
+
+SnapshotFile = namedtuple('SnapshotFile', ['file_id', 'filename', 'version_number', 'created_at', 'content_hash', 'content'])
+
+
+def snapshot_rows(project_id, at=None, file_ids=None):
+    """
+    The keyframe-to-target rows of every file as of ``at`` (now if None),
+    in order, optionally only for ``file_ids``.
+    """
+    partition = {'partition_by': [F('code_file_id')]}
+    versions = FileVersion.objects.filter(code_file__project_id=project_id)
+    if at is not None:
+        versions = versions.filter(created_at__lte=at)
+    if file_ids is not None:
+        versions = versions.filter(code_file_id__in=file_ids)
+    return (
+        versions
+        .annotate(
+            target=Window(Max('version_number'), **partition),
+            base=Window(Max(Case(When(is_keyframe=True, then='version_number'))), **partition)
+        )
+        .filter(version_number__gte=F('base'))
+        .order_by('code_file__filename', 'version_number')
+        .values_list(
+            'code_file_id', 'code_file__filename', 'version_number', 'target', 'created_at',
+            'content_hash', 'text', 'blob__data', 'delta', 'is_keyframe'
+        )
+    )
+
+
+def iter_snapshot(project_id, at=None, with_content=True, file_ids=None):
+    """
+    Yield a SnapshotFile for every file that had a version at ``at``, by
+    filename. Without ``with_content`` the texts are not rebuilt (or read).
+    """
+    rows = snapshot_rows(project_id, at, file_ids)
+    if not with_content:
+        rows = rows.filter(version_number=F('target')).values_list(
+            'code_file_id', 'code_file__filename', 'version_number', 'target', 'created_at', 'content_hash'
+        )
+        for file_id, filename, number, _, created_at, digest in rows.iterator(chunk_size=500):
+            yield SnapshotFile(file_id, filename, number, created_at, digest, None)
+        return
+
+    content = None
+    for file_id, filename, number, target, created_at, digest, text, blob_data, delta, is_keyframe in rows.iterator(chunk_size=500):
+        if is_keyframe:
+            content = decompress(blob_data) if blob_data is not None else text
+        else:
+            content = apply_delta(content, delta)
+        if number == target:
+            yield SnapshotFile(file_id, filename, number, created_at, digest, content)
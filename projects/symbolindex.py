@@ -0,0 +1,72 @@
+"""
+Per-project symbol table for Python files.
+
+After a version of a Python file is committed, the file is queued on
+``symbol_indexer`` (see ``projects.indexing``). A batch of files is read,
+parsed with ``ast``, and their rows in ``Symbol`` are replaced in one
+transaction. A file whose head is the version already indexed is skipped,
+so the work follows edits rather than project size. Heads that do not
+parse (half-typed code) keep the definitions of the last version that did.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from .indexing import BackgroundIndexer
+from .models import CodeFile, Symbol
+from .symbols import extract
+
+
+def stale_files():
+    """Python files whose head is not in the symbol table yet"""
+    return CodeFile.objects.filter(language='python', head__isnull=False).filter(
+        Q(symbols_version__isnull=True) | ~Q(symbols_version=F('head__version_number'))
+    )
+
+
+def index_files(code_file_ids):
+    """Bring the symbols of files up to their heads. Returns how many were indexed."""
+    code_files = [
+        code_file
+        for code_file in CodeFile.objects.select_related('head__blob').filter(
+            id__in=code_file_ids, language='python', head__isnull=False
+        )
+        if code_file.symbols_version != code_file.head.version_number
+    ]
+    if not code_files:
+        return 0
+    # Parsed before locking, so saves to the files are not held up by it
+    parsed = {code_file.id: (code_file, extract(code_file.head.content)) for code_file in code_files}
+
+    with transaction.atomic():
+        heads = dict(CodeFile.objects.select_for_update().filter(id__in=parsed).values_list('id', 'head_id'))
+        # A file saved meanwhile has been queued again
+        current = [(code_file, definitions) for code_file, definitions in parsed.values() if heads.get(code_file.id) == code_file.head_id]
+        replaced = [(code_file, definitions) for code_file, definitions in current if definitions is not None]
+        Symbol.objects.filter(code_file_id__in=[code_file.id for code_file, _ in replaced]).delete()
+        Symbol.objects.bulk_create(
+            [
+                Symbol(
+                    project_id=code_file.project_id,
+                    code_file_id=code_file.id,
+                    name=definition.name[:255],
+                    qualname=definition.qualname[:1024],
+                    kind=definition.kind,
+                    line=definition.line,
+                    end_line=definition.end_line
+                )
+                for code_file, definitions in replaced
+                for definition in definitions
+            ],
+            batch_size=500
+        )
+        by_version = defaultdict(list)
+        for code_file, _ in current:
+            by_version[code_file.head.version_number].append(code_file.id)
+        for version_number, ids in by_version.items():
+            CodeFile.objects.filter(id__in=ids).update(symbols_version=version_number)
+    return len(current)
+
+
+symbol_indexer = BackgroundIndexer('symbols', index_files, 'SYMBOL_INDEX_WORKERS')
@@ -0,0 +1,59 @@
+"""
+Definitions in Python source, for the outline and go-to-definition.
+
+Only what is visible from outside a function is collected: classes,
+functions, methods (and classes nested in classes), and names assigned at
+module or class level. Function bodies are not entered.
+"""
+import ast
+from collections import namedtuple
+
+Definition = namedtuple('Definition', ['name', 'qualname', 'kind', 'line', 'end_line'])
+
+
+def _assigned_names(target):
+    if isinstance(target, ast.Name):
+        yield target.id
+    elif isinstance(target, (ast.Tuple, ast.List)):
+        for element in target.elts:
+            yield from _assigned_names(element)
+    elif isinstance(target, ast.Starred):
+        yield from _assigned_names(target.value)
+
+
+def _walk(body, prefix, in_class):
+    for node in body:
+        if isinstance(node, ast.ClassDef):
+            qualname = prefix + node.name
+            yield Definition(node.name, qualname, 'class', node.lineno, node.end_lineno)
+            yield from _walk(node.body, qualname + '.', True)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            kind = 'method' if in_class else 'function'
+            yield Definition(node.name, prefix + node.name, kind, node.lineno, node.end_lineno)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            kind = 'attribute' if in_class else 'variable'
+            for target in targets:
+                for name in _assigned_names(target):
+                    yield Definition(name, prefix + name, kind, node.lineno, node.end_lineno)
+        elif isinstance(node, (ast.If, ast.Try)) and not in_class:
+            # Definitions guarded by a condition or an import fallback
+            for block in (node.body, node.orelse, getattr(node, 'finalbody', []), *[h.body for h in getattr(node, 'handlers', [])]):
+                yield from _walk(block, prefix, in_class)
+
+
+def extract(source):
+    """Return the definitions in ``source``, or None if it does not parse."""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    # The same name may be assigned several times; the first one is the definition
+    definitions, seen = [], set()
+    for definition in _walk(tree.body, '', False):
+        if definition.kind in ('variable', 'attribute'):
+            if definition.qualname in seen:
+                continue
+            seen.add(definition.qualname)
+        definitions.append(definition)
+    return definitions
@@ -1,7 +1,52 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from datetime import timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import OperationalError, connection
+from django.utils import timezone
 from django.urls import reverse
 from django.contrib.auth.models import User
-from .models import Project, CodeFile, FileVersion, Task
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from io import BytesIO, StringIO
+import gzip
+import json
+import tarfile
+import tempfile
+import zipfile
+from .models import Project, CodeFile, FileVersion, FileTrigram, ContentBlob, Symbol, Task
+from .blobs import content_hash
+from . import ot
+from . import codecs
+from .rooms import Room, room_group_name
+from . import rooms
+from .routing import websocket_urlpatterns
+from .consumers import announce_version, save_buffer, write_file_version
+from .writebehind import WriteBehindBuffer
+from .sendqueue import SendQueue, PRESENCE, UPDATE, CONTROL
+from .retention import RetentionPolicy, collect_blobs, compact_file
+from .diffs import diff_lines, diff_cache
+from .imports import ArchiveError, import_archive
+from .snapshots import iter_snapshot
+from . import blame
+from .blameindex import blame_indexer
+from .trigrams import ALL, query_for
+from .patterns import PatternError, check_pattern
+from . import symbols
+from .indexing import BackgroundIndexer
+from .search import search_indexer
+from .symbolindex import index_files, stale_files
+from . import metrics
+from . import access
 
 class ProjectsTestCase(TestCase):
     def setUp(self):
@@ -70,3 +115,1479 @@ class ProjectsTestCase(TestCase):
         response = self.client.get(reverse('code_editor', args=[self.project.id, self.code_file.id]))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'test.py')
+
+
+class OperationalTransformTestCase(TestCase):
+    def test_apply(self):
+        self.assertEqual(ot.apply('hello world', [6, 'there ', -5]), 'hello there ')
+        self.assertEqual(ot.apply('a😀b', [1, -2, 'c', 1]), 'acb')
+
+    def test_replace(self):
+        for old, new in [('abc', 'abc'), ('hello world', 'hello there world'), ('a😀b', 'a😀😀b'), ('xyz', ''), ('aaaa', 'aa')]:
+            self.assertEqual(ot.apply(old, ot.replace(old, new)), new)
+        self.assertEqual(ot.replace('hello world', 'hello there world'), [6, 'there ', 5])
+
+    def test_apply_rejects_wrong_length(self):
+        with self.assertRaises(ot.OperationError):
+            ot.apply('abc', [2, 'x'])
+
+    def test_transform_converges(self):
+        document = 'def main():\n    pass\n'
+        a = [4, -4, 'run', 13]
+        b = [12, '    print(1)\n', 9]
+        a_prime, b_prime = ot.transform(a, b)
+        self.assertEqual(
+            ot.apply(ot.apply(document, a), b_prime),
+            ot.apply(ot.apply(document, b), a_prime)
+        )
+
+    def test_transform_overlapping_deletes(self):
+        document = 'abcdef'
+        a = [1, -3, 2]
+        b = [2, -3, 1]
+        a_prime, b_prime = ot.transform(a, b)
+        self.assertEqual(ot.apply(ot.apply(document, a), b_prime), 'af')
+        self.assertEqual(ot.apply(ot.apply(document, b), a_prime), 'af')
+
+
+class CodecTestCase(TestCase):
+    def test_negotiate_prefers_client_order(self):
+        self.assertEqual(codecs.negotiate(None), (codecs.JSON, None))
+        self.assertEqual(codecs.negotiate(['other', 'codecollab.json']), (codecs.JSON, 'codecollab.json'))
+        if 'msgpack' in codecs.CODECS:
+            codec, subprotocol = codecs.negotiate(['codecollab.msgpack', 'codecollab.json'])
+            self.assertEqual((codec.name, subprotocol), ('msgpack', 'codecollab.msgpack'))
+
+    def test_round_trip(self):
+        payload = {'type': 'operation', 'operation': [3, 'é😀', -2], 'revision': 7}
+        for codec in codecs.CODECS.values():
+            self.assertEqual(codec.decode(codec.encode(payload)), payload)
+
+
+class RoomTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='roomuser', password='testpassword')
+
+    def test_stale_operation_is_transformed(self):
+        room = Room('project_1_file_1', 1, 'abc', save=lambda *args: None)
+        room.apply_operation(0, ['x', 3])
+        transformed = room.apply_operation(0, [3, 'y'])
+        self.assertEqual(transformed, [4, 'y'])
+        self.assertEqual(room.content, 'xabcy')
+        self.assertEqual(room.revision, 2)
+
+    def test_checkpoint_only_saves_new_revisions(self):
+        saved = []
+        room = Room('project_1_file_1', 1, 'abc', save=lambda *args: saved.append(args))
+        self.assertFalse(room.checkpoint())
+        room.apply_operation(0, [3, 'd'], self.user)
+        self.assertTrue(room.checkpoint())
+        self.assertFalse(room.checkpoint())
+        self.assertEqual(saved, [(1, 'abcd', self.user, None)])
+
+    @override_settings(EDITOR_CHECKPOINT_INTERVAL=0.01, EDITOR_ROOM_TTL=0.05)
+    def test_room_lingers_then_checkpoints_and_evicts(self):
+        saved = []
+
+        async def load():
+            return 'abc', 4
+
+        async def scenario():
+            room = await rooms.join_room('project_1_file_9', 9, 'chan', load, lambda *args: saved.append(args))
+            room.apply_operation(0, ['#', 3], self.user)
+            await asyncio.sleep(0.03)
+            self.assertEqual(saved, [(9, '#abc', self.user, 4)])
+
+            rooms.leave_room('project_1_file_9', 'chan')
+            self.assertIs(rooms.get_room('project_1_file_9'), room)
+            await asyncio.sleep(0.1)
+            self.assertIsNone(rooms.get_room('project_1_file_9'))
+
+        async_to_sync(scenario)()
+
+    def test_updates_since(self):
+        room = Room('project_1_file_1', 1, '', save=lambda *args: None)
+        for i in range(rooms.HISTORY_SIZE + 5):
+            room.apply_operation(i, [i, 'x'], self.user, 'tab')
+        self.assertEqual([u.revision for u in room.updates_since(room.revision - 2)], [room.revision - 1, room.revision])
+        self.assertEqual(room.updates_since(room.revision), [])
+        self.assertIsNone(room.updates_since(1))
+        self.assertIsNone(room.updates_since(room.revision + 1))
+
+    @override_settings(EDITOR_PRESENCE_TICK=0.02)
+    def test_presence_is_batched_per_tick(self):
+        published = []
+
+        async def publish(room, cursors):
+            published.append(cursors)
+
+        async def scenario():
+            room = Room('project_1_file_1', 1, '', save=lambda *args: None, publish_presence=publish)
+            for column in range(1, 20):
+                room.update_presence('alice', {'lineNumber': 1, 'column': column})
+            room.update_presence('bob', {'lineNumber': 2, 'column': 1})
+            await asyncio.sleep(0.05)
+
+        async_to_sync(scenario)()
+        self.assertEqual(published, [{
+            'alice': {'lineNumber': 1, 'column': 19},
+            'bob': {'lineNumber': 2, 'column': 1},
+        }])
+
+    def test_unknown_revision_is_rejected(self):
+        room = Room('project_1_file_1', 1, 'abc', save=lambda *args: None)
+        with self.assertRaises(ot.OperationError):
+            room.apply_operation(1, [3, 'y'])
+
+    def test_version_saved_elsewhere_is_merged(self):
+        saved = []
+        room = Room('project_1_file_1', 1, 'abc', save=lambda *args: saved.append(args), version=3)
+        room.apply_operation(0, [3, 'd'], self.user)
+        self.assertEqual(room.adopt('abc', 'Xbc', 4, 'other'), ['X', -1, 3])
+        self.assertEqual((room.content, room.revision, room.version), ('Xbcd', 2, 4))
+        self.assertEqual(room.updates_since(1)[0].user, 'other')
+        # The unsaved edit is kept and saved on top of that version
+        self.assertTrue(room.checkpoint())
+        self.assertEqual(saved, [(1, 'Xbcd', self.user, 4)])
+        room.saved(5)
+        self.assertEqual(room.adopt('Xbcd', 'Xbcd!', 6), [4, '!'])
+        self.assertFalse(room.checkpoint())
+        self.assertIsNone(room.adopt('Xbcd!', 'Xbcd!', 7))
+        self.assertEqual(room.version, 7)
+
+
+class WriteBehindBufferTestCase(TransactionTestCase):
+    def setUp(self):
+        metrics.reset()
+        self.writes = []
+        self.buffer = WriteBehindBuffer(
+            self.write,
+            window=0.2,
+            idle=0.05
+        )
+
+    def write(self, file_id, content, creator, base_version):
+        self.writes.append((file_id, content))
+        return len(self.writes)
+
+    def test_burst_is_coalesced_after_idle(self):
+        async def scenario():
+            for content in ['a', 'ab', 'abc']:
+                self.buffer.submit(1, content, None)
+            await asyncio.sleep(0.15)
+
+        async_to_sync(scenario)()
+        self.assertEqual(self.writes, [(1, 'abc')])
+        self.assertEqual(metrics.snapshot()['counters']['editor.save.coalesced_updates'], 2)
+
+    def test_window_bounds_continuous_typing(self):
+        async def scenario():
+            for i in range(12):
+                self.buffer.submit(1, str(i), None)
+                await asyncio.sleep(0.03)
+            await self.buffer.flush(1)
+
+        async_to_sync(scenario)()
+        self.assertGreaterEqual(len(self.writes), 2)
+        self.assertEqual(self.writes[-1], (1, '11'))
+
+    def test_flush_all_sync(self):
+        async def scenario():
+            self.buffer.submit(1, 'one', None)
+            self.buffer.submit(2, 'two', None)
+            self.buffer.flush_all_sync()
+
+        async_to_sync(scenario)()
+        self.assertEqual(sorted(self.writes), [(1, 'one'), (2, 'two')])
+
+    def test_content_submitted_during_a_write_is_not_lost(self):
+        writes = []
+
+        def write(file_id, content, creator, base_version):
+            writes.append((content, base_version))
+            if len(writes) == 1:
+                # The entry is still pending while it is written
+                self.assertIn(1, self.buffer._pending)
+                # The room checkpoints again while the first write runs
+                async_to_sync(self.submit_later)()
+            return 7 + len(writes)
+
+        self.buffer.write = write
+
+        async def scenario():
+            self.buffer.submit(1, 'one', None, base_version=3)
+            await self.buffer.flush(1)
+            self.assertIn(1, self.buffer._pending)
+            await asyncio.sleep(0.15)
+
+        async_to_sync(scenario)()
+        self.assertEqual(writes, [('one', 3), ('two', 8)])
+        self.assertNotIn(1, self.buffer._pending)
+        self.assertEqual(metrics.snapshot()['counters']['editor.save.coalesced_updates'], 0)
+
+    async def submit_later(self):
+        self.buffer.submit(1, 'two', None, base_version=3)
+
+    def test_failed_write_is_retried_with_backoff(self):
+        attempts = []
+
+        def write(file_id, content, creator, base_version):
+            attempts.append(time.monotonic())
+            if len(attempts) < 3:
+                raise OperationalError("database is locked")
+            return 1
+
+        self.buffer.write = write
+
+        async def scenario():
+            self.buffer.submit(1, 'one', None)
+            await self.buffer.flush(1)
+            self.assertEqual(self.buffer._pending[1].failures, 1)
+            # Typing on does not bring the retry forward
+            self.buffer.submit(1, 'two', None)
+            await asyncio.sleep(0.3)
+
+        async_to_sync(scenario)()
+        self.assertEqual(len(attempts), 3)
+        self.assertGreaterEqual(attempts[2] - attempts[1], 0.09)
+        self.assertNotIn(1, self.buffer._pending)
+        self.assertEqual(metrics.snapshot()['counters']['editor.save.errors'], 2)
+
+    def test_lock_is_kept_while_a_flush_waits_for_it(self):
+        async def scenario():
+            self.buffer.submit(1, 'one', None)
+            first = asyncio.ensure_future(self.buffer.flush(1))
+            await asyncio.sleep(0)
+            self.buffer.submit(1, 'two', None)
+            second = asyncio.ensure_future(self.buffer.flush(1))
+            await first
+            # The second flush has not run yet but still holds the lock
+            self.assertIn(1, self.buffer._locks)
+            await second
+            self.assertNotIn(1, self.buffer._locks)
+
+        async_to_sync(scenario)()
+        self.assertEqual(self.writes, [(1, 'one'), (1, 'two')])
+
+
+class AccessControlTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='testpassword')
+        self.member = User.objects.create_user(username='member', password='testpassword')
+        self.project = Project.objects.create(name='Guarded', owner=self.owner)
+        self.project.members.add(self.member, through_defaults={'role': 'admin'})
+
+    def fresh(self, user):
+        # A new user object, as a new request would have
+        return User.objects.get(id=user.id)
+
+    def test_owner_needs_no_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(access.get_role(self.owner, self.project), 'owner')
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'acl'},
+    })
+    def test_roles_are_cached_and_memoized(self):
+        member, next_request = self.fresh(self.member), self.fresh(self.member)
+        with self.assertNumQueries(1):
+            self.assertEqual(access.get_role(member, self.project.id), 'admin')
+            self.assertTrue(access.has_access(member, self.project))
+        with self.assertNumQueries(0):
+            self.assertEqual(access.get_role(next_request, self.project.id), 'admin')
+
+    def test_membership_changes_invalidate(self):
+        outsider = User.objects.create_user(username='outsider', password='testpassword')
+        self.assertFalse(access.has_access(self.fresh(outsider), self.project))
+        self.project.members.add(outsider)
+        self.assertTrue(access.has_access(self.fresh(outsider), self.project))
+        self.project.members.remove(self.member)
+        self.assertFalse(access.has_access(self.fresh(self.member), self.project))
+
+    def test_owner_change_invalidates(self):
+        access.get_role(self.fresh(self.member), self.project.id)
+        self.project.owner = self.member
+        self.project.save()
+        self.assertEqual(access.get_role(self.fresh(self.member), self.project.id), 'owner')
+
+    def test_missing_project(self):
+        self.assertIsNone(access.get_role(self.owner, 999999))
+
+    def test_access_lists_are_shared_between_workers(self):
+        # A per-process cache would keep a revoked member in on other workers
+        self.assertNotIsInstance(caches['shared'], LocMemCache)
+        access.get_role(self.fresh(self.member), self.project.id)
+        other_worker = caches.create_connection('shared')
+        self.assertIsNotNone(other_worker.get(access._cache_key(self.project.id)))
+        self.project.members.remove(self.member)
+        self.assertIsNone(other_worker.get(access._cache_key(self.project.id)))
+
+
+class SendQueueTestCase(TestCase):
+    def make_queue(self, **kwargs):
+        self.sent, self.dropped, self.slow = [], [], []
+
+        async def write(frame):
+            self.sent.append(frame)
+
+        async def refresh(kind, file_id):
+            self.sent.append((kind, file_id))
+
+        return SendQueue(
+            write, refresh,
+            on_drop=lambda *args: self.dropped.append(args),
+            on_slow=lambda: self.slow.append(True),
+            **kwargs
+        )
+
+    def test_overflow_collapses_updates_and_drops_cursors(self):
+        async def scenario():
+            queue = self.make_queue(limit=4, max_overflows=3)
+            queue.put('joined', CONTROL, 1)
+            for revision in range(1, 4):
+                queue.put(f'op{revision}', UPDATE, 1)
+                queue.put(f'cursor{revision}', PRESENCE, 1)
+            queue.start()
+            await asyncio.sleep(0.01)
+            queue.stop()
+
+        async_to_sync(scenario)()
+        # The markers already queued also cover the frames dropped later
+        self.assertEqual(self.sent, ['joined', ('snapshot', 1), ('presence_refresh', 1)])
+        self.assertEqual(self.dropped, [(UPDATE, 1, 2), (PRESENCE, 1, 2), (UPDATE, 1, 1), (PRESENCE, 1, 1)])
+        self.assertEqual(self.slow, [])
+
+    def test_persistently_slow_socket_is_closed(self):
+        queue = self.make_queue(limit=2, max_overflows=1)
+        for number in range(4):
+            queue.put(f'frame{number}', CONTROL)
+        self.assertEqual(self.slow, [True])
+        self.assertEqual(len(queue), 0)
+        queue.put('late')
+        self.assertEqual(len(queue), 0)
+
+
+@override_settings(VERSION_KEYFRAME_INTERVAL=4)
+class FileVersionStorageTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='writer', password='testpassword')
+        project = Project.objects.create(name='Versions', owner=self.user)
+        self.code_file = CodeFile.objects.create(project=project, filename='grow.py', language='python')
+        lines = [f"line {number}\n" for number in range(200)]
+        self.contents = []
+        for edit in range(10):
+            lines[edit * 20] = f"edited {edit}\n"
+            self.contents.append(''.join(lines))
+
+    def test_deltas_between_keyframes(self):
+        versions = [
+            FileVersion.objects.create_version(self.code_file, content, self.user)
+            for content in self.contents
+        ]
+        self.assertEqual([v.is_keyframe for v in versions][:5], [True, False, False, False, True])
+        self.assertLess(versions[1].stored_size, len(self.contents[1]) / 10)
+
+        cache.clear()
+        version = FileVersion.objects.get(code_file=self.code_file, version_number=8)
+        with self.assertNumQueries(1):
+            self.assertEqual(version.content, self.contents[7])
+        # Rebuilt contents are cached for the next reader
+        fresh = FileVersion.objects.get(pk=version.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(fresh.content, self.contents[7])
+
+    def test_rechain_compresses_full_copies(self):
+        for number, content in enumerate(self.contents, start=1):
+            FileVersion.objects.create(code_file=self.code_file, content=content, creator=self.user, version_number=number)
+        before, after = FileVersion.objects.rechain(self.code_file, batch_size=3)
+        self.assertEqual(before, sum(len(content) for content in self.contents))
+        self.assertLess(after, before / 2)
+        cache.clear()
+        stored = FileVersion.objects.filter(code_file=self.code_file).order_by('version_number')
+        self.assertEqual([version.content for version in stored], self.contents)
+
+    def test_identical_content_is_stored_once(self):
+        for content in ['', 'x = 1\n' * 50, '', 'x = 1\n' * 50]:
+            FileVersion.objects.create(code_file=self.code_file, content=content, creator=self.user, version_number=1 + FileVersion.objects.count())
+        self.assertEqual(ContentBlob.objects.count(), 2)
+        cache.clear()
+        self.assertEqual(FileVersion.objects.get(version_number=4).content, 'x = 1\n' * 50)
+
+    def test_migrate_blobs_moves_legacy_text(self):
+        for number in (1, 2, 3):
+            version = FileVersion.objects.create(code_file=self.code_file, content='same', creator=self.user, version_number=number)
+            FileVersion.objects.filter(pk=version.pk).update(text='same', blob=None, content_hash='')
+        ContentBlob.objects.all().delete()
+
+        output = StringIO()
+        call_command('migrate_blobs', batch_size=2, stdout=output)
+        self.assertIn('Moved 3 keyframes into 1 blobs', output.getvalue())
+        self.assertEqual(set(FileVersion.objects.values_list('text', 'blob_id')), {('', ContentBlob.objects.get().hash)})
+
+
+@override_settings(SYMBOL_INDEX_WORKERS=0)
+class VersionCounterTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='saver', password='testpassword')
+        project = Project.objects.create(name='Counter', owner=self.user)
+        self.code_file = CodeFile.objects.create(project=project, filename='busy.py', language='python')
+
+    def test_head_follows_new_versions(self):
+        first = FileVersion.objects.create_version(self.code_file, 'a', self.user)
+        second = FileVersion.objects.create_version(self.code_file, 'ab', self.user)
+        self.assertEqual((first.version_number, second.version_number), (1, 2))
+        code_file = CodeFile.objects.select_related('head').get(pk=self.code_file.pk)
+        self.assertEqual(code_file.version_count, 2)
+        self.assertEqual(code_file.get_latest_version().pk, second.pk)
+
+    def test_concurrent_saves_get_distinct_numbers(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("in-memory SQLite fails concurrent writers instead of making them wait (see DATABASES)")
+        threads, per_thread, errors = 8, 10, []
+
+        def save(worker):
+            try:
+                for number in range(per_thread):
+                    FileVersion.objects.create_version(self.code_file, f'{worker}:{number}', self.user)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=save, args=(worker,)) for worker in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        numbers = sorted(FileVersion.objects.filter(code_file=self.code_file).values_list('version_number', flat=True))
+        self.assertEqual(numbers, list(range(1, threads * per_thread + 1)))
+        code_file = CodeFile.objects.get(pk=self.code_file.pk)
+        self.assertEqual(code_file.version_count, threads * per_thread)
+        self.assertEqual(code_file.head.version_number, threads * per_thread)
+
+
+RETENTION = [
+    {'age': 24 * 3600, 'bucket': None},
+    {'age': 7 * 24 * 3600, 'bucket': 3600, 'per_author': True},
+    {'age': None, 'bucket': 24 * 3600},
+]
+
+
+class RetentionTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now().replace(hour=12, minute=30)
+        self.user = User.objects.create_user(username='keeper', password='testpassword')
+
+    def test_policy_tiers(self):
+        policy = RetentionPolicy(RETENTION, now=self.now)
+        versions = [
+            (1, 1, self.now - timedelta(minutes=5)),
+            (2, 1, self.now - timedelta(minutes=6)),
+            (3, 1, self.now - timedelta(days=2, minutes=1)),
+            (4, 2, self.now - timedelta(days=2, minutes=2)),
+            (5, 1, self.now - timedelta(days=2, minutes=3)),
+            (6, 1, self.now - timedelta(days=9, hours=1)),
+            (7, 2, self.now - timedelta(days=9, hours=2)),
+        ]
+        self.assertEqual(list(policy.expired(versions)), [5, 7])
+
+    @override_settings(VERSION_KEYFRAME_INTERVAL=4)
+    def test_compaction_rebases_deltas(self):
+        project = Project.objects.create(name='Old', owner=self.user)
+        code_file = CodeFile.objects.create(project=project, filename='old.py', language='python')
+        lines = [f"line {number}\n" for number in range(100)]
+        contents = []
+        for edit in range(10):
+            lines[edit * 10] = f"edited {edit}\n"
+            contents.append(''.join(lines))
+            version = FileVersion.objects.create_version(code_file, contents[-1], self.user)
+            # Ten saves on the same day, long ago
+            FileVersion.objects.filter(pk=version.pk).update(created_at=self.now - timedelta(days=20, minutes=10 - edit))
+
+        removed, rewritten = compact_file(code_file.id, RetentionPolicy(RETENTION, now=self.now))
+        # Only the newest version of the day survives, and it is the head
+        self.assertEqual((removed, rewritten), (9, 1))
+        cache.clear()
+        remaining = FileVersion.objects.get(code_file=code_file)
+        self.assertTrue(remaining.is_keyframe)
+        self.assertEqual(remaining.content, contents[-1])
+
+    @override_settings(VERSION_KEYFRAME_INTERVAL=4)
+    def test_kept_versions_still_rebuild(self):
+        project = Project.objects.create(name='Mixed', owner=self.user)
+        code_file = CodeFile.objects.create(project=project, filename='mixed.py', language='python')
+        lines = [f"line {number}\n" for number in range(100)]
+        contents = []
+        for edit in range(12):
+            lines[edit * 5] = f"edited {edit}\n"
+            contents.append(''.join(lines))
+            version = FileVersion.objects.create_version(code_file, contents[-1], self.user)
+            # Two versions per hour, three days ago
+            FileVersion.objects.filter(pk=version.pk).update(
+                created_at=self.now - timedelta(days=3) + timedelta(minutes=30 * edit)
+            )
+
+        removed, _ = compact_file(code_file.id, RetentionPolicy(RETENTION, now=self.now))
+        # 12:30 | 13:00 13:30 | ... | 17:00 17:30 | 18:00
+        self.assertEqual(removed, 5)
+        cache.clear()
+        kept = FileVersion.objects.filter(code_file=code_file).order_by('version_number')
+        for version in kept:
+            self.assertEqual(version.content, contents[version.version_number - 1])
+
+
+    @override_settings(VERSION_KEYFRAME_INTERVAL=4)
+    def test_small_batches_decide_like_one_pass(self):
+        other = User.objects.create_user(username='other', password='testpassword')
+        project = Project.objects.create(name='Blocks', owner=self.user)
+        code_file = CodeFile.objects.create(project=project, filename='blocks.py', language='python')
+        contents = {}
+        for edit in range(20):
+            content = ''.join(f"line {number} {edit if number == edit else ''}\n" for number in range(40))
+            version = FileVersion.objects.create_version(code_file, content, other if edit % 3 == 0 else self.user)
+            # Three authors' worth of saves, 20 minutes apart, three days ago
+            FileVersion.objects.filter(pk=version.pk).update(
+                created_at=self.now - timedelta(days=3) + timedelta(minutes=20 * edit)
+            )
+            contents[version.version_number] = content
+        policy = RetentionPolicy(RETENTION, now=self.now)
+        expected = set(policy.expired(
+            FileVersion.objects.filter(code_file=code_file).order_by('-version_number')
+            .values_list('id', 'creator_id', 'created_at')
+        ))
+        self.assertTrue(expected)
+
+        removed, _ = compact_file(code_file.id, policy, batch_size=3)
+        self.assertEqual(removed, len(expected))
+        cache.clear()
+        kept = FileVersion.objects.filter(code_file=code_file)
+        self.assertFalse(kept.filter(id__in=expected).exists())
+        for version in kept:
+            self.assertEqual(version.content, contents[version.version_number])
+
+    def test_reused_blob_is_not_collected(self):
+        old = self.now - timedelta(days=1)
+        ContentBlob.objects.store('kept')
+        ContentBlob.objects.store('dropped')
+        ContentBlob.objects.update(created_at=old)
+        # A save about to point a version at an unused old blob
+        self.assertGreater(ContentBlob.objects.store('kept').created_at, old)
+        self.assertEqual(collect_blobs(), 1)
+        self.assertEqual(list(ContentBlob.objects.values_list('hash', flat=True)), [content_hash('kept')])
+
+    def test_blob_collected_during_a_save_is_stored_again(self):
+        blob = ContentBlob.objects.store('text')
+        ContentBlob.objects.update(created_at=self.now - timedelta(days=1))
+        blob = ContentBlob.objects.get(pk=blob.pk)
+        with mock.patch.object(ContentBlob.objects, 'get_or_create', return_value=(blob, False)):
+            ContentBlob.objects.filter(pk=blob.pk).delete()
+            self.assertEqual(ContentBlob.objects.store('text').text, 'text')
+        self.assertTrue(ContentBlob.objects.filter(pk=blob.pk).exists())
+
+
+class FileHistoryTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='historian', password='testpassword')
+        self.client.login(username='historian', password='testpassword')
+        self.project = Project.objects.create(name='History', owner=self.user)
+        self.code_file = CodeFile.objects.create(project=self.project, filename='long.py', language='python')
+        for number in range(1, 61):
+            FileVersion.objects.create(code_file=self.code_file, content=f'print({number})', creator=self.user, version_number=number)
+
+    def test_history_is_paginated_by_version_number(self):
+        url = reverse('file_history', args=[self.project.id, self.code_file.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        versions = response.context['versions']
+        self.assertEqual([v.version_number for v in versions], list(range(60, 10, -1)))
+        self.assertEqual(response.context['next_before'], 11)
+        self.assertNotContains(response, 'print(60)')
+
+        response = self.client.get(url, {'before': 11})
+        self.assertEqual([v.version_number for v in response.context['versions']], list(range(10, 0, -1)))
+        self.assertIsNone(response.context['next_before'])
+
+    def test_version_content_is_cacheable(self):
+        url = reverse('version_content', args=[self.project.id, self.code_file.id, 7])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode(), 'print(7)')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+        missing = reverse('version_content', args=[self.project.id, self.code_file.id, 99])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+        User.objects.create_user(username='stranger', password='testpassword')
+        self.client.login(username='stranger', password='testpassword')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class RangedContentTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader', password='testpassword')
+        self.client.login(username='reader', password='testpassword')
+        self.project = Project.objects.create(name='Ranges', owner=self.user)
+        self.code_file = CodeFile.objects.create(project=self.project, filename='big.py', language='python')
+        self.content = ''.join(f'line {number} é\n' for number in range(1, 101))
+        FileVersion.objects.create_version(self.code_file, self.content, self.user)
+        self.url = reverse('version_content', args=[self.project.id, self.code_file.id, 1])
+
+    def test_line_ranges(self):
+        response = self.client.get(self.url, {'lines': '3-4'})
+        self.assertEqual(response.content.decode(), 'line 3 é\nline 4 é\n')
+        self.assertEqual(response['X-Total-Lines'], '100')
+        self.assertEqual(self.client.get(self.url, {'lines': '99-'}).content.decode(), 'line 99 é\nline 100 é\n')
+        self.assertEqual(self.client.get(self.url, {'lines': '5-2'}).status_code, 400)
+
+    def test_byte_ranges(self):
+        data = self.content.encode('utf-8')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, data[:10])
+        self.assertEqual(response['Content-Range'], f'bytes 0-9/{len(data)}')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(response.content, data[-5:])
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f'bytes={len(data)}-').status_code, 416)
+        # Multiple ranges are answered with the whole text
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual((response.status_code, response.content), (200, data))
+
+    def test_gzip(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content).decode(), self.content)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertNotIn('Content-Encoding', self.client.get(self.url))
+
+    @override_settings(EDITOR_INLINE_MAX_CHARS=100, EDITOR_INITIAL_LINES=10)
+    def test_editor_renders_the_top_of_large_files(self):
+        response = self.client.get(reverse('code_editor', args=[self.project.id, self.code_file.id]))
+        self.assertEqual(response.context['content'], ''.join(self.content.splitlines(keepends=True)[:10]))
+        self.assertEqual(response.context['rest_url'], self.url + '?lines=11-')
+        rest = self.client.get(response.context['rest_url']).content.decode()
+        self.assertEqual(response.context['content'] + rest, self.content)
+
+        with self.settings(EDITOR_INLINE_MAX_CHARS=10 ** 6):
+            response = self.client.get(reverse('code_editor', args=[self.project.id, self.code_file.id]))
+            self.assertEqual(response.context['content'], self.content)
+            self.assertIsNone(response.context['rest_url'])
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', password='testpassword')
+        self.other = User.objects.create_user(username='member', password='testpassword')
+        self.client.login(username='owner', password='testpassword')
+        self.project = Project.objects.create(name='Cached', owner=self.user)
+        self.code_file = CodeFile.objects.create(project=self.project, filename='main.py', language='python')
+        FileVersion.objects.create_version(self.code_file, 'x = 1\n', self.user)
+        self.detail_url = reverse('project_detail', args=[self.project.id])
+        self.editor_url = reverse('code_editor', args=[self.project.id, self.code_file.id])
+        self.history_url = reverse('file_history', args=[self.project.id, self.code_file.id])
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in (self.detail_url, self.editor_url, self.history_url):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['ETag'].startswith('"'))
+            self.assertIn('no-cache', response['Cache-Control'])
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_editor_revalidation_does_not_read_content(self):
+        response = self.client.get(self.editor_url)
+        with mock.patch.object(FileVersion, '_reconstruct', side_effect=AssertionError):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.revalidate(self.editor_url, response).status_code, 304)
+        # Not even the head row, with its text, delta and blame, is loaded
+        self.assertFalse([query for query in queries if 'projects_fileversion' in query['sql']])
+
+    def test_new_version_changes_file_pages(self):
+        editor = self.client.get(self.editor_url)
+        history = self.client.get(self.history_url)
+        FileVersion.objects.create_version(self.code_file, 'x = 2\n', self.user)
+        response = self.revalidate(self.editor_url, editor)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'x = 2')
+        self.assertEqual(self.revalidate(self.history_url, history).status_code, 200)
+
+    def test_project_changes_change_the_project_page(self):
+        response = self.client.get(self.detail_url)
+        CodeFile.objects.create(project=self.project, filename='other.py', language='python')
+        response = self.revalidate(self.detail_url, response)
+        self.assertContains(response, 'other.py')
+
+        self.project.members.add(self.other, through_defaults={'role': 'member'})
+        response = self.revalidate(self.detail_url, response)
+        self.assertContains(response, 'member')
+        self.assertEqual(self.revalidate(self.detail_url, response).status_code, 304)
+
+    def test_etag_is_per_user(self):
+        self.project.members.add(self.other, through_defaults={'role': 'member'})
+        response = self.client.get(self.detail_url)
+        self.client.login(username='member', password='testpassword')
+        self.assertEqual(self.revalidate(self.detail_url, response).status_code, 200)
+
+    def test_pages_with_messages_are_rendered(self):
+        response = self.client.get(self.detail_url)
+        self.client.post(reverse('edit_project', args=[self.project.id]), {
+            'name': 'Renamed', 'description': '', 'language': 'python', 'max_members': 5
+        })
+        response = self.revalidate(self.detail_url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertContains(response, 'Renamed')
+
+
+class SaveFileTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='saver', password='testpassword')
+        self.client.login(username='saver', password='testpassword')
+        self.project = Project.objects.create(name='Saves', owner=self.user)
+        self.code_file = CodeFile.objects.create(project=self.project, filename='main.py', language='python')
+        FileVersion.objects.create_version(self.code_file, 'a = 1\n', self.user)
+        self.url = reverse('save_file', args=[self.project.id, self.code_file.id])
+
+    def save(self, **data):
+        headers = {'HTTP_IF_MATCH': data.pop('if_match')} if 'if_match' in data else {}
+        return self.client.post(self.url, json.dumps(data), content_type='application/json', **headers)
+
+    def test_unchanged_content_is_not_stored(self):
+        updated_at = CodeFile.objects.get(pk=self.code_file.pk).updated_at
+        response = self.save(content='a = 1\n', base_version=1)
+        self.assertEqual(response.json(), {'success': True, 'version_number': 1, 'changed': False})
+        self.assertEqual(self.code_file.versions.count(), 1)
+        self.assertEqual(CodeFile.objects.get(pk=self.code_file.pk).updated_at, updated_at)
+
+        # Identical content is not a conflict even against a stale base
+        FileVersion.objects.create_version(self.code_file, 'a = 2\n', self.user)
+        self.assertEqual(self.save(content='a = 2\n', base_version=1).json()['changed'], False)
+
+    def test_unchanged_content_of_a_legacy_version_is_not_stored(self):
+        # Versions stored before content hashes were kept have none
+        FileVersion.objects.filter(code_file=self.code_file).update(content_hash='')
+        self.assertEqual(self.save(content='a = 1\n', base_version=1).json()['changed'], False)
+        self.assertEqual(self.code_file.versions.count(), 1)
+        self.assertEqual(self.code_file.versions.get().content_hash, content_hash('a = 1\n'))
+        self.assertEqual(self.save(content='a = 2\n', base_version=1).json()['version_number'], 2)
+
+    def test_stale_save_is_refused_with_a_diff(self):
+        response = self.save(content='a = 2\n', base_version=1)
+        self.assertEqual(response.json()['version_number'], 2)
+        self.assertEqual(response['ETag'], '"v2"')
+
+        response = self.save(content='a = 3\n', base_version=1)
+        self.assertEqual(response.status_code, 409)
+        data = response.json()
+        self.assertEqual(data['version_number'], 2)
+        self.assertEqual((data['diff']['added'], data['diff']['removed']), (1, 1))
+        self.assertEqual(self.code_file.versions.count(), 2)
+        # Without a base the save overwrites, as before
+        self.assertEqual(self.save(content='a = 3\n').json()['version_number'], 3)
+
+    def test_if_match(self):
+        self.assertEqual(self.save(content='b\n', if_match='"v1"').json()['version_number'], 2)
+        self.assertEqual(self.save(content='c\n', if_match='"v1"').status_code, 409)
+        self.assertEqual(self.save(content='c\n', if_match='*').status_code, 200)
+        self.assertEqual(self.save(content='d\n', if_match='"abc"').status_code, 400)
+        self.assertEqual(self.save(content='d\n', base_version='1').status_code, 400)
+
+
+class DiffTestCase(TestCase):
+    def setUp(self):
+        diff_cache.clear()
+        self.user = User.objects.create_user(username='differ', password='testpassword')
+        self.client.login(username='differ', password='testpassword')
+        self.project = Project.objects.create(name='Diffs', owner=self.user)
+        self.code_file = CodeFile.objects.create(project=self.project, filename='diff.py', language='python')
+        self.old = ''.join(f'line {number}\n' for number in range(20))
+        self.new = self.old.replace('line 2\n', 'line two\n').replace('line 15\n', '')
+        FileVersion.objects.create_version(self.code_file, self.old, self.user)
+        FileVersion.objects.create_version(self.code_file, self.new, self.user)
+
+    def test_diff_lines_groups_changes_into_hunks(self):
+        diff = diff_lines(self.old, self.new)
+        self.assertEqual((diff['added'], diff['removed']), (1, 2))
+        self.assertEqual(len(diff['hunks']), 2)
+        first, second = diff['hunks']
+        self.assertEqual((first['old_start'], first['old_count'], first['new_start'], first['new_count']), (1, 6, 1, 6))
+        self.assertIn(['-', 'line 2'], first['lines'])
+        self.assertIn(['+', 'line two'], first['lines'])
+        self.assertEqual(second['lines'][3], ['-', 'line 15'])
+        self.assertEqual(diff_lines(self.old, self.old)['hunks'], [])
+
+    def test_moved_block_is_aligned_on_unique_lines(self):
+        old = 'def a():\n    return 1\n\ndef b():\n    return 2\n'
+        new = 'def b():\n    return 2\n\ndef a():\n    return 1\n'
+        diff = diff_lines(old, new)
+        self.assertEqual((diff['added'], diff['removed']), (3, 3))
+
+    @override_settings(DIFF_MAX_LINES=10)
+    def test_large_inputs_are_not_diffed(self):
+        diff = diff_lines(self.old, self.new)
+        self.assertTrue(diff['too_large'])
+        self.assertEqual(diff['hunks'], [])
+
+    def test_diff_endpoint_is_cached(self):
+        url = reverse('file_diff', args=[self.project.id, self.code_file.id])
+        response = self.client.get(url, {'from': 1, 'to': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['added'], 1)
+        self.assertIn('immutable', response['Cache-Control'])
+
+        versions = FileVersion.objects.filter(code_file=self.code_file).order_by('version_number')
+        key = (versions[0].pk, versions[1].pk)
+        self.assertIsNotNone(diff_cache.get(key))
+        diff_cache.put(key, {'too_large': False, 'added': 7, 'removed': 0, 'hunks': []})
+        self.assertEqual(self.client.get(url, {'from': 1, 'to': 2}).json()['added'], 7)
+
+        self.assertEqual(self.client.get(url, {'from': 1}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'from': 1, 'to': 9}).status_code, 404)
+
+
+class ProjectExportTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='exporter', password='testpassword')
+        self.client.login(username='exporter', password='testpassword')
+        self.project = Project.objects.create(name='Export', owner=self.user)
+        for number in range(3):
+            code_file = CodeFile.objects.create(project=self.project, filename=f'pkg/mod{number}.py', language='python')
+            FileVersion.objects.create_version(code_file, f'old {number}\n', self.user)
+            FileVersion.objects.create_version(code_file, f'new {number}\n' * 5000, self.user)
+        CodeFile.objects.create(project=self.project, filename='../empty.txt', language='other')
+
+    def test_export_streams_head_versions(self):
+        response = self.client.get(reverse('export_project', args=[self.project.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        prefix = f'project-{self.project.id}/'
+        self.assertEqual(sorted(archive.namelist()), [prefix + 'empty.txt'] + [prefix + f'pkg/mod{n}.py' for n in range(3)])
+        self.assertEqual(archive.read(prefix + 'pkg/mod1.py').decode(), 'new 1\n' * 5000)
+        self.assertEqual(archive.read(prefix + 'empty.txt'), b'')
+
+    def test_export_requires_access(self):
+        User.objects.create_user(username='outsider', password='testpassword')
+        self.client.login(username='outsider', password='testpassword')
+        response = self.client.get(reverse('export_project', args=[self.project.id]))
+        self.assertEqual(response.status_code, 403)
+
+
+class SearchTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='searcher', password='testpassword')
+        self.client.login(username='searcher', password='testpassword')
+        self.project = Project.objects.create(name='Search', owner=self.user)
+        self.files = {}
+        for name, content in [
+            ('models.py', 'class Widget:\n    def render(self):\n        return 1\n'),
+            ('views.py', 'from models import Widget\n\ndef show():\n    return Widget().render()\n'),
+            ('util.js', 'function render() {}\n'),
+        ]:
+            code_file = CodeFile.objects.create(project=self.project, filename=name, language='python')
+            with self.captureOnCommitCallbacks(execute=True):
+                FileVersion.objects.create_version(code_file, content, self.user)
+            self.files[name] = code_file
+
+    def search(self, **params):
+        return self.client.get(reverse('search_files', args=[self.project.id]), params)
+
+    def test_query_for_extracts_required_trigrams(self):
+        self.assertEqual(query_for('abcd'), ('and', [('tri', 'abc'), ('tri', 'bcd')]))
+        self.assertEqual(query_for('Foo|bar'), ('or', [('tri', 'foo'), ('tri', 'bar')]))
+        self.assertEqual(query_for('def (\\w+)_test'), ('and', [('tri', 'def'), ('tri', 'ef '), ('tri', '_te'), ('tri', 'tes'), ('tri', 'est')]))
+        self.assertEqual(query_for('ab.*'), ALL)
+
+    def test_index_follows_the_head(self):
+        code_file = self.files['util.js']
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            FileVersion.objects.create_version(code_file, 'function paint() {}\n', self.user)
+        # Until the index catches up the file is scanned by every search
+        self.assertEqual(self.search(q='paint').json()['results'][0]['filename'], 'util.js')
+        for callback in callbacks:
+            callback()
+        code_file.refresh_from_db()
+        self.assertTrue(code_file.search_indexed)
+        trigrams = set(FileTrigram.objects.filter(code_file=code_file).values_list('trigram', flat=True))
+        self.assertIn('pai', trigrams)
+        self.assertNotIn('ren', trigrams)
+        self.assertIn('fun', trigrams)
+
+    def test_search_reads_only_candidate_files(self):
+        data = self.search(q='Widget').json()
+        self.assertEqual([r['filename'] for r in data['results']], ['models.py', 'views.py'])
+        self.assertEqual([m['line'] for m in data['results'][1]['matches']], [1, 4])
+
+        data = self.search(q=r'def \w+\(self', regex='1').json()
+        self.assertEqual(data['results'][0]['matches'], [{'line': 2, 'text': '    def render(self):'}])
+
+        data = self.search(q='RENDER', ignore_case='1').json()
+        self.assertEqual(len(data['results']), 3)
+        self.assertEqual(self.search(q='RENDER').json()['results'], [])
+
+        self.assertEqual(self.search(q='ab').status_code, 400)
+        self.assertEqual(self.search(q='(abc', regex='1').status_code, 400)
+
+    def test_patterns_that_backtrack_are_refused(self):
+        for pattern in [r'(Widget\w+)+x', r'(Wid|Widg)*et', r'(Widget)\1', r'abc.*.*.*.*x', r'Widget.*=.*x', r'\w+_\w+Widget']:
+            self.assertEqual(self.search(q=pattern, regex='1').status_code, 400)
+        self.assertEqual(len(self.search(q=r'(?:def|return) \w+', regex='1').json()['results']), 2)
+        self.assertEqual(len(self.search(q=r'def \w+\(\s*self', regex='1').json()['results']), 1)
+
+    def test_only_patterns_that_split_text_one_way_are_accepted(self):
+        for pattern in [r'def \w+\(\s*self', r'\d+\.\d+', r'\s*=\s*\w+', r'foo.*bar', r'[^,]*,[^,]*,x', r'(?:\d{3})+']:
+            check_pattern(pattern)
+        for pattern in [r'.*.*x', r'.*a.*b', r'a?a?a?aaa', r'\w+_\w+', r'(?=.*a.*b)foo', r'(a|a)*']:
+            with self.assertRaises(PatternError):
+                check_pattern(pattern)
+
+    @override_settings(SEARCH_MAX_FILES=1)
+    def test_search_stops_at_file_limit(self):
+        data = self.search(q='Widget').json()
+        self.assertEqual([result['filename'] for result in data['results']], ['models.py'])
+        self.assertTrue(data['truncated'])
+
+    @override_settings(SEARCH_TIME_LIMIT=0)
+    def test_search_stops_at_time_limit(self):
+        data = self.search(q='Widget').json()
+        self.assertEqual(len(data['results']), 1)
+        self.assertTrue(data['truncated'])
+
+    def test_unindexed_files_are_scanned_and_indexed(self):
+        FileTrigram.objects.all().delete()
+        CodeFile.objects.update(search_indexed=False)
+        with mock.patch.object(search_indexer, 'schedule') as schedule:
+            self.assertEqual(len(self.search(q='Widget').json()['results']), 2)
+        self.assertEqual(sorted(schedule.call_args[0][0]), sorted(code_file.id for code_file in self.files.values()))
+
+        call_command('build_search_index', stdout=StringIO())
+        self.assertFalse(CodeFile.objects.filter(search_indexed=False).exists())
+        self.assertEqual(len(self.search(q='Widget').json()['results']), 2)
+        postings = FileTrigram.objects.count()
+        call_command('build_search_index', '--all', stdout=StringIO())
+        self.assertEqual(FileTrigram.objects.count(), postings)
+
+
+SOURCE = """import os
+try:
+    import json
+except ImportError:
+    json = None
+
+DEBUG = True
+a, (b, c) = 1, (2, 3)
+
+class Widget(Base):
+    size: int = 3
+
+    def render(self):
+        local = 1
+        return local
+
+    class Meta:
+        ordering = []
+
+async def main():
+    pass
+
+DEBUG = False
+"""
+
+
+@override_settings(SYMBOL_INDEX_WORKERS=0)
+class SymbolIndexTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='navigator', password='testpassword')
+        self.client.login(username='navigator', password='testpassword')
+        self.project = Project.objects.create(name='Symbols', owner=self.user)
+        self.code_file = CodeFile.objects.create(project=self.project, filename='app.py', language='python')
+
+    def save(self, content, code_file=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            FileVersion.objects.create_version(code_file or self.code_file, content, self.user)
+
+    def test_extract_collects_top_level_definitions(self):
+        definitions = symbols.extract(SOURCE)
+        self.assertEqual(
+            [(d.qualname, d.kind, d.line) for d in definitions],
+            [
+                ('json', 'variable', 5), ('DEBUG', 'variable', 7), ('a', 'variable', 8),
+                ('b', 'variable', 8), ('c', 'variable', 8), ('Widget', 'class', 10),
+                ('Widget.size', 'attribute', 11), ('Widget.render', 'method', 13),
+                ('Widget.Meta', 'class', 17), ('Widget.Meta.ordering', 'attribute', 18),
+                ('main', 'function', 20),
+            ]
+        )
+        self.assertIsNone(symbols.extract('def broken(:'))
+
+    def test_saves_update_the_symbol_table(self):
+        self.save(SOURCE)
+        response = self.client.get(reverse('file_outline', args=[self.project.id, self.code_file.id]))
+        data = response.json()
+        self.assertFalse(data['stale'])
+        self.assertIn({'name': 'render', 'qualname': 'Widget.render', 'kind': 'method', 'line': 13, 'end_line': 15}, data['symbols'])
+
+        # A save that does not parse keeps the last definitions
+        self.save(SOURCE + 'def half(')
+        self.assertEqual(Symbol.objects.filter(code_file=self.code_file).count(), 11)
+        self.save('def only():\n    pass\n')
+        self.assertEqual(list(Symbol.objects.filter(code_file=self.code_file).values_list('qualname', flat=True)), ['only'])
+
+        other = CodeFile.objects.create(project=self.project, filename='other.js', language='javascript')
+        self.save('function only() {}', code_file=other)
+        self.assertFalse(Symbol.objects.filter(code_file=other).exists())
+
+    def test_go_to_definition(self):
+        self.save(SOURCE)
+        url = reverse('find_symbol', args=[self.project.id])
+        data = self.client.get(url, {'name': 'Widget.render'}).json()
+        self.assertEqual(data['definitions'], [{'file': self.code_file.id, 'filename': 'app.py', 'qualname': 'Widget.render', 'kind': 'method', 'line': 13}])
+        self.assertEqual(self.client.get(url, {'name': 'missing'}).json()['definitions'], [])
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+        # Qualified names match whole parts only
+        other = CodeFile.objects.create(project=self.project, filename='other.py', language='python')
+        self.save('class MyWidget:\n    def render(self):\n        pass\n\nclass Outer:\n    class Widget:\n        def render(self):\n            pass\n', code_file=other)
+        data = self.client.get(url, {'name': 'Widget.render'}).json()
+        self.assertEqual([d['qualname'] for d in data['definitions']], ['Widget.render', 'Outer.Widget.render'])
+
+    def test_indexer_only_parses_changed_heads(self):
+        self.save(SOURCE)
+        with self.assertNumQueries(1):
+            self.assertEqual(index_files([self.code_file.id]), 0)
+
+    def test_threaded_indexer_batches_and_retries(self):
+        calls = []
+        def index(code_file_ids):
+            calls.append(sorted(code_file_ids))
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return len(code_file_ids)
+        indexer = BackgroundIndexer('test', index, 'SYMBOL_INDEX_WORKERS')
+        with override_settings(SYMBOL_INDEX_WORKERS=1), mock.patch.object(indexer, 'inline', return_value=False), \
+                mock.patch('projects.indexing.RETRY_DELAY', 0):
+            indexer.schedule([3, 1, 2, 1])
+            indexer.shutdown()
+        self.assertEqual(calls, [[1, 2, 3], [1, 2, 3]])
+
+    def test_stale_files_are_picked_up_when_looked_up(self):
+        with mock.patch('projects.indexing.BackgroundIndexer.schedule'):
+            self.save(SOURCE)
+        self.assertEqual(list(stale_files().values_list('id', flat=True)), [self.code_file.id])
+        data = self.client.get(reverse('file_outline', args=[self.project.id, self.code_file.id])).json()
+        self.assertFalse(data['stale'])
+        self.assertEqual(len(data['symbols']), 11)
+
+        with mock.patch('projects.indexing.BackgroundIndexer.schedule'):
+            self.save(SOURCE + 'def later():\n    pass\n')
+        data = self.client.get(reverse('find_symbol', args=[self.project.id]), {'name': 'later'}).json()
+        self.assertEqual(len(data['definitions']), 1)
+
+
+class BlameTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='testpassword')
+        self.bob = User.objects.create_user(username='bob', password='testpassword')
+        self.client.login(username='alice', password='testpassword')
+        self.project = Project.objects.create(name='Blame', owner=self.alice)
+        self.project.members.add(self.bob)
+        self.code_file = CodeFile.objects.create(project=self.project, filename='blame.py', language='python')
+        FileVersion.objects.create_version(self.code_file, 'a\nb\nc\nd\n', self.alice)
+        FileVersion.objects.create_version(self.code_file, 'a\nB\nx\nc\nd\n', self.bob)
+        FileVersion.objects.create_version(self.code_file, 'a\nB\nx\nd\ne\n', self.alice)
+
+    def test_advance_tracks_lines_across_versions(self):
+        self.assertEqual(blame.advance(None, None, 'one\ntwo\n', 1), [[2, 1]])
+        self.assertEqual(blame.advance([[2, 1]], 'one\ntwo\n', 'zero\none\ntwo\n', 2), [[1, 2], [2, 1]])
+        self.assertIsNone(blame.advance(None, 'one\n', 'two\n', 2))
+        head = self.code_file.get_latest_version()
+        self.assertEqual(head.blame, [[1, 1], [2, 2], [1, 1], [1, 3]])
+
+    def test_blame_endpoint_names_authors(self):
+        url = reverse('file_blame', args=[self.project.id, self.code_file.id])
+        self.client.get(url)
+        # Session, user and cached access list, then the version and its authors
+        with self.assertNumQueries(5):
+            data = self.client.get(url).json()
+        self.assertEqual(data['version'], 3)
+        self.assertEqual(
+            [(r['start'], r['count'], r['author']) for r in data['ranges']],
+            [(1, 1, 'alice'), (2, 2, 'bob'), (4, 1, 'alice'), (5, 1, 'alice')]
+        )
+        data = self.client.get(url, {'version': 2}).json()
+        self.assertEqual([r['count'] for r in data['ranges']], [1, 2, 2])
+
+    def test_missing_blame_is_rebuilt_once(self):
+        FileVersion.objects.filter(code_file=self.code_file).update(blame=None)
+        url = reverse('file_blame', args=[self.project.id, self.code_file.id])
+        data = self.client.get(url).json()
+        self.assertEqual([r['version'] for r in data['ranges']], [1, 2, 1, 3])
+        self.assertFalse(FileVersion.objects.filter(code_file=self.code_file, blame__isnull=True).exists())
+
+    def test_missing_blame_is_left_to_the_indexer(self):
+        FileVersion.objects.filter(code_file=self.code_file).update(blame=None)
+        url = reverse('file_blame', args=[self.project.id, self.code_file.id])
+        # Queued for a worker thread instead of replayed in the request
+        with mock.patch.object(blame_indexer, 'schedule') as schedule:
+            response = self.client.get(url)
+        schedule.assert_called_once_with([self.code_file.id])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.json()['version'], response.json()['pending']), (3, True))
+        self.assertTrue(FileVersion.objects.filter(code_file=self.code_file, blame__isnull=True).exists())
+
+
+@override_settings(VERSION_KEYFRAME_INTERVAL=4)
+class SnapshotTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reviewer', password='testpassword')
+        self.client.login(username='reviewer', password='testpassword')
+        self.project = Project.objects.create(name='Snapshots', owner=self.user)
+        self.start = timezone.now() - timedelta(days=1)
+        self.files = []
+        for name in ('a.py', 'b.py', 'c.py'):
+            code_file = CodeFile.objects.create(project=self.project, filename=name, language='python')
+            lines = [f'{name} line {number}\n' for number in range(30)]
+            for number in range(1, 11):
+                lines[number] = f'{name} edit {number}\n'
+                version = FileVersion.objects.create_version(code_file, ''.join(lines), self.user)
+                FileVersion.objects.filter(pk=version.pk).update(created_at=self.start + timedelta(hours=number))
+            self.files.append(code_file)
+        # Created after every point looked at below
+        CodeFile.objects.create(project=self.project, filename='later.py', language='python')
+        cache.clear()
+
+    def test_snapshot_rebuilds_each_file_in_one_query(self):
+        at = self.start + timedelta(hours=6, minutes=30)
+        with self.assertNumQueries(1):
+            snapshot = list(iter_snapshot(self.project.id, at))
+        self.assertEqual([f.filename for f in snapshot], ['a.py', 'b.py', 'c.py'])
+        for snapshot_file, code_file in zip(snapshot, self.files):
+            expected = FileVersion.objects.get(code_file=code_file, version_number=6)
+            self.assertEqual(snapshot_file.version_number, 6)
+            self.assertEqual(snapshot_file.content, expected.content)
+        self.assertEqual(list(iter_snapshot(self.project.id, self.start)), [])
+
+    def test_snapshot_endpoints(self):
+        at = (self.start + timedelta(hours=2)).isoformat()
+        response = self.client.get(reverse('project_snapshot', args=[self.project.id]), {'at': at})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([f['version'] for f in response.json()['files']], [2, 2, 2])
+        self.assertIn('max-age', response['Cache-Control'])
+
+        response = self.client.get(reverse('export_snapshot', args=[self.project.id]), {'at': at})
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        name = f'project-{self.project.id}/b.py'
+        self.assertEqual(archive.read(name).decode(), FileVersion.objects.get(code_file=self.files[1], version_number=2).content)
+
+        future = (timezone.now() + timedelta(days=1)).isoformat()
+        self.assertEqual(self.client.get(reverse('project_snapshot', args=[self.project.id]), {'at': future}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('project_snapshot', args=[self.project.id]), {'at': 'yesterday'}).status_code, 400)
+
+    def test_snapshot_time_with_a_positive_offset(self):
+        url = reverse('project_snapshot', args=[self.project.id])
+        at = (self.start + timedelta(hours=2, minutes=30)).astimezone(dt_timezone(timedelta(hours=2)))
+        self.assertTrue(at.isoformat().endswith('+02:00'))
+        # Encoded, and as typed into a URL, where "+" decodes to a space
+        for response in (self.client.get(url, {'at': at.isoformat()}), self.client.get(f'{url}?at={at.isoformat()}')):
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([f['version'] for f in response.json()['files']], [2, 2, 2])
+        self.assertEqual(self.client.get(url, {'at': at.strftime('%Y-%m-%d %H:%M')}).status_code, 200)
+
+
+class ArchiveImportTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='importer', password='testpassword')
+        self.client.login(username='importer', password='testpassword')
+        self.project = Project.objects.create(name='Import', owner=self.user)
+
+    def make_zip(self, files):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name, content in files.items():
+                archive.writestr(name, content)
+        buffer.seek(0)
+        return buffer
+
+    def test_import_creates_files_and_versions_in_bulk(self):
+        files = {f'repo/mod{number}.py': f'x = {number % 3}\n' for number in range(20)}
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(9):
+                code_files = import_archive(self.project, self.make_zip(files), self.user)
+
+        self.assertEqual(len(code_files), 20)
+        self.assertEqual(ContentBlob.objects.count(), 3)
+        code_file = CodeFile.objects.get(project=self.project, filename='mod4.py')
+        self.assertEqual(code_file.language, 'python')
+        self.assertEqual(code_file.version_count, 1)
+        self.assertEqual(code_file.get_latest_version().content, 'x = 1\n')
+        # Indexed once the import committed
+        self.assertTrue(code_file.search_indexed)
+        self.assertEqual(set(FileTrigram.objects.filter(code_file=code_file).values_list('trigram', flat=True)), {'x =', ' = ', '= 1'})
+
+        # The next save continues from the imported version
+        version = FileVersion.objects.create_version(code_file, 'x = 2\n', self.user)
+        self.assertEqual(version.version_number, 2)
+
+    def test_invalid_archive_imports_nothing(self):
+        CodeFile.objects.create(project=self.project, filename='taken.py', language='python')
+        files = {'taken.py': 'a', 'nested/dir/file.py': 'b', 'ok.py': 'c', 'image.png': b'\xff\xd8'}
+        with self.assertRaises(ArchiveError) as raised:
+            import_archive(self.project, self.make_zip(files), self.user)
+        self.assertEqual(len(raised.exception.errors), 3)
+        self.assertEqual(CodeFile.objects.filter(project=self.project).count(), 1)
+
+    def test_reused_old_blobs_are_made_young(self):
+        old = timezone.now() - timedelta(days=2)
+        ContentBlob.objects.store('x = 1\n')
+        ContentBlob.objects.update(created_at=old)
+        import_archive(self.project, self.make_zip({'a.py': 'x = 1\n', 'b.py': 'x = 2\n'}), self.user)
+        self.assertGreater(ContentBlob.objects.get(hash=content_hash('x = 1\n')).created_at, old)
+        self.assertEqual(ContentBlob.objects.count(), 2)
+
+    @override_settings(IMPORT_MAX_TOTAL_SIZE=25)
+    def test_archive_unpacking_to_too_much_is_refused(self):
+        files = {f'mod{number}.py': 'x' * 10 for number in range(3)}
+        with self.assertRaises(ArchiveError) as raised:
+            import_archive(self.project, self.make_zip(files), self.user)
+        self.assertIn('more than 25 bytes', str(raised.exception))
+        self.assertFalse(CodeFile.objects.filter(project=self.project).exists())
+        import_archive(self.project, self.make_zip({'a.py': 'x' * 10, 'b.py': 'y' * 15}), self.user)
+        self.assertEqual(CodeFile.objects.filter(project=self.project).count(), 2)
+
+    def test_upload_view_and_command_accept_tarballs(self):
+        buffer = BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+            data = b'print(1)\n'
+            info = tarfile.TarInfo('main.py')
+            info.size = len(data)
+            archive.addfile(info, BytesIO(data))
+        upload = SimpleUploadedFile('project.tar.gz', buffer.getvalue())
+        response = self.client.post(reverse('import_files', args=[self.project.id]), {'archive': upload})
+        self.assertRedirects(response, reverse('project_detail', args=[self.project.id]))
+        self.assertTrue(CodeFile.objects.filter(project=self.project, filename='main.py').exists())
+
+        with tempfile.NamedTemporaryFile(suffix='.zip') as path:
+            path.write(self.make_zip({'util.js': 'let a;'}).getvalue())
+            path.flush()
+            out = StringIO()
+            call_command('import_project', self.project.id, path.name, stdout=out)
+            self.assertIn('Imported 1 files', out.getvalue())
+            with self.assertRaises(CommandError):
+                call_command('import_project', self.project.id, path.name, stdout=StringIO())
+
+
+# Symbol extraction runs inline: the in-memory test database takes one writer at a time
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    SYMBOL_INDEX_WORKERS=0
+)
+class CodeEditorConsumerTestCase(TransactionTestCase):
+    def setUp(self):
+        # The shared cache is a table that flushing between tests keeps
+        caches['shared'].clear()
+        self.user = User.objects.create_user(username='editor', password='testpassword')
+        self.project = Project.objects.create(name='Live', owner=self.user)
+        self.code_file = CodeFile.objects.create(project=self.project, filename='live.py', language='python')
+        FileVersion.objects.create_version(self.code_file, 'abc', self.user)
+
+    def tearDown(self):
+        rooms._rooms.clear()
+
+    def communicator(self, query='', subprotocols=None, path=None):
+        application = URLRouter(websocket_urlpatterns)
+        if path is None:
+            path = f'/ws/projects/{self.project.id}/files/{self.code_file.id}/'
+        communicator = WebsocketCommunicator(application, path + query, subprotocols=subprotocols)
+        communicator.scope['user'] = self.user
+        return communicator
+
+    def test_operations_are_acked_and_broadcast(self):
+        async def scenario():
+            first, second = self.communicator(), self.communicator()
+            await first.connect()
+            snapshot = await first.receive_json_from()
+            self.assertEqual((snapshot['type'], snapshot['content'], snapshot['revision']), ('snapshot', 'abc', 0))
+            await second.connect()
+            await second.receive_json_from()  # snapshot
+            self.assertEqual(await first.receive_json_from(), {'type': 'user_joined', 'file': self.code_file.id, 'username': 'editor'})
+            # Nobody is told about their own arrival
+            self.assertTrue(await second.receive_nothing())
+
+            await first.send_json_to({'type': 'operation', 'revision': 0, 'operation': [3, 'd']})
+            self.assertEqual(await first.receive_json_from(), {'type': 'ack', 'file': self.code_file.id, 'revision': 1})
+            message = await second.receive_json_from()
+            self.assertEqual(message['operation'], [3, 'd'])
+            self.assertEqual(message['revision'], 1)
+
+            await first.disconnect()
+            await second.disconnect()
+
+        async_to_sync(scenario)()
+        latest = FileVersion.objects.filter(code_file=self.code_file).order_by('-version_number').first()
+        self.assertEqual(latest.content, 'abcd')
+
+    def test_http_save_waits_for_live_edits_to_be_stored(self):
+        self.client.force_login(self.user)
+        editor_url = reverse('code_editor', args=[self.project.id, self.code_file.id])
+        save_url = reverse('save_file', args=[self.project.id, self.code_file.id])
+
+        async def save(content, base_version):
+            return await sync_to_async(self.client.post)(
+                save_url, json.dumps({'content': content, 'base_version': base_version}),
+                content_type='application/json'
+            )
+
+        async def scenario():
+            socket = self.communicator()
+            await socket.connect()
+            await socket.receive_json_from()  # snapshot
+            await socket.send_json_to({'type': 'operation', 'revision': 0, 'operation': [3, 'd']})
+            await socket.receive_json_from()  # ack
+
+            page = await sync_to_async(self.client.get)(editor_url)
+            self.assertEqual((page.context['content'], page.context['base_version']), ('abcd', 1))
+            response = await save('xbcd', 1)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.json()['version_number'], 1)
+
+            # Once the room has stored its edit the save goes through
+            rooms.file_room(self.code_file.id).checkpoint()
+            await save_buffer.flush(self.code_file.id)
+            response = await save('xbcd', 2)
+            self.assertEqual(response.json()['version_number'], 3)
+            message = await socket.receive_json_from()
+            self.assertEqual((message['operation'], message['revision']), (['x', -1, 3], 2))
+            # A checkpoint of what the room had before is refused
+            self.assertIsNone(await sync_to_async(write_file_version)(self.code_file.id, 'abcd', self.user, 2))
+            await socket.disconnect()
+
+        async_to_sync(scenario)()
+        self.assertEqual(CodeFile.objects.get(id=self.code_file.id).get_latest_version().content, 'xbcd')
+        self.assertEqual(FileVersion.objects.filter(code_file=self.code_file).count(), 3)
+
+    def test_version_saved_by_another_worker_keeps_live_edits(self):
+        def save_elsewhere():
+            version, _ = FileVersion.objects.save_content(self.code_file, 'Xbc', self.user, 1)
+            announce_version(self.project.id, self.code_file.id, version.version_number, self.user)
+
+        async def scenario():
+            socket = self.communicator()
+            await socket.connect()
+            await socket.receive_json_from()  # snapshot
+            await socket.send_json_to({'type': 'operation', 'revision': 0, 'operation': [3, 'd']})
+            await socket.receive_json_from()  # ack
+            await sync_to_async(save_elsewhere)()
+            message = await socket.receive_json_from()
+            self.assertEqual((message['operation'], message['revision']), (['X', -1, 3], 2))
+            room = rooms.file_room(self.code_file.id)
+            self.assertEqual((room.content, room.version, room.dirty), ('Xbcd', 2, True))
+            await socket.disconnect()
+            await save_buffer.flush(self.code_file.id)
+
+        async_to_sync(scenario)()
+        self.assertEqual(CodeFile.objects.get(id=self.code_file.id).get_latest_version().content, 'Xbcd')
+
+    @skipUnless('msgpack' in codecs.CODECS, "msgpack is not installed")
+    def test_msgpack_clients_get_binary_frames(self):
+        async def scenario():
+            binary = self.communicator(subprotocols=['codecollab.msgpack', 'codecollab.json'])
+            text = self.communicator()
+            connected, subprotocol = await binary.connect()
+            self.assertEqual(subprotocol, 'codecollab.msgpack')
+            snapshot = codecs.CODECS['msgpack'].decode(await binary.receive_from())
+            self.assertEqual(snapshot['content'], 'abc')
+            await text.connect()
+            await text.receive_json_from()  # snapshot
+            await binary.receive_from()  # user_joined
+
+            await text.send_json_to({'type': 'operation', 'revision': 0, 'operation': ['#', 3]})
+            await text.receive_json_from()  # ack
+            message = codecs.CODECS['msgpack'].decode(await binary.receive_from())
+            self.assertEqual(message['operation'], ['#', 3])
+
+            await binary.disconnect()
+            await text.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_reconnect_receives_only_missed_updates(self):
+        async def scenario():
+            stayer = self.communicator('?client=stayer')
+            await stayer.connect()
+            snapshot = await stayer.receive_json_from()
+
+            for revision, operation in enumerate([[3, 'd'], [4, 'e']]):
+                await stayer.send_json_to({'type': 'operation', 'revision': revision, 'operation': operation})
+                await stayer.receive_json_from()  # ack
+
+            query = f"?client=returning&epoch={snapshot['epoch']}&revision=1"
+            returning = self.communicator(query)
+            await returning.connect()
+            self.assertEqual(await returning.receive_json_from(), {
+                'type': 'catchup',
+                'file': self.code_file.id,
+                'updates': [{'revision': 2, 'operation': [4, 'e'], 'user': 'editor', 'own': False}]
+            })
+            await returning.disconnect()
+
+            stale = self.communicator('?client=stale&epoch=other&revision=1')
+            await stale.connect()
+            self.assertEqual((await stale.receive_json_from())['type'], 'snapshot')
+            await stale.disconnect()
+            await stayer.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_project_socket_multiplexes_files(self):
+        other_file = CodeFile.objects.create(project=self.project, filename='other.py', language='python')
+        FileVersion.objects.create_version(other_file, 'xyz', self.user)
+        foreign_project = Project.objects.create(name='Foreign', owner=self.user)
+        foreign_file = CodeFile.objects.create(project=foreign_project, filename='foreign.py', language='python')
+
+        async def scenario():
+            socket = self.communicator(path=f'/ws/projects/{self.project.id}/')
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+            for code_file in (self.code_file, other_file):
+                await socket.send_json_to({'type': 'subscribe', 'file': code_file.id})
+                snapshot = await socket.receive_json_from()
+                self.assertEqual(snapshot['file'], code_file.id)
+
+            await socket.send_json_to({'type': 'operation', 'file': other_file.id, 'revision': 0, 'operation': ['!', 3]})
+            self.assertEqual(await socket.receive_json_from(), {'type': 'ack', 'file': other_file.id, 'revision': 1})
+            self.assertEqual(rooms.get_room(room_group_name(self.project.id, other_file.id)).content, '!xyz')
+            self.assertEqual(rooms.get_room(room_group_name(self.project.id, self.code_file.id)).content, 'abc')
+
+            # Files of other projects cannot be reached through this socket
+            await socket.send_json_to({'type': 'subscribe', 'file': foreign_file.id})
+            self.assertEqual((await socket.receive_json_from())['type'], 'error')
+
+            await socket.send_json_to({'type': 'unsubscribe', 'file': other_file.id})
+            await socket.send_json_to({'type': 'operation', 'file': other_file.id, 'revision': 1, 'operation': [4, '?']})
+            self.assertEqual(await socket.receive_json_from(), {
+                'type': 'error', 'file': other_file.id, 'message': 'Not subscribed to file'
+            })
+            await socket.disconnect()
+
+        async_to_sync(scenario)()
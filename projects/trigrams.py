@@ -0,0 +1,75 @@
+"""
+Trigram extraction for code search.
+
+Files are indexed by the set of lowercased three-character substrings of
+each of their lines. A regular expression is turned into a boolean query
+over trigrams that any matching line must satisfy: the literal runs it
+requires, ANDed, with alternatives ORed. Lines are matched one at a time,
+so a trigram never spans a line break.
+
+Queries are nested tuples: ``('and', [...])``, ``('or', [...])``,
+``('tri', 'abc')``, or ``ALL`` when the pattern requires nothing that the
+index can check.
+"""
+try:
+    import re._parser as sre_parse
+    import re._constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+ALL = ('all',)
+
+
+def trigrams(text):
+    found = set()
+    for line in text.lower().splitlines():
+        for start in range(len(line) - 2):
+            found.add(line[start:start + 3])
+    return found
+
+
+def _combine(op, parts):
+    flat = []
+    for part in parts:
+        flat.extend(part[1] if part[0] == op else [part])
+    return flat[0] if len(flat) == 1 else (op, flat)
+
+
+def _and(parts):
+    parts = [part for part in parts if part != ALL]
+    return _combine('and', parts) if parts else ALL
+
+
+def _or(parts):
+    if not parts or any(part == ALL for part in parts):
+        return ALL
+    return _combine('or', parts)
+
+
+def _literal(run):
+    return _and([('tri', run[start:start + 3]) for start in range(len(run) - 2)])
+
+
+def _sequence(items):
+    parts = []
+    run = ''
+    for op, arg in items:
+        if op is sre_constants.LITERAL:
+            run += chr(arg).lower()
+            continue
+        parts.append(_literal(run))
+        run = ''
+        if op is sre_constants.SUBPATTERN:
+            parts.append(_sequence(arg[-1]))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and arg[0] >= 1:
+            parts.append(_sequence(arg[2]))
+        elif op is sre_constants.BRANCH:
+            parts.append(_or([_sequence(branch) for branch in arg[1]]))
+    parts.append(_literal(run))
+    return _and(parts)
+
+
+def query_for(pattern):
+    """The trigram query a line matching ``pattern`` must satisfy."""
+    return _sequence(sre_parse.parse(pattern))
@@ -7,10 +7,20 @@ urlpatterns = [
     path('projects/<int:project_id>/', views.project_detail, name='project_detail'),
     path('projects/<int:project_id>/edit/', views.edit_project, name='edit_project'),
     path('projects/<int:project_id>/delete/', views.delete_project, name='delete_project'),
+    path('projects/<int:project_id>/export.zip', views.export_project, name='export_project'),
+    path('projects/<int:project_id>/search/', views.search_files, name='search_files'),
+    path('projects/<int:project_id>/symbols/', views.find_symbol, name='find_symbol'),
+    path('projects/<int:project_id>/snapshot/', views.project_snapshot, name='project_snapshot'),
+    path('projects/<int:project_id>/snapshot.zip', views.export_snapshot, name='export_snapshot'),
     path('projects/<int:project_id>/files/create/', views.create_file, name='create_file'),
+    path('projects/<int:project_id>/files/import/', views.import_files, name='import_files'),
     path('projects/<int:project_id>/files/<int:file_id>/', views.code_editor, name='code_editor'),
     path('projects/<int:project_id>/files/<int:file_id>/save/', views.save_file, name='save_file'),
     path('projects/<int:project_id>/files/<int:file_id>/history/', views.file_history, name='file_history'),
+    path('projects/<int:project_id>/files/<int:file_id>/versions/<int:version_number>/content/', views.version_content, name='version_content'),
+    path('projects/<int:project_id>/files/<int:file_id>/diff/', views.file_diff, name='file_diff'),
+    path('projects/<int:project_id>/files/<int:file_id>/blame/', views.file_blame, name='file_blame'),
+    path('projects/<int:project_id>/files/<int:file_id>/outline/', views.file_outline, name='file_outline'),
     path('projects/<int:project_id>/files/<int:file_id>/delete/', views.delete_file, name='delete_file'),
     path('projects/<int:project_id>/invite/', views.invite_member, name='invite_member'),
     path('projects/<int:project_id>/members/', views.project_members, name='project_members'),
@@ -22,4 +32,5 @@ urlpatterns = [
     path('projects/<int:project_id>/tasks/<int:task_id>/delete/', views.delete_task, name='delete_task'),
     path('projects/<int:project_id>/request/', views.request_to_join, name='request_to_join'),
     path('requests/<int:request_id>/handle/', views.handle_join_request, name='handle_join_request'),
+    path('metrics/editor/', views.editor_metrics, name='editor_metrics'),
 ]
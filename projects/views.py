@@ -1,15 +1,42 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from django.contrib.auth.models import User
-from django.http import HttpResponseForbidden, JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.http import require_POST
 from django.db.models import Q
-from .models import Project, ProjectMembership, CodeFile, FileVersion, Task, ProjectRequest
+from .models import Project, ProjectMembership, CodeFile, FileVersion, Symbol, Task, ProjectRequest, VersionConflict
 from .forms import ProjectForm, CodeFileForm, TaskForm, ProjectInviteForm
 from .utils import check_user_access
+from . import metrics
+from .rooms import file_room, get_room, room_group_name, room_stats
+from .consumers import announce_version, has_live_edits
+from .diffs import diff_lines, diff_versions
+from .export import iter_project_zip, iter_zip
+from .snapshots import iter_snapshot
+from .search import SearchError, search_project
+from .ranges import text_response
+from .conditional import conditional_response, page_etag, set_validators
+from .imports import ArchiveError, import_archive
+from .symbolindex import stale_files, symbol_indexer
+from .blameindex import blame_indexer
 import json
-from datetime import datetime
+import re
+from datetime import datetime, timezone as dt_timezone
+
+# Versions listed per history page
+HISTORY_PAGE_SIZE = 50
+# Browsers may keep a version's content this long (seconds)
+VERSION_CACHE_MAX_AGE = 365 * 24 * 3600
+# Past snapshots only change when old versions are compacted away
+SNAPSHOT_CACHE_MAX_AGE = 3600
 
 @login_required
 def project_list(request):
@@ -72,8 +99,12 @@ def create_project(request):
 def project_detail(request, project_id):
     try:
         project = Project.objects.get(id=project_id)
+        etag = page_etag(request, 'project', project.id, project.change_count, project.updated_at.isoformat())
+        response = conditional_response(request, etag, project.updated_at)
+        if response is not None:
+            return response
         is_owner = project.owner_id == request.user.id
-        is_member = project.members.filter(id=request.user.id).exists()
+        is_member = check_user_access(request.user, project)
         has_pending_request = project.requests.filter(
             requester=request.user,
             status='pending'
@@ -87,11 +118,95 @@ def project_detail(request, project_id):
             'files': list(project.code_files.all()),
             'tasks': list(project.tasks.all()),
         }
-        return render(request, 'projects/project_detail.html', context)
+        return set_validators(render(request, 'projects/project_detail.html', context), etag, project.updated_at)
     except Project.DoesNotExist:
         messages.error(request, 'Project not found.')
         return redirect('project_list')
 
+@login_required
+def search_files(request, project_id):
+    if not check_user_access(request.user, project_id):
+        return JsonResponse({'error': 'You don\'t have access to this project.'}, status=403)
+    try:
+        results, truncated = search_project(
+            project_id,
+            request.GET.get('q', ''),
+            regex=request.GET.get('regex') == '1',
+            ignore_case=request.GET.get('ignore_case') == '1'
+        )
+    except SearchError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'results': results, 'truncated': truncated})
+
+@login_required
+def export_project(request, project_id):
+    project = get_object_or_404(Project, id=project_id)
+    if not check_user_access(request.user, project):
+        return HttpResponseForbidden("You don't have access to this project.")
+    
+    response = StreamingHttpResponse(iter_project_zip(project), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="project-{project.id}.zip"'
+    return response
+
+def _snapshot_time(request):
+    """The ``at`` query parameter as an aware datetime, or None if invalid"""
+    value = request.GET.get('at', '')
+    try:
+        at = parse_datetime(value)
+        if at is None and ' ' in value:
+            # An unencoded "+02:00" offset arrives as " 02:00"
+            head, _, offset = value.rpartition(' ')
+            at = parse_datetime(f'{head}+{offset}')
+    except ValueError:
+        return None
+    if at is None:
+        return None
+    if timezone.is_naive(at):
+        at = timezone.make_aware(at, dt_timezone.utc)
+    at = at.astimezone(dt_timezone.utc)
+    return at if at <= timezone.now() else None
+
+@login_required
+def project_snapshot(request, project_id):
+    if not check_user_access(request.user, project_id):
+        return JsonResponse({'error': 'You don\'t have access to this project.'}, status=403)
+    at = _snapshot_time(request)
+    if at is None:
+        return JsonResponse({'error': 'at must be an ISO 8601 time that is not in the future.'}, status=400)
+    
+    files = [
+        {
+            'id': snapshot_file.file_id,
+            'filename': snapshot_file.filename,
+            'version': snapshot_file.version_number,
+            'created_at': snapshot_file.created_at.isoformat(),
+            'content_hash': snapshot_file.content_hash,
+            'content_url': reverse('version_content', args=[project_id, snapshot_file.file_id, snapshot_file.version_number])
+        }
+        for snapshot_file in iter_snapshot(project_id, at, with_content=False)
+    ]
+    response = JsonResponse({'at': at.isoformat(), 'files': files})
+    patch_cache_control(response, private=True, max_age=SNAPSHOT_CACHE_MAX_AGE)
+    return response
+
+@login_required
+def export_snapshot(request, project_id):
+    project = get_object_or_404(Project, id=project_id)
+    if not check_user_access(request.user, project):
+        return HttpResponseForbidden("You don't have access to this project.")
+    at = _snapshot_time(request)
+    if at is None:
+        return JsonResponse({'error': 'at must be an ISO 8601 time that is not in the future.'}, status=400)
+    
+    entries = (
+        (snapshot_file.filename, snapshot_file.content, snapshot_file.created_at)
+        for snapshot_file in iter_snapshot(project.id, at)
+    )
+    response = StreamingHttpResponse(iter_zip(project, entries), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="project-{project.id}-{at:%Y%m%dT%H%M%SZ}.zip"'
+    patch_cache_control(response, private=True, max_age=SNAPSHOT_CACHE_MAX_AGE)
+    return response
+
 @login_required
 def edit_project(request, project_id):
     try:
@@ -156,8 +271,7 @@ def create_file(request, project_id):
         project = Project.objects.get(id=project_id)
         
         # Check if user has access to the project
-        if not (project.owner_id == request.user.id or 
-                project.members.filter(id=request.user.id).exists()):
+        if not check_user_access(request.user, project):
             return HttpResponseForbidden("You don't have access to this project.")
         
         if request.method == 'POST':
@@ -189,12 +303,7 @@ def create_file(request, project_id):
                 code_file.save()
                 
                 # Create initial empty version
-                FileVersion.objects.create(
-                    content="",
-                    creator=request.user,
-                    version_number=1,
-                    code_file=code_file
-                )
+                FileVersion.objects.create_version(code_file, "", request.user)
                 
                 messages.success(request, f'File "{code_file.filename}" created successfully!')
                 return redirect('code_editor', project_id=str(project.id), file_id=str(code_file.id))
@@ -213,28 +322,86 @@ def create_file(request, project_id):
         messages.error(request, f'An error occurred while creating the file: {str(e)}')
         return redirect('project_detail', project_id=str(project_id))
 
+@login_required
+def import_files(request, project_id):
+    project = get_object_or_404(Project, id=project_id)
+    if not check_user_access(request.user, project):
+        return HttpResponseForbidden("You don't have access to this project.")
+    
+    errors = []
+    if request.method == 'POST':
+        upload = request.FILES.get('archive')
+        if upload is None:
+            errors = ['Choose a zip or tar archive to upload.']
+        else:
+            try:
+                code_files = import_archive(project, upload, request.user)
+                messages.success(request, f'Imported {len(code_files)} files.')
+                return redirect('project_detail', project_id=str(project.id))
+            except ArchiveError as e:
+                errors = e.errors
+    
+    return render(request, 'projects/import_files.html', {
+        'project': project,
+        'errors': errors
+    })
+
 @login_required
 def code_editor(request, project_id, file_id):
     try:
         project = Project.objects.get(id=project_id)
         
         # Check if user has access to the project
-        if not (project.owner_id == request.user.id or 
-                project.members.filter(id=request.user.id).exists()):
+        if not check_user_access(request.user, project):
             return HttpResponseForbidden("You don't have access to this project.")
         
-        # Get the code file
+        # The head version (with its text) is only loaded when the page is
+        # rendered; revalidation needs just head_id and updated_at
         code_file = CodeFile.objects.get(id=file_id, project=project)
         
-        # Get the latest version's content
-        latest_version = FileVersion.objects.filter(code_file=code_file).order_by('-version_number').first()
-        content = latest_version.content if latest_version else ""
-        
-        return render(request, 'projects/code_editor.html', {
+        # Serve a file that is being edited from its live room, if this
+        # process has one, so hot files never touch FileVersion
+        room = get_room(room_group_name(project.id, code_file.id))
+        rest_url = base_version = None
+        etag = last_modified = None
+        if room is not None:
+            content = room.content
+            # The room's unsaved edits are on top of this version, and an
+            # HTTP save against it is announced to the room (see save_file)
+            base_version = room.version
+        else:
+            # The page shows the head version and the project's file list, so
+            # a reload when neither changed is answered before the text is read
+            last_modified = max(code_file.updated_at, project.updated_at)
+            if code_file.head_id is not None:
+                etag = page_etag(
+                    request, 'editor', project.id, project.change_count, project.updated_at.isoformat(),
+                    code_file.head_id, code_file.updated_at.isoformat()
+                )
+            response = conditional_response(request, etag, last_modified)
+            if response is not None:
+                return response
+            latest_version = code_file.get_latest_version()
+            content = latest_version.content if latest_version else ""
+            # Saves from the page are refused if someone else saved meanwhile
+            base_version = latest_version.version_number if latest_version else None
+            # Large files render their first lines at once; the page fetches
+            # the rest of the same (immutable) version afterwards
+            if len(content) > settings.EDITOR_INLINE_MAX_CHARS:
+                lines = content.splitlines(keepends=True)
+                if len(lines) > settings.EDITOR_INITIAL_LINES:
+                    content = ''.join(lines[:settings.EDITOR_INITIAL_LINES])
+                    rest_url = reverse('version_content', args=[project.id, code_file.id, latest_version.version_number])
+                    rest_url += f'?lines={settings.EDITOR_INITIAL_LINES + 1}-'
+        
+        response = render(request, 'projects/code_editor.html', {
             'project': project,
             'code_file': code_file,
-            'content': content
+            'content': content,
+            'rest_url': rest_url,
+            'base_version': base_version
         })
+        return set_validators(response, etag, last_modified)
     except (Project.DoesNotExist, CodeFile.DoesNotExist):
         messages.error(request, 'File not found.')
         return redirect('project_detail', project_id=str(project_id))
@@ -245,28 +412,199 @@ def file_history(request, project_id, file_id):
         project = Project.objects.get(id=project_id)
         
         # Check if user has access to the project
-        if not (project.owner_id == request.user.id or 
-                any(m.user_id == request.user.id for m in project.members)):
+        if not check_user_access(request.user, project):
             return HttpResponseForbidden("You don't have access to this project.")
         
-        # Find the file in the project
-        code_file = next((f for f in project.code_files if str(f.id) == file_id), None)
-        if not code_file:
-            messages.error(request, 'File not found.')
-            return redirect('project_detail', project_id=str(project.id))
-        
-        # Get versions in reverse chronological order
-        versions = sorted(code_file.versions, key=lambda v: v.version_number, reverse=True)
+        code_file = CodeFile.objects.get(id=file_id, project=project)
+        etag = page_etag(
+            request, 'history', project.id, code_file.id, code_file.head_id,
+            code_file.updated_at.isoformat(), request.GET.get('before', '')
+        )
+        response = conditional_response(request, etag, code_file.updated_at)
+        if response is not None:
+            return response
+        
+        # Keyset pagination: a page is the versions below ``before``, newest
+        # first. Only metadata is loaded; content is fetched per version
+        versions = code_file.versions.select_related('creator').only(
+            'version_number', 'created_at', 'code_file', 'creator__username'
+        ).order_by('-version_number')
+        before = request.GET.get('before')
+        if before and before.isdigit():
+            versions = versions.filter(version_number__lt=int(before))
+        versions = list(versions[:HISTORY_PAGE_SIZE + 1])
+        next_before = None
+        if len(versions) > HISTORY_PAGE_SIZE:
+            versions = versions[:HISTORY_PAGE_SIZE]
+            next_before = versions[-1].version_number
         
         context = {
             'project': project,
             'code_file': code_file,
             'versions': versions,
+            'is_first_page': not before,
+            'next_before': next_before,
         }
-        return render(request, 'projects/file_history.html', context)
+        return set_validators(render(request, 'projects/file_history.html', context), etag, code_file.updated_at)
     except Project.DoesNotExist:
         messages.error(request, 'Project not found.')
         return redirect('project_list')
+    except CodeFile.DoesNotExist:
+        messages.error(request, 'File not found.')
+        return redirect('project_detail', project_id=str(project_id))
+
+@login_required
+def file_blame(request, project_id, file_id):
+    if not check_user_access(request.user, project_id):
+        return JsonResponse({'error': 'You don\'t have access to this project.'}, status=403)
+    versions = FileVersion.objects.filter(code_file_id=file_id, code_file__project_id=project_id)
+    try:
+        # The text is not needed, only the stored ranges
+        candidates = versions.only('version_number', 'blame')
+        if 'version' in request.GET:
+            version = candidates.get(version_number=int(request.GET['version']))
+        else:
+            version = candidates.latest('version_number')
+    except ValueError:
+        return JsonResponse({'error': 'version must be a version number.'}, status=400)
+    except FileVersion.DoesNotExist:
+        return JsonResponse({'error': 'Version not found.'}, status=404)
+    
+    if version.blame is None:
+        # Saved before blame was tracked. Filling it in replays the whole
+        # history, so it is left to the blame indexer (inline backends
+        # catch up right here)
+        blame_indexer.schedule([int(file_id)])
+        version.refresh_from_db(fields=['blame'])
+        if version.blame is None:
+            response = JsonResponse({
+                'version': version.version_number,
+                'pending': True,
+                'message': 'Blame is not available yet; try again shortly.'
+            }, status=202)
+            response['Retry-After'] = '5'
+            return response
+    
+    authors = {
+        number: (username, created_at)
+        for number, username, created_at in versions.filter(
+            version_number__in={number for _, number in version.blame}
+        ).values_list('version_number', 'creator__username', 'created_at')
+    }
+    ranges = []
+    line = 1
+    for count, number in version.blame:
+        # Versions removed by compaction have no author left to show
+        username, created_at = authors.get(number, (None, None))
+        ranges.append({
+            'start': line,
+            'count': count,
+            'version': number,
+            'author': username,
+            'created_at': created_at.isoformat() if created_at else None
+        })
+        line += count
+    return JsonResponse({'version': version.version_number, 'ranges': ranges})
+
+@login_required
+def file_outline(request, project_id, file_id):
+    if not check_user_access(request.user, project_id):
+        return JsonResponse({'error': 'You don\'t have access to this project.'}, status=403)
+    try:
+        code_file = CodeFile.objects.only('language', 'version_count', 'symbols_version').get(id=file_id, project_id=project_id)
+    except CodeFile.DoesNotExist:
+        return JsonResponse({'error': 'File not found.'}, status=404)
+    if code_file.language == 'python' and code_file.symbols_version != code_file.version_count:
+        # Left behind by a failed index; inline backends catch up right here
+        symbol_indexer.schedule([code_file.id])
+        code_file.refresh_from_db(fields=['symbols_version'])
+    
+    symbols = list(Symbol.objects.filter(code_file_id=file_id).values('name', 'qualname', 'kind', 'line', 'end_line'))
+    return JsonResponse({
+        'version': code_file.symbols_version,
+        # The newest version has not been indexed yet
+        'stale': code_file.symbols_version != code_file.version_count,
+        'symbols': symbols
+    })
+
+@login_required
+def find_symbol(request, project_id):
+    if not check_user_access(request.user, project_id):
+        return JsonResponse({'error': 'You don\'t have access to this project.'}, status=403)
+    name = request.GET.get('name', '')
+    if not name:
+        return JsonResponse({'error': 'name is required.'}, status=400)
+    
+    stale = list(stale_files().filter(project_id=project_id).values_list('id', flat=True))
+    if stale:
+        symbol_indexer.schedule(stale)
+    
+    # "Widget.render" looks up the last part and keeps the qualified names
+    # that are it or end in ".Widget.render" (not "MyWidget.render")
+    symbols = Symbol.objects.filter(project_id=project_id, name=name.rsplit('.', 1)[-1])
+    if '.' in name:
+        symbols = symbols.filter(Q(qualname=name) | Q(qualname__endswith='.' + name))
+    definitions = [
+        {
+            'file': symbol['code_file_id'],
+            'filename': symbol['code_file__filename'],
+            'qualname': symbol['qualname'],
+            'kind': symbol['kind'],
+            'line': symbol['line']
+        }
+        for symbol in symbols.order_by('code_file__filename', 'line').values(
+            'code_file_id', 'code_file__filename', 'qualname', 'kind', 'line'
+        )[:100]
+    ]
+    return JsonResponse({'definitions': definitions})
+
+@login_required
+def version_content(request, project_id, file_id, version_number):
+    # The access list is cached, so this needs no project query
+    if not check_user_access(request.user, project_id):
+        return JsonResponse({'error': 'You don\'t have access to this project.'}, status=403)
+    try:
+        version = FileVersion.objects.get(
+            code_file_id=file_id,
+            code_file__project_id=project_id,
+            version_number=version_number
+        )
+    except FileVersion.DoesNotExist:
+        return JsonResponse({'error': 'Version not found.'}, status=404)
+    
+    try:
+        response = text_response(request, version.content)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    # A version never changes once written
+    patch_cache_control(response, private=True, max_age=VERSION_CACHE_MAX_AGE, immutable=True)
+    return response
+
+@login_required
+def file_diff(request, project_id, file_id):
+    if not check_user_access(request.user, project_id):
+        return JsonResponse({'error': 'You don\'t have access to this project.'}, status=403)
+    try:
+        numbers = [int(request.GET['from']), int(request.GET['to'])]
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Both from and to version numbers are required.'}, status=400)
+    
+    versions = {
+        version.version_number: version
+        for version in FileVersion.objects.filter(
+            code_file_id=file_id,
+            code_file__project_id=project_id,
+            version_number__in=numbers
+        ).select_related('blob')
+    }
+    if any(number not in versions for number in numbers):
+        return JsonResponse({'error': 'Version not found.'}, status=404)
+    
+    diff = diff_versions(versions[numbers[0]], versions[numbers[1]])
+    response = JsonResponse({'from': numbers[0], 'to': numbers[1], **diff})
+    # Both sides are immutable, so the diff is too
+    patch_cache_control(response, private=True, max_age=VERSION_CACHE_MAX_AGE, immutable=True)
+    return response
 
 @login_required
 def delete_file(request, project_id, file_id):
@@ -274,8 +612,7 @@ def delete_file(request, project_id, file_id):
         project = Project.objects.get(id=project_id)
         
         # Check if user has access to the project
-        if not (project.owner_id == request.user.id or 
-                any(m.user_id == request.user.id for m in project.members)):
+        if not check_user_access(request.user, project):
             return HttpResponseForbidden("You don't have access to this project.")
         
         # Find and remove the file
@@ -338,8 +675,7 @@ def project_members(request, project_id):
         project = Project.objects.get(id=project_id)
         
         # Check if user has access to the project
-        if not (project.owner_id == request.user.id or 
-                project.members.filter(id=request.user.id).exists()):
+        if not check_user_access(request.user, project):
             return HttpResponseForbidden("You don't have access to this project.")
         
         context = {
@@ -383,8 +719,7 @@ def task_list(request, project_id):
         project = Project.objects.get(id=project_id)
         
         # Check if user has access to the project
-        if not (project.owner_id == request.user.id or 
-                any(m.user_id == request.user.id for m in project.members)):
+        if not check_user_access(request.user, project):
             return HttpResponseForbidden("You don't have access to this project.")
         
         context = {
@@ -402,8 +737,7 @@ def create_task(request, project_id):
         project = Project.objects.get(id=project_id)
         
         # Check if user has access to the project
-        if not (project.owner_id == request.user.id or 
-                any(m.user_id == request.user.id for m in project.members)):
+        if not check_user_access(request.user, project):
             return HttpResponseForbidden("You don't have access to this project.")
         
         if request.method == 'POST':
@@ -440,8 +774,7 @@ def task_detail(request, project_id, task_id):
         project = Project.objects.get(id=project_id)
         
         # Check if user has access to the project
-        if not (project.owner_id == request.user.id or 
-                any(m.user_id == request.user.id for m in project.members)):
+        if not check_user_access(request.user, project):
             return HttpResponseForbidden("You don't have access to this project.")
         
         # Find the task
@@ -465,8 +798,7 @@ def edit_task(request, project_id, task_id):
         project = Project.objects.get(id=project_id)
         
         # Check if user has access to the project
-        if not (project.owner_id == request.user.id or 
-                any(m.user_id == request.user.id for m in project.members)):
+        if not check_user_access(request.user, project):
             return HttpResponseForbidden("You don't have access to this project.")
         
         # Find the task
@@ -514,8 +846,7 @@ def delete_task(request, project_id, task_id):
         project = Project.objects.get(id=project_id)
         
         # Check if user has access to the project
-        if not (project.owner_id == request.user.id or 
-                any(m.user_id == request.user.id for m in project.members)):
+        if not check_user_access(request.user, project):
             return HttpResponseForbidden("You don't have access to this project.")
         
         # Find and remove the task
@@ -532,6 +863,26 @@ def delete_task(request, project_id, task_id):
         messages.error(request, 'Project not found.')
         return redirect('project_list')
 
+def _base_version(request, data):
+    """
+    The version a save was made against, from ``If-Match`` (an ETag
+    returned by an earlier save) or ``base_version``, or None if the save
+    is unconditional. Raises ValueError if either is malformed.
+    """
+    if_match = request.headers.get('If-Match', '').strip()
+    if if_match and if_match != '*':
+        etags = parse_etags(if_match)
+        if len(etags) != 1 or not re.fullmatch(r'"v\d+"', etags[0]):
+            raise ValueError('If-Match must be one ETag returned by a save.')
+        return int(etags[0][2:-1])
+    base_version = data.get('base_version')
+    if base_version is not None and (type(base_version) is not int or base_version < 1):
+        raise ValueError('base_version must be a version number.')
+    return base_version
+
+def _version_etag(version):
+    return quote_etag(f'v{version.version_number}')
+
 @login_required
 @require_POST
 def save_file(request, project_id, file_id):
@@ -539,8 +890,7 @@ def save_file(request, project_id, file_id):
         project = Project.objects.get(id=project_id)
         
         # Check if user has access to the project
-        if not (project.owner_id == request.user.id or 
-                project.members.filter(id=request.user.id).exists()):
+        if not check_user_access(request.user, project):
             return JsonResponse({'error': 'You don\'t have access to this project.'}, status=403)
         
         # Get the code file
@@ -549,27 +899,49 @@ def save_file(request, project_id, file_id):
         # Get the content from the request
         data = json.loads(request.body)
         content = data.get('content', '')
+        try:
+            base_version = _base_version(request, data)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        # The live room would have to drop its unsaved edits to take the
+        # save over, so it is refused until they are stored
+        if has_live_edits(code_file.id):
+            metrics.increment('saves.conflicts')
+            room = file_room(code_file.id)
+            return JsonResponse({
+                'error': 'This file has live edits that are not saved yet.',
+                'version_number': room.version,
+                'diff': diff_lines(content, room.content)
+            }, status=409)
+
+        # A new version, stored as a delta against the latest one, unless
+        # nothing changed; stale saves are refused with what changed since
+        try:
+            version, created = FileVersion.objects.save_content(code_file, content, request.user, base_version)
+        except VersionConflict as e:
+            metrics.increment('saves.conflicts')
+            response = JsonResponse({
+                'error': str(e),
+                'version_number': e.head.version_number,
+                'diff': diff_lines(content, e.head.content)
+            }, status=409)
+            response['ETag'] = _version_etag(e.head)
+            return response
+        if created:
+            # A live room adopts the version instead of checkpointing over it
+            announce_version(project.id, code_file.id, version.version_number, request.user)
+        else:
+            metrics.increment('saves.unchanged')
         
-        # Get the latest version number
-        latest_version = FileVersion.objects.filter(code_file=code_file).order_by('-version_number').first()
-        new_version_number = (latest_version.version_number + 1) if latest_version else 1
-        
-        # Create new version
-        FileVersion.objects.create(
-            content=content,
-            creator=request.user,
-            version_number=new_version_number,
-            code_file=code_file
-        )
-        
-        # Update file's updated_at timestamp
-        code_file.updated_at = datetime.utcnow()
-        code_file.save()
-        
-        return JsonResponse({
+        # create_version also moves the file's head and updated_at
+        response = JsonResponse({
             'success': True,
-            'version_number': new_version_number
+            'version_number': version.version_number,
+            'changed': created
         })
+        response['ETag'] = _version_etag(version)
+        return response
     except (Project.DoesNotExist, CodeFile.DoesNotExist):
         return JsonResponse({'error': 'File not found.'}, status=404)
     except Exception as e:
@@ -586,7 +958,7 @@ def request_to_join(request, project_id):
             return JsonResponse({'error': 'This project is not public'}, status=403)
         
         # Check if user is already a member or owner
-        if project.owner_id == request.user.id or any(m.user_id == request.user.id for m in project.members):
+        if check_user_access(request.user, project):
             return JsonResponse({'error': 'You are already a member of this project'}, status=400)
         
         # Check if user already has a pending request
@@ -643,3 +1015,9 @@ def handle_join_request(request, request_id):
         return JsonResponse({'success': True})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+
+@staff_member_required
+def editor_metrics(request):
+    """Collaboration metrics for this worker process"""
+    return JsonResponse(dict(metrics.snapshot(), rooms=room_stats()))
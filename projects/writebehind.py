@@ -0,0 +1,176 @@
+"""
+Write-behind buffer for editor saves.
+
+Collaborative edits arrive much faster than we want to create FileVersion
+rows. The buffer keeps only the latest content per file and writes it once
+the file has been idle for a short while, or once the oldest unsaved change
+reaches the maximum window, whichever comes first.
+
+Each write carries the version its content was based on. A file's entry
+stays pending until its write has finished, and content submitted while
+the write was running stays pending after it, based on what was stored.
+A write that fails leaves the entry pending and is retried with backoff.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field, replace
+
+from channels.db import database_sync_to_async
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingWrite:
+    file_id: int
+    content: str
+    creator: object
+    first_at: float
+    updates: int = 1
+    base_version: int = None
+    failures: int = 0
+    retry_at: float = 0
+    timer: asyncio.TimerHandle = field(default=None, repr=False)
+
+
+class WriteBehindBuffer:
+    def __init__(self, write, window, idle, written=None, max_retry_delay=60):
+        """
+        ``write(file_id, content, creator, base_version)`` is a synchronous
+        function that persists one version and returns its number, or None
+        if nothing was stored. ``written(file_id, version_number)`` is then
+        called on the event loop. ``window`` bounds how long a change may
+        stay unsaved and ``idle`` is how long a file must be quiet before
+        saving. A failed write is retried after ``idle`` seconds, doubling
+        up to ``max_retry_delay``.
+        """
+        self.write = write
+        self.window = window
+        self.idle = idle
+        self.written = written
+        self.max_retry_delay = max_retry_delay
+        self._pending = {}
+        self._locks = {}
+        # Flushes holding or waiting for each file's lock
+        self._lock_users = {}
+        self._tasks = set()
+
+    def submit(self, file_id, content, creator, base_version=None):
+        """Record the latest content of a file; replaces any unsaved content."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (e.g. during shutdown): keep it for flush_all_sync
+            loop = None
+        now = loop.time() if loop is not None else 0
+        pending = self._pending.get(file_id)
+        if pending is None:
+            pending = PendingWrite(file_id, content, creator, first_at=now, base_version=base_version)
+            self._pending[file_id] = pending
+        else:
+            pending.content = content
+            pending.creator = creator
+            pending.base_version = base_version
+            pending.updates += 1
+            if pending.timer is not None:
+                pending.timer.cancel()
+
+        if loop is None:
+            return
+        delay = min(pending.first_at + self.window, now + self.idle) - now
+        # New edits do not bring a retry forward
+        delay = max(delay, pending.retry_at - now)
+        pending.timer = loop.call_later(max(delay, 0), self._schedule_flush, file_id)
+
+    def has_pending(self, file_id):
+        """Whether content of the file is waiting to be written"""
+        return file_id in self._pending
+
+    def _schedule_flush(self, file_id):
+        task = asyncio.ensure_future(self.flush(file_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, file_id):
+        """Write the pending content of one file now, if there is any."""
+        lock = self._locks.setdefault(file_id, asyncio.Lock())
+        self._lock_users[file_id] = self._lock_users.get(file_id, 0) + 1
+        try:
+            async with lock:
+                await self._flush(file_id)
+        finally:
+            # Only dropped once no other flush is waiting for it
+            self._lock_users[file_id] -= 1
+            if not self._lock_users[file_id]:
+                del self._lock_users[file_id]
+                del self._locks[file_id]
+
+    async def _flush(self, file_id):
+        pending = self._pending.get(file_id)
+        if pending is None:
+            return
+        if pending.timer is not None:
+            pending.timer.cancel()
+        # Written from a copy, as submit updates the entry in place
+        written = replace(pending, timer=None)
+        try:
+            version_number = await database_sync_to_async(self._write)(written)
+        except Exception:
+            if self._pending.get(file_id) is pending:
+                self._retry_later(pending)
+            return
+        if self._pending.get(file_id) is pending and pending.updates == written.updates:
+            del self._pending[file_id]
+        else:
+            # Submitted during the write: left pending (submit set its
+            # timer again), on top of what was just stored
+            pending.updates -= written.updates
+            pending.failures, pending.retry_at = 0, 0
+            if version_number is not None and pending.base_version == written.base_version:
+                pending.base_version = version_number
+        if version_number is not None and self.written is not None:
+            self.written(file_id, version_number)
+
+    def _retry_later(self, pending):
+        loop = asyncio.get_running_loop()
+        pending.failures += 1
+        delay = min(self.idle * 2 ** (pending.failures - 1), self.max_retry_delay)
+        pending.retry_at = loop.time() + delay
+        if pending.timer is not None:
+            pending.timer.cancel()
+        pending.timer = loop.call_later(delay, self._schedule_flush, pending.file_id)
+        logger.warning(f"Will retry saving file {pending.file_id} in {delay:g}s (attempt {pending.failures + 1})")
+
+    async def flush_all(self):
+        for file_id in list(self._pending):
+            await self.flush(file_id)
+
+    def flush_all_sync(self):
+        """Write everything still pending; used when the worker shuts down."""
+        while self._pending:
+            _, pending = self._pending.popitem()
+            if pending.timer is not None:
+                pending.timer.cancel()
+            try:
+                self._write(pending)
+            except Exception:
+                # Already logged, and nothing is left to retry it
+                pass
+
+    def _write(self, pending):
+        """Store one entry and return the version number; raises if it failed."""
+        started = time.monotonic()
+        try:
+            version_number = self.write(pending.file_id, pending.content, pending.creator, pending.base_version)
+        except Exception as e:
+            metrics.increment('editor.save.errors')
+            logger.error(f"Error flushing file {pending.file_id}: {str(e)}", exc_info=True)
+            raise
+        metrics.observe('editor.save.flush_latency', time.monotonic() - started)
+        metrics.increment('editor.save.flushes')
+        metrics.increment('editor.save.coalesced_updates', pending.updates - 1)
+        logger.info(f"Flushed file {pending.file_id} ({pending.updates} updates coalesced into one version)")
+        return version_number
@@ -3,6 +3,17 @@ let editor;
 let socket;
 let isEditorReady = false;
 let lastSentContent = '';
+// Collaboration state: the last server revision applied locally, the edit
+// waiting for an ack and the local edits made while waiting for it
+let revision = 0;
+let outstanding = null;
+let outstandingSocket = null;
+let buffer = null;
+let applyingRemote = false;
+// Identifies this tab and the room incarnation so a reconnect can resume
+// from the last revision instead of reloading the whole document
+const clientId = Math.random().toString(36).slice(2, 10);
+let roomEpoch = null;
 let reconnectAttempts = 0;
 const maxReconnectAttempts = 5;
 const reconnectDelay = 3000;
@@ -65,7 +76,9 @@ function initializeEditor() {
     });
 
     // Set up editor event listeners
-    editor.onDidChangeModelContent(() => {
+    editor.onDidChangeModelContent((e) => {
+        if (applyingRemote) return;
+        
         if (!isTyping) {
             isTyping = true;
             showInfoNotification('You are now typing...');
@@ -74,20 +87,27 @@ function initializeEditor() {
         clearTimeout(typingTimeout);
         typingTimeout = setTimeout(() => {
             isTyping = false;
-            sendCodeChanges();
         }, 1000);
+        
+        const model = editor.getModel();
+        let lengthBefore = model.getValueLength();
+        for (const change of e.changes) {
+            lengthBefore += change.rangeLength - change.text.length;
+        }
+        queueOperation(OT.fromMonacoChanges(e.changes, lengthBefore));
     });
 
     editor.onDidChangeCursorPosition((e) => {
         if (socket && socket.readyState === WebSocket.OPEN) {
             const position = editor.getPosition();
-            socket.send(JSON.stringify({
+            sendMessage({
                 type: 'cursor_update',
+                file: Number(fileId),
                 position: {
                     lineNumber: position.lineNumber,
                     column: position.column
                 }
-            }));
+            });
         }
     });
 
@@ -105,7 +125,9 @@ function initializeEditor() {
 function initializeWebSocket() {
     // Set up the WebSocket connection
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${window.location.host}/ws/projects/${projectId}/files/${fileId}/`;
+    // One socket per project; open files are subscribed to over it
+    const params = new URLSearchParams({ client: clientId });
+    const wsUrl = `${protocol}//${window.location.host}/ws/projects/${projectId}/?${params}`;
     
     console.log('WebSocket Connection Details:');
     console.log('Protocol:', protocol);
@@ -116,7 +138,12 @@ function initializeWebSocket() {
     console.log('User Authentication Status:', document.cookie.includes('sessionid') ? 'Authenticated' : 'Not Authenticated');
     
     try {
-        socket = new WebSocket(wsUrl);
+        // Prefer compact binary frames when the MessagePack library loaded
+        const subprotocols = window.MessagePack
+            ? ['codecollab.msgpack', 'codecollab.json']
+            : ['codecollab.json'];
+        socket = new WebSocket(wsUrl, subprotocols);
+        socket.binaryType = 'arraybuffer';
         
         // Set a connection timeout
         const connectionTimeout = setTimeout(() => {
@@ -132,16 +159,14 @@ function initializeWebSocket() {
             showSuccessNotification('Connected to collaboration server');
             
             reconnectAttempts = 0;
-            // Send any pending changes
-            if (isEditorReady && editor.getValue() !== lastSentContent) {
-                sendCodeChanges();
-            }
+            subscribe();
         };
         
         socket.onmessage = (event) => {
-            console.log('Received WebSocket message:', event.data);
             try {
-                const data = JSON.parse(event.data);
+                const data = typeof event.data === 'string'
+                    ? JSON.parse(event.data)
+                    : MessagePack.decode(new Uint8Array(event.data));
                 handleWebSocketMessage(data);
             } catch (error) {
                 console.error('Error parsing WebSocket message:', error);
@@ -151,12 +176,6 @@ function initializeWebSocket() {
         socket.onclose = (event) => {
             console.log('WebSocket connection closed:', event.code, event.reason);
             
-            // Auto-save when connection is lost
-            if (isEditorReady && editor.getValue() !== lastSentContent) {
-                console.log('Auto-saving content after connection loss...');
-                saveContent(editor.getValue());
-            }
-            
             let errorMessage = 'Connection lost. ';
             switch (event.code) {
                 case 4001:
@@ -186,6 +205,12 @@ function initializeWebSocket() {
                 console.error('Maximum reconnection attempts reached. Please refresh the page.');
                 showErrorNotification(errorMessage);
                 
+                // Unsent edits can no longer be caught up, so save them directly
+                if (isEditorReady && (outstanding || buffer)) {
+                    console.log('Auto-saving content after connection loss...');
+                    saveContent(editor.getValue());
+                }
+                
                 // Add connection error message to editor
                 if (isEditorReady) {
                     const errorMsg = document.createElement('div');
@@ -220,14 +245,37 @@ function initializeWebSocket() {
     }
 }
 
+// Subscribe to the open file, resuming from the last revision we saw
+function subscribe() {
+    const message = { type: 'subscribe', file: Number(fileId) };
+    if (roomEpoch) {
+        message.epoch = roomEpoch;
+        message.revision = revision;
+    }
+    sendMessage(message);
+}
+
 // Handle WebSocket messages
 function handleWebSocketMessage(data) {
+    // The socket is shared by the project; ignore other files' frames
+    if (data.file !== undefined && String(data.file) !== String(fileId)) {
+        return;
+    }
     switch (data.type) {
-        case 'code_update':
-            handleCodeUpdate(data);
+        case 'snapshot':
+            handleSnapshot(data);
+            break;
+        case 'catchup':
+            handleCatchup(data);
             break;
-        case 'cursor_update':
-            handleCursorUpdate(data);
+        case 'operation':
+            handleRemoteOperation(data);
+            break;
+        case 'ack':
+            handleAck(data);
+            break;
+        case 'presence':
+            handlePresence(data);
             break;
         case 'user_joined':
             handleUserJoined(data);
@@ -243,28 +291,85 @@ function handleWebSocketMessage(data) {
     }
 }
 
-// Handle code updates from other users
-function handleCodeUpdate(data) {
-    if (!isEditorReady || data.user === getCurrentUsername()) return;
+// Replace the document with the server's copy and reset pending edits
+function handleSnapshot(data) {
+    if (!isEditorReady) return;
     
     const currentPosition = editor.getPosition();
     const currentScroll = editor.getScrollPosition();
     
+    applyingRemote = true;
     editor.setValue(data.content);
+    applyingRemote = false;
     
-    // Restore cursor position and scroll
     editor.setPosition(currentPosition);
     editor.setScrollPosition(currentScroll);
     
+    revision = data.revision;
+    roomEpoch = data.epoch;
+    outstanding = null;
+    buffer = null;
     lastSentContent = data.content;
 }
 
-// Handle cursor updates from other users
-function handleCursorUpdate(data) {
-    if (!isEditorReady || data.user === getCurrentUsername()) return;
+// Replay the updates missed while disconnected, then resend our own edit if
+// the server never received it
+function handleCatchup(data) {
+    for (const update of data.updates) {
+        if (update.own) {
+            handleAck(update);
+        } else {
+            handleRemoteOperation(update);
+        }
+    }
+    if (outstanding && outstandingSocket !== socket) {
+        sendOperation(outstanding);
+    }
+}
+
+// Apply an edit made by another user, transforming our unacknowledged edits
+function handleRemoteOperation(data) {
+    // Updates already included in a snapshot or catch-up can arrive late
+    if (!isEditorReady || data.revision <= revision) return;
     
-    const position = data.position;
-    updateRemoteCursor(data.user, position);
+    let operation = data.operation;
+    if (outstanding) {
+        [outstanding, operation] = OT.transform(outstanding, operation);
+    }
+    if (buffer) {
+        [buffer, operation] = OT.transform(buffer, operation);
+    }
+    revision = data.revision;
+    
+    const model = editor.getModel();
+    applyingRemote = true;
+    model.pushEditOperations([], OT.toMonacoEdits(operation, model), () => null);
+    applyingRemote = false;
+}
+
+// Our outstanding edit was accepted; send whatever was typed meanwhile
+function handleAck(data) {
+    if (data.revision <= revision) return;
+    revision = data.revision;
+    outstanding = buffer;
+    buffer = null;
+    if (outstanding) {
+        sendOperation(outstanding);
+    } else {
+        lastSentContent = editor.getValue();
+    }
+}
+
+// Handle a batch of cursor positions from other users
+function handlePresence(data) {
+    if (!isEditorReady) return;
+    
+    const currentUsername = getCurrentUsername();
+    for (const [username, position] of Object.entries(data.cursors)) {
+        if (username !== currentUsername) {
+            updateRemoteCursor(username, position);
+        }
+    }
 }
 
 // Update remote cursor position
@@ -323,26 +428,39 @@ function handleUserLeft(data) {
     removeRemoteCursor(data.username);
 }
 
-// Send code changes to server
-function sendCodeChanges() {
-    if (!isEditorReady || !socket || socket.readyState !== WebSocket.OPEN) {
-        console.log('Cannot send code changes: Editor not ready or socket not connected');
+// Queue a local edit; only one edit is in flight at a time
+function queueOperation(operation) {
+    if (outstanding) {
+        buffer = buffer ? OT.compose(buffer, operation) : operation;
         return;
     }
-    
-    const content = editor.getValue();
-    if (content === lastSentContent) {
-        console.log('No changes to send');
+    outstanding = operation;
+    sendOperation(operation);
+}
+
+// Send an edit to the server tagged with the revision it was made against
+function sendOperation(operation) {
+    if (!socket || socket.readyState !== WebSocket.OPEN) {
+        console.log('Cannot send operation: socket not connected');
         return;
     }
     
-    console.log('Sending code changes...');
-    socket.send(JSON.stringify({
-        type: 'code_update',
-        content: content
-    }));
-    
-    lastSentContent = content;
+    sendMessage({
+        type: 'operation',
+        file: Number(fileId),
+        revision: revision,
+        operation: operation
+    });
+    outstandingSocket = socket;
+}
+
+// Encode a message with the codec negotiated for the socket
+function sendMessage(message) {
+    if (socket.protocol === 'codecollab.msgpack') {
+        socket.send(MessagePack.encode(message));
+    } else {
+        socket.send(JSON.stringify(message));
+    }
 }
 
 // Get current username from meta tag
@@ -0,0 +1,183 @@
+// Operational transformation helpers shared with projects/ot.py.
+//
+// An operation is an array walking the whole document from left to right:
+// a positive number retains characters, a string inserts text and a
+// negative number deletes characters. Lengths are UTF-16 code units, which
+// is what JavaScript strings and Monaco offsets use.
+const OT = (function () {
+    function isRetain(c) { return typeof c === 'number' && c > 0; }
+    function isDelete(c) { return typeof c === 'number' && c < 0; }
+    function isInsert(c) { return typeof c === 'string'; }
+
+    function retain(op, n) {
+        if (n <= 0) return;
+        if (op.length && isRetain(op[op.length - 1])) {
+            op[op.length - 1] += n;
+        } else {
+            op.push(n);
+        }
+    }
+
+    function insert(op, text) {
+        if (!text) return;
+        const last = op.length - 1;
+        if (op.length && isInsert(op[last])) {
+            op[last] += text;
+        } else if (op.length && isDelete(op[last])) {
+            // Keep inserts in front of deletes, like the server does
+            if (op.length > 1 && isInsert(op[last - 1])) {
+                op[last - 1] += text;
+            } else {
+                op.splice(last, 0, text);
+            }
+        } else {
+            op.push(text);
+        }
+    }
+
+    function del(op, n) {
+        if (n <= 0) return;
+        if (op.length && isDelete(op[op.length - 1])) {
+            op[op.length - 1] -= n;
+        } else {
+            op.push(-n);
+        }
+    }
+
+    function shrink(c, n) {
+        return c > 0 ? c - n : c + n;
+    }
+
+    // Returns [a', b'] so that apply(apply(doc, a), b') == apply(apply(doc, b), a').
+    function transform(a, b) {
+        const aPrime = [];
+        const bPrime = [];
+        let i = 0, j = 0;
+        let ca = a[i++], cb = b[j++];
+        while (ca !== undefined || cb !== undefined) {
+            if (ca !== undefined && isInsert(ca)) {
+                insert(aPrime, ca);
+                retain(bPrime, ca.length);
+                ca = a[i++];
+                continue;
+            }
+            if (cb !== undefined && isInsert(cb)) {
+                retain(aPrime, cb.length);
+                insert(bPrime, cb);
+                cb = b[j++];
+                continue;
+            }
+            if (ca === undefined || cb === undefined) {
+                throw new Error('Operations have different lengths');
+            }
+            const step = Math.min(Math.abs(ca), Math.abs(cb));
+            if (isRetain(ca) && isRetain(cb)) {
+                retain(aPrime, step);
+                retain(bPrime, step);
+            } else if (isDelete(ca) && isRetain(cb)) {
+                del(aPrime, step);
+            } else if (isRetain(ca) && isDelete(cb)) {
+                del(bPrime, step);
+            }
+            ca = Math.abs(ca) > step ? shrink(ca, step) : a[i++];
+            cb = Math.abs(cb) > step ? shrink(cb, step) : b[j++];
+        }
+        return [aPrime, bPrime];
+    }
+
+    // Returns a single operation with the effect of a followed by b.
+    function compose(a, b) {
+        const result = [];
+        let i = 0, j = 0;
+        let ca = a[i++], cb = b[j++];
+        while (ca !== undefined || cb !== undefined) {
+            if (ca !== undefined && isDelete(ca)) {
+                del(result, -ca);
+                ca = a[i++];
+                continue;
+            }
+            if (cb !== undefined && isInsert(cb)) {
+                insert(result, cb);
+                cb = b[j++];
+                continue;
+            }
+            if (ca === undefined || cb === undefined) {
+                throw new Error('Operations cannot be composed');
+            }
+            if (isRetain(ca) && isRetain(cb)) {
+                const step = Math.min(ca, cb);
+                retain(result, step);
+                ca = ca > step ? ca - step : a[i++];
+                cb = cb > step ? cb - step : b[j++];
+            } else if (isRetain(ca) && isDelete(cb)) {
+                const step = Math.min(ca, -cb);
+                del(result, step);
+                ca = ca > step ? ca - step : a[i++];
+                cb = -cb > step ? cb + step : b[j++];
+            } else if (isInsert(ca) && isRetain(cb)) {
+                const step = Math.min(ca.length, cb);
+                insert(result, ca.slice(0, step));
+                ca = ca.length > step ? ca.slice(step) : a[i++];
+                cb = cb > step ? cb - step : b[j++];
+            } else {
+                // Insert followed by delete: the text never existed
+                const step = Math.min(ca.length, -cb);
+                ca = ca.length > step ? ca.slice(step) : a[i++];
+                cb = -cb > step ? cb + step : b[j++];
+            }
+        }
+        return result;
+    }
+
+    // Build one operation from the changes of a Monaco content change event.
+    // All change ranges refer to the document before the event.
+    function fromMonacoChanges(changes, lengthBefore) {
+        const sorted = changes.slice().sort((x, y) => x.rangeOffset - y.rangeOffset);
+        const op = [];
+        let index = 0;
+        for (const change of sorted) {
+            retain(op, change.rangeOffset - index);
+            insert(op, change.text);
+            del(op, change.rangeLength);
+            index = change.rangeOffset + change.rangeLength;
+        }
+        retain(op, lengthBefore - index);
+        return op;
+    }
+
+    // Convert an operation into Monaco edits against the current model.
+    function toMonacoEdits(op, model) {
+        const edits = [];
+        let index = 0;
+        let pending = null;
+        const flush = () => {
+            if (!pending) return;
+            const start = model.getPositionAt(pending.start);
+            const end = model.getPositionAt(pending.end);
+            edits.push({
+                range: new monaco.Range(start.lineNumber, start.column, end.lineNumber, end.column),
+                text: pending.text,
+                forceMoveMarkers: true
+            });
+            pending = null;
+        };
+        for (const c of op) {
+            if (isRetain(c)) {
+                flush();
+                index += c;
+                continue;
+            }
+            if (!pending) pending = { start: index, end: index, text: '' };
+            if (isInsert(c)) {
+                pending.text += c;
+            } else {
+                pending.end -= c;
+                index -= c;
+            }
+        }
+        flush();
+        return edits;
+    }
+
+    return { transform, compose, fromMonacoChanges, toMonacoEdits };
+})();